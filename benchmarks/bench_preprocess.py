@@ -0,0 +1,88 @@
+import os
+import io
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.preprocess import parse_xml_file, parse_xml_streaming
+
+DEFAULT_XML_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'patients_ehr')
+
+def scale_xml_file(xml_file_path, scale, output_dir):
+    """Write a larger copy of a CCDA file by repeating its structuredBody components.
+
+    Args:
+        xml_file_path (str): Path of the source XML file.
+        scale (int): Number of copies of the body components.
+        output_dir (str): Directory for the scaled file.
+
+    Returns:
+        str: Path of the scaled file.
+    """
+    with open(xml_file_path, 'r') as f:
+        text = f.read()
+
+    start = text.index('<structuredBody>') + len('<structuredBody>')
+    end = text.index('</structuredBody>')
+    scaled_text = text[:start] + text[start:end] * scale + text[end:]
+
+    scaled_path = os.path.join(output_dir, os.path.basename(xml_file_path))
+    with open(scaled_path, 'w') as f:
+        f.write(scaled_text)
+    return scaled_path
+
+def measure(parse, xml_files, repeat):
+    """Time a parser over a list of files and record its peak traced memory.
+
+    Args:
+        parse (callable): parse_xml_file or parse_xml_streaming.
+        xml_files (list): Paths of the XML files to parse.
+        repeat (int): Number of passes over the files.
+
+    Returns:
+        tuple: (seconds per file, peak memory in MiB, parsed results of the last pass).
+    """
+    results = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    # extract_section_data prints one line per section
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            results = [parse(xml_file) for xml_file in xml_files]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / (repeat * len(xml_files)), peak / (1024 * 1024), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the DOM and streaming CCDA parsers.")
+    parser.add_argument('--xml-dir', default=DEFAULT_XML_DIR, help="Directory of CCDA XML files.")
+    parser.add_argument('--scale', type=int, default=1, help="Repeat the body of each file this many times.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of passes over the files.")
+    args = parser.parse_args()
+
+    xml_files = sorted(
+        os.path.join(args.xml_dir, file_name) for file_name in os.listdir(args.xml_dir) if file_name.endswith('.xml')
+    )
+
+    with tempfile.TemporaryDirectory() as scaled_dir:
+        if args.scale > 1:
+            xml_files = [scale_xml_file(xml_file, args.scale, scaled_dir) for xml_file in xml_files]
+        size_mib = sum(os.path.getsize(xml_file) for xml_file in xml_files) / (1024 * 1024)
+        print(f"{len(xml_files)} files, {size_mib:.1f} MiB total, {args.repeat} passes")
+
+        dom_time, dom_peak, dom_results = measure(parse_xml_file, xml_files, args.repeat)
+        stream_time, stream_peak, stream_results = measure(parse_xml_streaming, xml_files, args.repeat)
+
+    print(f"{'parser':<12}{'ms/file':>10}{'peak MiB':>12}")
+    print(f"{'dom':<12}{dom_time * 1000:>10.2f}{dom_peak:>12.2f}")
+    print(f"{'streaming':<12}{stream_time * 1000:>10.2f}{stream_peak:>12.2f}")
+    print(f"Identical output: {dom_results == stream_results}")
+
+if __name__ == "__main__":
+    main()
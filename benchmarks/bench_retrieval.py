@@ -0,0 +1,61 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.model import load_patients, load_trials
+from src.ai.prefilter import prefilter_pairs
+from src.ai.retrieval import TrialIndex, load_brief_summaries, retrieve_candidates
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+def load_matches(output_dir):
+    """Eligible (patient_id, trial_id) pairs found by the full cross product."""
+    matches = set()
+    for file_name in os.listdir(output_dir):
+        if file_name.endswith('_eligibility.json'):
+            with open(os.path.join(output_dir, file_name)) as f:
+                for trial in json.load(f)["eligibleTrials"]:
+                    matches.add((file_name.split('_')[0], trial["trialId"]))
+    return matches
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall of the retrieval stage against the full cross product.")
+    parser.add_argument('--patients', default=os.path.join(DATA_DIR, 'processed', 'patients_small'))
+    parser.add_argument('--trials', default=os.path.join(DATA_DIR, 'raw', 'scraped_small'))
+    parser.add_argument('--outputs', default=os.path.join(DATA_DIR, 'outputs_small'),
+                        help="Eligibility files produced by matching every patient with every trial.")
+    parser.add_argument('--csv', default=os.path.join(DATA_DIR, 'raw', 'study-links.csv'))
+    parser.add_argument('--top-k', type=int, nargs='+', default=[1, 3, 5, 10, 15, 20])
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients = load_patients(args.patients)
+        trials = load_trials(args.trials)
+        start = time.perf_counter()
+        index = TrialIndex()
+        index.update(trials, load_brief_summaries(args.csv))
+        build_seconds = time.perf_counter() - start
+    eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+    matches = load_matches(args.outputs)
+
+    print(f"{len(patients)} patients x {len(trials)} trials, {len(matches)} eligible pairs in the full cross product")
+    print(f"Index built in {build_seconds * 1000:.0f} ms ({len(index.postings)} terms)")
+    print(f"{'top-k':>6}{'pairs kept':>12}{'with prefilter':>16}{'recall':>8}{'ms/patient':>12}")
+    for top_k in args.top_k:
+        start = time.perf_counter()
+        candidates = retrieve_candidates(index, patients, trials, top_k)
+        query_ms = (time.perf_counter() - start) * 1000 / len(patients)
+        kept = candidates & eligible_pairs
+        kept_pairs = {(patient_id, trial["trialId"]) for i, (patient_id, _) in enumerate(patients)
+                      for j, trial in enumerate(trials) if kept[i, j]}
+        recall = len(matches & kept_pairs) / len(matches) if matches else 1.0
+        print(f"{top_k:>6}{int(candidates.sum()):>12}{int(kept.sum()):>16}{recall:>8.2f}{query_ms:>12.2f}")
+
+if __name__ == "__main__":
+    main()
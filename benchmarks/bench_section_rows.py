@@ -0,0 +1,100 @@
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+import xml.etree.ElementTree as ET
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.preprocess import ns, extract_section_data, calculate_duration, calculate_last_usage
+
+def legacy_extract_section_data(section_title, section, patient_data):
+    """Reference copy of the previous row extractor, which resolved every td path twice."""
+    data_key = section_title
+    if data_key not in patient_data:
+        patient_data[data_key] = []
+
+    for row in section.findall('.//hl7:tbody/hl7:tr', ns):
+        if section_title == 'Medications':
+            start_date = row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None
+            stop_date = row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None
+            description = row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None
+            info = {
+                'Start': start_date,
+                'Stop': stop_date,
+                'Description': description,
+                'Duration of Usage': calculate_duration(start_date, stop_date),
+                'Last Usage': calculate_last_usage(stop_date)
+            }
+        elif section_title == 'Vital Signs':
+            info = {
+                'Start': row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None,
+                'Stop': row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None,
+                'Description': row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None,
+                'Value': row.find('hl7:td[5]', ns).text if row.find('hl7:td[5]', ns) is not None else None
+            }
+        else:
+            start_date = row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None
+            stop_date = row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None
+            description = row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None
+            info = {
+                'Start': start_date,
+                'Stop': stop_date,
+                'Description': description,
+                'Duration': calculate_duration(start_date, stop_date),
+                'Last': calculate_last_usage(stop_date)
+            }
+        patient_data[data_key].append(info)
+
+def build_section(section_title, row_count):
+    """Build a section element with row_count table rows of five cells.
+
+    Args:
+        section_title (str): The title of the section.
+        row_count (int): Number of rows in the table body.
+
+    Returns:
+        Element: The section element.
+    """
+    hl7 = ns['hl7']
+    section = ET.Element(f"{{{hl7}}}section")
+    ET.SubElement(section, f"{{{hl7}}}title").text = section_title
+    tbody = ET.SubElement(ET.SubElement(section, f"{{{hl7}}}table"), f"{{{hl7}}}tbody")
+    for index in range(row_count):
+        row = ET.SubElement(tbody, f"{{{hl7}}}tr")
+        day = index % 28 + 1
+        cells = [f"2020-01-{day:02d}T00:00:00Z", f"2020-02-{day:02d}T00:00:00Z", f"Entry {index}", "code", f"{index} mg"]
+        for text in cells:
+            ET.SubElement(row, f"{{{hl7}}}td").text = text
+    return section
+
+def time_extractor(extract, section_title, section, repeat):
+    """Return the best time per row in microseconds and the extracted rows."""
+    row_count = len(section.findall('.//hl7:tbody/hl7:tr', ns))
+    best = float('inf')
+    for _ in range(repeat):
+        patient_data = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            extract(section_title, section, patient_data)
+            best = min(best, time.perf_counter() - start)
+    return best / row_count * 1e6, patient_data
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row micro-benchmark of the section extractor.")
+    parser.add_argument('--rows', type=int, default=5000, help="Rows per synthetic section.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing repetitions (best is kept).")
+    args = parser.parse_args()
+
+    print(f"{'section':<14}{'legacy us/row':>15}{'schema us/row':>15}{'speedup':>10}{'identical':>11}")
+    for section_title in ('Medications', 'Vital Signs', 'Problems'):
+        section = build_section(section_title, args.rows)
+        legacy_time, legacy_rows = time_extractor(legacy_extract_section_data, section_title, section, args.repeat)
+        schema_time, schema_rows = time_extractor(extract_section_data, section_title, section, args.repeat)
+        print(f"{section_title:<14}{legacy_time:>15.2f}{schema_time:>15.2f}"
+              f"{legacy_time / schema_time:>9.1f}x{str(legacy_rows == schema_rows):>11}")
+
+if __name__ == "__main__":
+    main()
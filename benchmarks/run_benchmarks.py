@@ -0,0 +1,270 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import numpy as np
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.fake_llm import FakeChatModel
+from src.ai.prefilter import prefilter_pairs
+from src.ai.preprocess import process_xml_files, parse_xml_file
+from src.ai.results import ResultSink, read_eligibility_file
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+DEFAULT_XML_DIR = os.path.join(DATA_DIR, 'raw', 'patients_ehr')
+DEFAULT_TRIAL_DIR = os.path.join(DATA_DIR, 'raw', 'scraped_small')
+
+def synthesize_patients(xml_dir, count, output_dir):
+    """Write count CCDA files by replicating the sample files under new patient IDs.
+
+    Args:
+        xml_dir (str): Directory of the sample XML files.
+        count (int): Number of patients to write.
+        output_dir (str): Directory for the synthetic files.
+    """
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for file_name in sorted(f for f in os.listdir(xml_dir) if f.endswith('.xml')):
+            path = os.path.join(xml_dir, file_name)
+            with open(path) as f:
+                samples.append((parse_xml_file(path)["Patient ID"], f.read()))
+
+    os.makedirs(output_dir, exist_ok=True)
+    for index in range(count):
+        patient_id, text = samples[index % len(samples)]
+        new_id = str(uuid.uuid5(uuid.NAMESPACE_OID, f"{patient_id}-{index}"))
+        with open(os.path.join(output_dir, f"patient_{index:06d}.xml"), 'w') as f:
+            f.write(text.replace(patient_id, new_id))
+
+def synthesize_trials(trial_dir, count, output_dir):
+    """Write count criteria files by replicating the sample trials under new NCT numbers.
+
+    Args:
+        trial_dir (str): Directory of the sample criteria files.
+        count (int): Number of trials to write.
+        output_dir (str): Directory for the synthetic files.
+    """
+    samples = []
+    for file_name in sorted(f for f in os.listdir(trial_dir) if f.endswith('_criteria.txt')):
+        with open(os.path.join(trial_dir, file_name)) as f:
+            samples.append(f.read())
+
+    os.makedirs(output_dir, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(output_dir, f"NCT9{index:07d}_criteria.txt"), 'w') as f:
+            f.write(samples[index % len(samples)])
+
+def peak_rss_mib():
+    """Peak resident set size of this process or of its largest finished child, in MiB."""
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / divisor
+
+def latency_summary(seconds):
+    """p50, p95 and mean of a list of durations in seconds."""
+    if not seconds:
+        return {"p50": None, "p95": None, "mean": None}
+    return {
+        "p50": float(np.percentile(seconds, 50)),
+        "p95": float(np.percentile(seconds, 95)),
+        "mean": float(np.mean(seconds)),
+    }
+
+def run_stage(name, function, items, repeat, setup=None):
+    """Time a stage over several repetitions.
+
+    Args:
+        name (str): The stage name, printed with the result.
+        function (callable): Runs the stage once.
+        items (int): Number of items (patients, pairs or results) a run handles.
+        repeat (int): Number of runs.
+        setup (callable, optional): Called before each run, outside the timing.
+
+    Returns:
+        dict: The run 'seconds', their p50/p95/mean, 'itemsPerSecond' at the median and the
+        'peakRssMib' of the process once the stage has run.
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        seconds.append(time.perf_counter() - start)
+
+    stats = {"items": items, "seconds": seconds, **latency_summary(seconds)}
+    stats["itemsPerSecond"] = items / stats["p50"] if stats["p50"] else None
+    stats["peakRssMib"] = round(peak_rss_mib(), 1)
+    print(f"{name:<12}{items:>8}{stats['p50'] * 1000:>12.1f}{stats['p95'] * 1000:>12.1f}"
+          f"{stats['itemsPerSecond'] or 0:>12.1f}{stats['peakRssMib']:>10.1f}", file=sys.stderr)
+    return stats
+
+def reset_directory(path):
+    """Empty a directory, creating it if needed."""
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def run_benchmarks(args, work_dir):
+    """Generate the synthetic data and time every stage.
+
+    Args:
+        args (argparse.Namespace): The command line options.
+        work_dir (str): Scratch directory for the inputs and outputs.
+
+    Returns:
+        dict: The benchmark report.
+    """
+    xml_dir = os.path.join(work_dir, 'patients_ehr')
+    json_dir = os.path.join(work_dir, 'patients_json')
+    store_dir = os.path.join(work_dir, 'patients_store')
+    trial_dir = os.path.join(work_dir, 'trials')
+    output_dir = os.path.join(work_dir, 'outputs')
+    synthesize_patients(args.xml_dir, args.patients, xml_dir)
+    synthesize_trials(args.trial_dir, args.trials, trial_dir)
+
+    print(f"{'stage':<12}{'items':>8}{'p50 ms':>12}{'p95 ms':>12}{'items/s':>12}{'RSS MiB':>10}", file=sys.stderr)
+    stages = {}
+    stages["preprocess"] = run_stage(
+        "preprocess", lambda: process_xml_files(xml_dir, json_dir, workers=args.workers, store_directory=store_dir),
+        args.patients, args.repeat, setup=lambda: reset_directory(json_dir))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        patients = model.load_patients(store_dir)
+        trials = model.load_trials(trial_dir)
+    patient_records = [patient_ehr for _, patient_ehr in patients]
+    eligible_pairs = prefilter_pairs(patient_records, trials)
+    stages["prefilter"] = run_stage("prefilter", lambda: prefilter_pairs(patient_records, trials),
+                                    len(patients) * len(trials), args.repeat)
+
+    # Matching runs against the fake model, so it measures the pipeline's own overhead plus the
+    # simulated latency; the fake's per-call durations give the LLM latency percentiles
+    llm = FakeChatModel(latency=args.llm_latency, latency_per_1k_tokens=args.llm_latency_per_1k_tokens)
+    model.configure_llm(llm)
+    model.configure_patient_summary(args.summary_tokens or None)
+    if args.mode == 'batched':
+        from src.ai.batching import process_patients_and_trials_batched
+        match = lambda: process_patients_and_trials_batched(store_dir, trial_dir, output_dir)
+    elif args.mode == 'async':
+        from src.ai.async_engine import run_async_matching
+        match = lambda: run_async_matching(store_dir, trial_dir, output_dir, max_concurrency=args.concurrency,
+                                           requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+    else:
+        match = lambda: model.process_patients_and_trials(store_dir, trial_dir, output_dir)
+    try:
+        stages["matching"] = run_stage("matching", match, int(eligible_pairs.sum()), args.repeat,
+                                       setup=lambda: reset_directory(output_dir))
+    finally:
+        model.configure_llm(None)
+        model.configure_patient_summary(None)
+
+    # Replay the eligible results through the result sink, on their own
+    results = [(file_name.split('_')[0], trial)
+               for file_name in sorted(os.listdir(output_dir))
+               for trial in read_eligibility_file(os.path.join(output_dir, file_name))]
+    for name, jsonl in (("results", False), ("results_jsonl", True)):
+        replay_dir = os.path.join(work_dir, name)
+
+        def write_results():
+            with ResultSink(replay_dir, jsonl=jsonl) as sink:
+                for patient_id, trial in results:
+                    sink.add(patient_id, trial)
+
+        stages[name] = run_stage(name, write_results, len(results), args.repeat,
+                                 setup=lambda: reset_directory(replay_dir))
+
+    return {
+        "config": {
+            "patients": args.patients, "trials": args.trials, "repeat": args.repeat, "mode": args.mode,
+            "workers": args.workers, "llmLatency": args.llm_latency,
+            "llmLatencyPer1kTokens": args.llm_latency_per_1k_tokens, "summaryTokens": args.summary_tokens,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "stages": stages,
+        "llm": {"calls": len(llm.call_seconds), "promptTokens": llm.prompt_tokens,
+                "completionTokens": llm.output_tokens, **latency_summary(llm.call_seconds)},
+    }
+
+def compare_with_baseline(report, baseline, tolerance, min_delta=0.005):
+    """Compare the median stage times with a stored report.
+
+    Args:
+        report (dict): The current report.
+        baseline (dict): A report saved by an earlier run.
+        tolerance (float): Allowed slowdown, e.g. 0.2 for 20%.
+        min_delta (float): Slowdowns under this many seconds are timer noise, not regressions.
+
+    Returns:
+        dict: Per stage, the baseline and current p50, their 'ratio' and whether it is a 'regression'.
+    """
+    if baseline.get("config") != report["config"]:
+        print("The baseline was run with a different configuration; ratios are not comparable", file=sys.stderr)
+    comparison = {}
+    for name, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or not base.get("p50"):
+            continue
+        ratio = stats["p50"] / base["p50"]
+        comparison[name] = {"baselineP50": base["p50"], "p50": stats["p50"], "ratio": round(ratio, 3),
+                            "regression": ratio > 1 + tolerance and stats["p50"] - base["p50"] > min_delta}
+        status = "REGRESSION" if comparison[name]["regression"] else "ok"
+        print(f"{name:<14}{base['p50'] * 1000:>10.1f} ms -> {stats['p50'] * 1000:>10.1f} ms  x{ratio:.2f}  {status}",
+              file=sys.stderr)
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark with an offline fake LLM.")
+    parser.add_argument('--patients', type=int, default=50, help="Number of synthetic patients.")
+    parser.add_argument('--trials', type=int, default=40, help="Number of synthetic trials.")
+    parser.add_argument('--xml-dir', default=DEFAULT_XML_DIR, help="Sample CCDA files to replicate.")
+    parser.add_argument('--trial-dir', default=DEFAULT_TRIAL_DIR, help="Sample criteria files to replicate.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage.")
+    parser.add_argument('--mode', choices=['sequential', 'batched', 'async'], default='batched',
+                        help="Matching runner to benchmark.")
+    parser.add_argument('--workers', type=int, default=1, help="Preprocessing worker processes.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight in async mode.")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="Fake LLM latency per call, in seconds.")
+    parser.add_argument('--llm-latency-per-1k-tokens', type=float, default=0.0,
+                        help="Extra fake LLM latency per thousand prompt and completion tokens, in seconds.")
+    parser.add_argument('--summary-tokens', type=int, default=model.DEFAULT_SUMMARY_TOKENS,
+                        help="Token budget of the patient summary; 0 sends the raw EHR data.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--baseline', help="A stored JSON report to compare the median stage times with.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Slowdown over the baseline reported as a regression.")
+    parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                        help="Slowdowns smaller than this are ignored as timer noise.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        report = run_benchmarks(args, work_dir)
+
+    regressions = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare_with_baseline(report, json.load(f), args.tolerance,
+                                                         args.min_delta_ms / 1000)
+        regressions = any(stage["regression"] for stage in report["comparison"].values())
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
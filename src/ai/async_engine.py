@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import openai
+import numpy as np
+from langchain_core.messages import AIMessage
+from src.metrics import configure_logging, metrics
+from src.utils import write_json_atomic
+from src.ai import model
+from src.ai.prefilter import prefilter_pairs, report_prefilter
+from src.ai.retrieval import restrict_to_candidates
+from src.ai.results import ResultSink
+from src.ai.verdicts import EVALUATION_RESPONSE_FORMAT, ResponseFormatError, parse_verdicts
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text):
+    """Roughly estimate the number of tokens in a prompt for rate limiting.
+
+    Args:
+        text (str): The prompt text.
+
+    Returns:
+        int: The estimated token count (about four characters per token).
+    """
+    return max(1, len(text) // 4)
+
+def is_retryable_error(error):
+    """Decide whether a failed LLM call should be retried.
+
+    Args:
+        error (Exception): The exception raised by the chat model.
+
+    Returns:
+        bool: True for rate limiting (429), 5xx responses, timeouts and connection errors.
+    """
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+class TokenBucket:
+    """Asynchronous token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        """Create a full bucket.
+
+        Args:
+            rate_per_minute (float): Number of tokens added per minute.
+            capacity (float, optional): Maximum burst size. Defaults to one minute of tokens.
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        """Add the tokens accumulated since the last update."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until amount tokens are available and take them.
+
+        Args:
+            amount (float): Number of tokens to take. Requests larger than the capacity
+                are clamped so they can still proceed once the bucket is full.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class RateLimiter:
+    """Combined requests-per-minute and tokens-per-minute limiter."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        """Create the request and token buckets.
+
+        Args:
+            requests_per_minute (int): Maximum number of requests per minute.
+            tokens_per_minute (int): Maximum number of prompt tokens per minute.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, prompt_tokens):
+        """Wait for one request slot and prompt_tokens tokens.
+
+        Args:
+            prompt_tokens (int): Estimated number of tokens in the prompt.
+        """
+        await self.requests.acquire(1)
+        await self.tokens.acquire(prompt_tokens)
+
+async def call_llm_async(prompt, llm, limiter, semaphore, max_retries=5, base_delay=1.0, response_format=None,
+                         validate=None):
+    """Send a prompt with ainvoke, honouring the concurrency and rate limits.
+
+    Args:
+        prompt (str): The fully rendered prompt.
+        llm (ChatOpenAI): The chat model to call.
+        limiter (RateLimiter): The shared requests/tokens per minute limiter.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight.
+        max_retries (int): Maximum number of retries on 429, 5xx and connection errors.
+        base_delay (float): Initial backoff delay in seconds, doubled after each retry.
+        response_format (dict, optional): Structured output format requested from the model.
+        validate (callable, optional): Called with the response text before it is cached, see
+            model.call_llm.
+
+    Returns:
+        AIMessage: The model response, rebuilt from the LLM cache on a hit.
+
+    Raises:
+        Exception: The last error once retries are exhausted or if it is not retryable.
+    """
+    model_name, temperature = model.cache_identity(llm, response_format)
+    if model.llm_cache is not None:
+        cached_response = model.llm_cache.get(model_name, temperature, prompt)
+        if cached_response is not None:
+            return AIMessage(content=cached_response)
+
+    if response_format is not None:
+        llm = llm.bind(response_format=response_format)
+    prompt_tokens = estimate_tokens(prompt)
+    attempt = 0
+    while True:
+        await limiter.acquire(prompt_tokens)
+        try:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await llm.ainvoke(prompt)
+                model.record_llm_call(prompt, response, time.perf_counter() - start)
+            break
+        except Exception as error:
+            metrics.inc('llm_errors_total', error=error.__class__.__name__)
+            if attempt >= max_retries or not is_retryable_error(error):
+                raise
+            # Exponential backoff with jitter
+            delay = base_delay * (2 ** attempt) + random.uniform(0, base_delay)
+            logger.warning("Retrying LLM call after error (%s) in %.2fs...", error.__class__.__name__, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    if validate is not None:
+        validate(response.content)
+    if model.llm_cache is not None:
+        model.llm_cache.set(model_name, temperature, prompt, response.content)
+
+    return response
+
+async def precompute_trial_keywords_async(trials, keywords_path, llm, limiter, semaphore, **retry_options):
+    """Concurrently identify criteria keywords for trials missing from the keyword store.
+
+    Args:
+        trials (list): Trials as returned by model.load_trials.
+        keywords_path (str): JSON file where the keywords are persisted, or None.
+        llm (ChatOpenAI): The chat model to call.
+        limiter (RateLimiter): The shared rate limiter.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight.
+        **retry_options: max_retries and base_delay passed to call_llm_async.
+
+    Returns:
+        dict: Keywords keyed by trial ID, in the format of model.precompute_trial_keywords.
+        Trials whose keyword call failed are left out.
+    """
+    trial_keywords = {}
+    if keywords_path and os.path.exists(keywords_path):
+        with open(keywords_path, 'r') as f:
+            trial_keywords = json.load(f)
+
+    pending = []
+    for trial in trials:
+        criteria_hash = model.hash_criteria_text(trial["criteria"])
+        entry = trial_keywords.get(trial["trialId"])
+        if entry is None or entry.get("criteriaHash") != criteria_hash:
+            pending.append((trial, criteria_hash))
+
+    responses = await asyncio.gather(*[
+        call_llm_async(model.build_keywords_prompt(trial["criteria"]), llm, limiter, semaphore, **retry_options)
+        for trial, _ in pending
+    ], return_exceptions=True)
+    updated = False
+    for (trial, criteria_hash), response in zip(pending, responses):
+        if isinstance(response, Exception):
+            # The trial's pairs are skipped; the next run asks for its keywords again
+            metrics.inc('llm_errors_total', error=type(response).__name__)
+            logger.warning("Could not identify the keywords of trial %s: %s", trial['trialId'], response)
+            continue
+        trial_keywords[trial["trialId"]] = {"criteriaHash": criteria_hash, "keywords": response.content}
+        updated = True
+
+    if keywords_path and updated:
+        write_json_atomic(keywords_path, trial_keywords, indent=2)
+
+    return trial_keywords
+
+async def evaluate_pair_async(patient_id, patient_ehr, trial, criteria_keywords, llm, limiter, semaphore,
+                              max_attempts=3, **retry_options):
+    """Evaluate one patient against one trial.
+
+    An answer that does not follow the response schema is requested again for this pair only,
+    as in model.evaluate_pair, and the criteria decided by the rule engine are not sent at all.
+
+    Args:
+        patient_id (str): The ID of the patient.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        trial (dict): The trial as returned by model.load_trials.
+        criteria_keywords (str): The precomputed keywords of the trial.
+        llm (ChatOpenAI): The chat model to call.
+        limiter (RateLimiter): The shared rate limiter.
+        semaphore (asyncio.Semaphore): Bounds the number of requests in flight.
+        max_attempts (int): Number of evaluation requests before the pair is given up.
+        **retry_options: max_retries and base_delay passed to call_llm_async.
+
+    Returns:
+        dict: The eligibility JSON for the trial if the patient is eligible, otherwise None.
+    """
+    rule_verdicts, needs_llm, criteria_keywords = model.apply_rules(trial, patient_ehr, criteria_keywords)
+    eligibility_dict = dict(rule_verdicts)
+    if needs_llm:
+        prompt = model.build_evaluation_prompt(criteria_keywords, patient_ehr)
+        for attempt in range(1, max_attempts + 1):
+            try:
+                response = await call_llm_async(prompt, llm, limiter, semaphore,
+                                                response_format=EVALUATION_RESPONSE_FORMAT, validate=parse_verdicts,
+                                                **retry_options)
+                break
+            except ResponseFormatError as e:
+                metrics.inc('llm_invalid_responses_total')
+                logger.warning("Invalid answer for Trial %s (Patient %s), attempt %s of %s: %s",
+                               trial['trialId'], patient_id, attempt, max_attempts, e)
+        else:
+            metrics.inc('pairs_failed_total')
+            logger.warning("Giving up on Trial %s (Patient %s) after %s invalid answers",
+                           trial['trialId'], patient_id, max_attempts)
+            return None
+        eligibility_dict.update(model.parse_eligibility_results(response.content))
+    final_eligibility = model.determine_overall_eligibility(eligibility_dict)
+    logger.debug("Final Eligibility for Trial %s (Patient %s): %s", trial['trialId'], patient_id, final_eligibility)
+
+    if final_eligibility == "Yes":
+        return model.create_eligibility_json(patient_id, trial["trialId"], trial["studyTitle"], eligibility_dict)
+    return None
+
+async def process_patients_and_trials_async(patient_dir, trial_dir, output_dir, keywords_path=None, llm=None,
+                                            max_concurrency=8, requests_per_minute=500, tokens_per_minute=200000,
+                                            max_retries=5, base_delay=1.0, top_k=None, index_path=None, csv_path=None,
+                                            embedding_dir=None, sink=None):
+    """Evaluate every patient against every trial with concurrent LLM calls.
+
+    Args:
+        patient_dir (str): Directory containing patient EHR JSON files.
+        trial_dir (str): Directory containing trial criteria text files.
+        output_dir (str): Directory where eligibility results will be saved.
+        keywords_path (str, optional): JSON file where the per-trial criteria keywords are persisted.
+        llm (ChatOpenAI, optional): The chat model to call. Defaults to model.get_llm() with
+            the client's own retries disabled, so backoff is handled here.
+        max_concurrency (int): Maximum number of LLM requests in flight.
+        requests_per_minute (int): Request rate limit.
+        tokens_per_minute (int): Prompt token rate limit.
+        max_retries (int): Maximum number of retries per call on 429 and 5xx errors.
+        base_delay (float): Initial exponential backoff delay in seconds.
+        top_k (int, optional): Only evaluate each patient against its top-K candidate trials.
+        index_path (str, optional): File where the retrieval index is persisted and updated.
+        csv_path (str, optional): study-links.csv, whose brief summaries are indexed with the criteria.
+        embedding_dir (str, optional): Shortlist the top-K trials by embedding similarity, with the
+            trial embeddings cached in this directory, instead of by BM25 score.
+        sink (ResultSink, optional): Where eligible trials are collected. Defaults to a sink
+            writing one {patient_id}_eligibility.json per patient to output_dir.
+
+    Results are written to the same {patient_id}_eligibility.json files as
+    model.process_patients_and_trials, in trial order. A pool of max_concurrency workers
+    evaluates the pairs patient by patient, and each patient is written as soon as its last
+    pair is done. A pair whose call fails after its retries is counted in pairs_failed_total
+    and skipped, without stopping the run.
+    """
+    if llm is None:
+        llm = model.get_llm(max_retries=0)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    retry_options = {"max_retries": max_retries, "base_delay": base_delay}
+
+    patients = model.load_patients(patient_dir)
+    trials = model.load_trials(trial_dir)
+
+    # Drop the pairs ruled out by the trial's age and sex eligibility before any LLM call
+    eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+    report_prefilter(eligible_pairs)
+    if top_k is not None:
+        eligible_pairs = restrict_to_candidates(eligible_pairs, patients, trials, top_k, index_path, csv_path,
+                                                embedding_dir)
+
+    active_trials = [trial for index, trial in enumerate(trials) if eligible_pairs[:, index].any()]
+    trial_keywords = await precompute_trial_keywords_async(active_trials, keywords_path, llm, limiter, semaphore,
+                                                           **retry_options)
+
+    # Pairs of trials without keywords are skipped
+    has_keywords = np.array([trial["trialId"] in trial_keywords for trial in trials], dtype=bool)
+    eligible_pairs = eligible_pairs & has_keywords[None, :]
+
+    owns_sink = sink is None
+    if owns_sink:
+        sink = ResultSink(output_dir)
+
+    # Eligible trials of the patients in progress, by trial index, and their pairs left
+    patient_results = {}
+    remaining = {}
+
+    def finish_patient(patient_id):
+        """Write a patient's eligible trials in trial order once all its pairs are done."""
+        for _, new_trial_info in sorted(patient_results.pop(patient_id, {}).items()):
+            sink.add(patient_id, new_trial_info)
+        sink.flush(patient_id)
+
+    pairs = (
+        (patient_id, patient_ehr, trial_index, trial)
+        for patient_index, (patient_id, patient_ehr) in enumerate(patients)
+        for trial_index, trial in enumerate(trials)
+        if eligible_pairs[patient_index, trial_index]
+    )
+
+    async def worker():
+        for patient_id, patient_ehr, trial_index, trial in pairs:
+            try:
+                new_trial_info = await evaluate_pair_async(patient_id, patient_ehr, trial,
+                                                           trial_keywords[trial["trialId"]]["keywords"],
+                                                           llm, limiter, semaphore, **retry_options)
+            except Exception as e:
+                metrics.inc('pairs_failed_total')
+                logger.warning("Skipping Trial %s (Patient %s) after a failed call: %s",
+                               trial['trialId'], patient_id, e)
+                new_trial_info = None
+            if new_trial_info is not None:
+                patient_results.setdefault(patient_id, {})[trial_index] = new_trial_info
+            remaining[patient_id] -= 1
+            if remaining[patient_id] == 0:
+                finish_patient(patient_id)
+
+    for patient_index, (patient_id, _) in enumerate(patients):
+        remaining[patient_id] = int(eligible_pairs[patient_index].sum())
+        if remaining[patient_id] == 0:
+            finish_patient(patient_id)
+
+    logger.info("Evaluating %s patient-trial pairs with up to %s requests in flight...",
+                int(eligible_pairs.sum()), max_concurrency)
+    await asyncio.gather(*[worker() for _ in range(max_concurrency)])
+
+    if owns_sink:
+        sink.close()
+    else:
+        sink.flush()
+
+def run_async_matching(patient_dir, trial_dir, output_dir, **kwargs):
+    """Synchronous entry point for process_patients_and_trials_async.
+
+    Args:
+        patient_dir (str): Directory containing patient EHR JSON files.
+        trial_dir (str): Directory containing trial criteria text files.
+        output_dir (str): Directory where eligibility results will be saved.
+        **kwargs: Options forwarded to process_patients_and_trials_async.
+    """
+    asyncio.run(process_patients_and_trials_async(patient_dir, trial_dir, output_dir, **kwargs))
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Concurrent patient-trial eligibility matching.")
+    parser.add_argument('--patients', required=True, help="Directory of processed patient JSON files.")
+    parser.add_argument('--trials', required=True, help="Directory of trial criteria text files.")
+    parser.add_argument('--output', required=True, help="Directory for the eligibility JSON files.")
+    parser.add_argument('--keywords', help="JSON file used to persist the per-trial keywords.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Maximum requests in flight.")
+    parser.add_argument('--rpm', type=int, default=500, help="Requests per minute limit.")
+    parser.add_argument('--tpm', type=int, default=200000, help="Tokens per minute limit.")
+    parser.add_argument('--top-k', type=int, help="Only evaluate each patient against its top-K retrieved trials.")
+    parser.add_argument('--index', help="File where the retrieval index is persisted.")
+    parser.add_argument('--csv', help="study-links.csv, whose brief summaries are indexed.")
+    parser.add_argument('--embedding-dir', help="Shortlist trials by embedding similarity, caching the embeddings here.")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="Stream the results to eligibility.jsonl instead of per-patient files.")
+    parser.add_argument('--llm-cache', default=os.path.join('data', 'cache', 'llm_cache.sqlite'),
+                        help="SQLite LLM response cache.")
+    parser.add_argument('--summary-tokens', type=int, default=model.DEFAULT_SUMMARY_TOKENS,
+                        help="Token budget of the patient summary sent in prompts; 0 sends the raw EHR data.")
+    parser.add_argument('--no-rules', dest='rules', action='store_false',
+                        help="Send every criterion to the model instead of deciding numeric and temporal ones locally.")
+
+    args = parser.parse_args()
+    model.configure_llm_cache(args.llm_cache)
+    model.configure_patient_summary(args.summary_tokens or None)
+    rule_stats = model.configure_rule_engine(args.rules)
+
+    with ResultSink(args.output, jsonl=args.jsonl) as result_sink:
+        run_async_matching(args.patients, args.trials, args.output, keywords_path=args.keywords,
+                           max_concurrency=args.concurrency, requests_per_minute=args.rpm,
+                           tokens_per_minute=args.tpm, top_k=args.top_k, index_path=args.index, csv_path=args.csv,
+                           embedding_dir=args.embedding_dir, sink=result_sink)
+    logger.info("LLM cache stats: %s", model.llm_cache.stats())
+    if model.patient_summary_tokens is not None:
+        model.prompt_size_stats.report()
+    if rule_stats is not None:
+        rule_stats.report()
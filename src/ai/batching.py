@@ -0,0 +1,357 @@
+import re
+import json
+import argparse
+import logging
+from langchain.prompts import PromptTemplate
+from src.metrics import configure_logging, metrics
+from src.ai import model
+from src.ai.criteria import parse_criteria_text, render_criteria_text, iter_criteria
+from src.ai.prefilter import prefilter_pairs, report_prefilter
+from src.ai.tokens import count_tokens
+from src.ai.retrieval import restrict_to_candidates
+from src.ai.results import ResultSink
+from src.ai.verdicts import ResponseFormatError
+
+logger = logging.getLogger(__name__)
+
+# Default budget for one batched prompt, well below the 128k-token context window so the
+# JSON answer for every packed trial still fits
+DEFAULT_MAX_PROMPT_TOKENS = 32000
+
+# Requests for a trial that the batched answers keep leaving out, before its pair is given up
+DEFAULT_MAX_ATTEMPTS = 3
+
+def get_record(trial):
+    """Return the compiled criteria record of a trial, compiling its text if needed.
+
+    Args:
+        trial (dict): A trial as returned by model.load_trials.
+
+    Returns:
+        dict: The compiled criteria record.
+    """
+    if "record" not in trial:
+        trial["record"] = parse_criteria_text(trial["criteria"], trial["trialId"])
+    return trial["record"]
+
+def render_trial_block(trial):
+    """Render one trial of a batched prompt.
+
+    Args:
+        trial (dict): A trial as returned by model.load_trials.
+
+    Returns:
+        str: The trial ID followed by its criteria addressed by criterion ID.
+    """
+    return f"Trial {trial['trialId']}:\n{render_criteria_text(get_record(trial))}"
+
+def build_batch_prompt(patient_ehr, trials, record_stats=True):
+    """Render one evaluation prompt covering several trials for a patient.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        trials (list): The trials to evaluate, as returned by model.load_trials.
+        record_stats (bool): Record the patient context size, see model.format_patient_context.
+
+    Returns:
+        str: The fully rendered prompt. The patient information is included once, followed
+        by every trial's criteria, and a JSON answer keyed by trial ID and criterion ID is asked for.
+    """
+    system_message = """
+    You are a clinical trial assistant.
+    Your task is to compare the patient's information with the inclusion and exclusion criteria
+    of several clinical trials. Every criterion is identified by its trial ID and criterion ID.
+
+    For each inclusion criterion (IDs starting with I), respond with:
+    - "Yes" if the patient meets the criterion or there is no information available
+    - "No" if there is evidence that the criterion is not met
+
+    For each exclusion criterion (IDs starting with E), respond with:
+    - "Yes" if the patient does not meet the criterion or there is no information available
+    - "No" if there is evidence that the criterion is met
+    """
+
+    relevant_patient_data = model.format_patient_context(patient_ehr, record_stats)
+
+    prompt_template = PromptTemplate(
+        input_variables=["patient_data", "trials"],
+        template=f"""
+        {system_message}
+
+        Patient Information: {{patient_data}}
+
+        {{trials}}
+
+        Evaluate each criterion on its own, without considering the other criteria.
+
+        Respond with a single JSON object and nothing else, mapping each trial ID to an object
+        that maps each of its criterion IDs to "Yes" or "No", for example:
+        {{{{"NCT00000000": {{{{"I1": "Yes", "E1": "No"}}}}}}}}
+        """
+    )
+
+    return prompt_template.format(
+        patient_data=relevant_patient_data,
+        trials='\n\n'.join(render_trial_block(trial) for trial in trials),
+    )
+
+def pack_trials(patient_ehr, trials, max_prompt_tokens=DEFAULT_MAX_PROMPT_TOKENS):
+    """Split a patient's trials into batches whose prompts fit a token budget.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        trials (list): The trials to evaluate for the patient.
+        max_prompt_tokens (int): Maximum number of prompt tokens per batch.
+
+    Returns:
+        list: Lists of trials, in order. A trial that does not fit the budget even alone gets
+        a batch of its own.
+    """
+    base_tokens = count_tokens(build_batch_prompt(patient_ehr, [], record_stats=False))
+    batches = []
+    batch, batch_tokens = [], base_tokens
+    for trial in trials:
+        trial_tokens = count_tokens(render_trial_block(trial)) + 2
+        if batch and batch_tokens + trial_tokens > max_prompt_tokens:
+            batches.append(batch)
+            batch, batch_tokens = [], base_tokens
+        batch.append(trial)
+        batch_tokens += trial_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def parse_batch_response(content, trials):
+    """Split a batched JSON answer back into one eligibility dictionary per trial.
+
+    Args:
+        content (str): The model response.
+        trials (list): The trials of the batch.
+
+    Returns:
+        dict: Eligibility dictionaries keyed by trial ID, each mapping '<criterion ID>: <criterion
+        text>' to 'Yes' or 'No'. Trials missing from the answer, or an answer that is not
+        valid JSON, are left out. Criteria the answer skips are recorded as 'No answer'.
+    """
+    # Models sometimes wrap the JSON in a Markdown code fence
+    content = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', content.strip())
+    try:
+        answer = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+
+    results = {}
+    for trial in trials:
+        trial_answer = answer.get(trial["trialId"])
+        if not isinstance(trial_answer, dict):
+            continue
+        eligibility_dict = {}
+        for _, criterion in iter_criteria(get_record(trial)):
+            status = trial_answer.get(criterion["id"])
+            eligibility_dict[f"{criterion['id']}: {criterion['text']}"] = (
+                status.strip().capitalize() if isinstance(status, str) else "No answer"
+            )
+        results[trial["trialId"]] = eligibility_dict
+    return results
+
+def is_complete(eligibility_dict):
+    """Check whether a trial's eligibility dictionary has an answer for every criterion."""
+    return "No answer" not in eligibility_dict.values()
+
+def evaluate_batch(patient_ehr, trials, llm=None, stats=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Evaluate a patient against a batch of trials with one request.
+
+    An answer that is not valid JSON, or that leaves out a trial or criterion, is not cached.
+    The trials it does not fully answer are evaluated again on their own, and a single trial
+    is requested up to max_attempts times.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        trials (list): The trials of the batch.
+        llm (ChatOpenAI, optional): The chat model to call. Defaults to model.get_llm().
+        stats (dict, optional): Counters updated with the 'requests' and 'promptTokens' sent.
+        max_attempts (int): Number of requests for a single trial before it is given up.
+
+    Returns:
+        dict: Eligibility dictionaries keyed by trial ID, see parse_batch_response. Trials
+        without a complete answer are left out.
+    """
+    prompt = build_batch_prompt(patient_ehr, trials)
+    prompt_tokens = count_tokens(prompt) if stats is not None else 0
+    answered = {}
+
+    def validate(content):
+        answered.update(parse_batch_response(content, trials))
+        complete = sum(1 for eligibility_dict in answered.values() if is_complete(eligibility_dict))
+        if complete < len(trials):
+            raise ResponseFormatError(f"the answer covers {complete} of {len(trials)} trials")
+
+    results = {}
+    for attempt in range(1, (max_attempts if len(trials) == 1 else 1) + 1):
+        if stats is not None:
+            stats["requests"] += 1
+            stats["promptTokens"] += prompt_tokens
+        answered.clear()
+        try:
+            results = parse_batch_response(model.call_llm(prompt, llm, validate=validate).content, trials)
+            break
+        except ResponseFormatError as e:
+            metrics.inc('llm_invalid_responses_total')
+            logger.warning("Incomplete batched answer for %s trial(s), attempt %s: %s", len(trials), attempt, e)
+            results = {trial_id: eligibility_dict for trial_id, eligibility_dict in answered.items()
+                       if is_complete(eligibility_dict)}
+
+    if len(trials) > 1:
+        for trial in trials:
+            if trial["trialId"] not in results:
+                results.update(evaluate_batch(patient_ehr, [trial], llm, stats, max_attempts))
+    return results
+
+def evaluate_patient_trials(patient_id, patient_ehr, patient_trials, max_prompt_tokens=DEFAULT_MAX_PROMPT_TOKENS,
+                            llm=None, stats=None):
+    """Evaluate a patient against its trials, packed into as few batched prompts as fit.
+
+    Args:
+        patient_id (str): The patient ID.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        patient_trials (list): The trials to evaluate.
+        max_prompt_tokens (int): Maximum number of prompt tokens per request.
+        llm (ChatOpenAI, optional): The chat model to call. Defaults to model.get_llm().
+        stats (dict, optional): Counters updated with the 'pairs', 'requests', 'promptTokens' and,
+            if it has that key, 'baselineTokens', see process_patients_and_trials_batched.
+
+    Returns:
+        list: The eligibility JSON structures of the trials the patient is eligible for, in trial order.
+    """
+    results = {}
+    for batch in pack_trials(patient_ehr, patient_trials, max_prompt_tokens):
+        results.update(evaluate_batch(patient_ehr, batch, llm, stats))
+
+    baseline_tokens = None
+    if stats is not None and "baselineTokens" in stats:
+        baseline_tokens = count_tokens(model.build_evaluation_prompt("", patient_ehr, record_stats=False))
+
+    eligible = []
+    for trial in patient_trials:
+        if stats is not None:
+            stats["pairs"] += 1
+            if baseline_tokens is not None:
+                if "criteriaTokens" not in trial:
+                    trial["criteriaTokens"] = count_tokens(trial["criteria"])
+                stats["baselineTokens"] += baseline_tokens + trial["criteriaTokens"]
+
+        eligibility_dict = results.get(trial["trialId"])
+        if eligibility_dict is None:
+            metrics.inc('pairs_failed_total')
+            logger.warning("No answer for Trial %s (Patient %s)", trial['trialId'], patient_id)
+            continue
+        final_eligibility = model.determine_overall_eligibility(eligibility_dict)
+        logger.debug("Final Eligibility for Trial %s (Patient %s): %s",
+                     trial['trialId'], patient_id, final_eligibility)
+
+        if final_eligibility == "Yes":
+            eligible.append(model.create_eligibility_json(patient_id, trial["trialId"], trial["studyTitle"],
+                                                          eligibility_dict))
+    return eligible
+
+def process_patients_and_trials_batched(patient_dir, trial_dir, output_dir, max_prompt_tokens=DEFAULT_MAX_PROMPT_TOKENS,
+                                        llm=None, top_k=None, index_path=None, csv_path=None,
+                                        embedding_dir=None, sink=None, baseline=False):
+    """Evaluate every patient against the trials with one batched prompt per group of trials.
+
+    Args:
+        patient_dir (str): Directory containing patient EHR JSON files, or a feature store.
+        trial_dir (str): Directory containing trial criteria text files, or a compiled criteria file.
+        output_dir (str): Directory where eligibility results will be saved.
+        max_prompt_tokens (int): Maximum number of prompt tokens per request.
+        llm (ChatOpenAI, optional): The chat model to call. Defaults to model.get_llm().
+        top_k (int, optional): Only evaluate each patient against its top-K candidate trials.
+        index_path (str, optional): File where the retrieval index is persisted and updated.
+        csv_path (str, optional): study-links.csv, whose brief summaries are indexed with the criteria.
+        embedding_dir (str, optional): Shortlist the top-K trials by embedding similarity, with the
+            trial embeddings cached in this directory, instead of by BM25 score.
+        sink (ResultSink, optional): Where eligible trials are collected. Defaults to a sink
+            writing one {patient_id}_eligibility.json per patient to output_dir.
+        baseline (bool): Also estimate the tokens of the per-pair prompts, for comparison.
+
+    Returns:
+        dict: The number of 'pairs' evaluated, 'requests' sent and 'promptTokens' sent, the
+        'tokensPerPair' of the batched mode and, with baseline, 'baselineTokensPerPair', the
+        tokens the per-pair evaluation prompt of model.process_patients_and_trials would have
+        sent with the criteria text in place of the keywords. The baseline is estimated from
+        the prompt without criteria, counted once per patient, and the criteria tokens of
+        each trial, counted once.
+
+    Results are written to the same {patient_id}_eligibility.json files as
+    model.process_patients_and_trials, in trial order.
+    """
+    patients = model.load_patients(patient_dir)
+    trials = model.load_trials(trial_dir)
+
+    # Drop the pairs ruled out by the trial's age and sex eligibility before any LLM call
+    eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+    report_prefilter(eligible_pairs)
+    if top_k is not None:
+        eligible_pairs = restrict_to_candidates(eligible_pairs, patients, trials, top_k, index_path, csv_path,
+                                                embedding_dir)
+
+    owns_sink = sink is None
+    if owns_sink:
+        sink = ResultSink(output_dir)
+
+    stats = {"pairs": 0, "requests": 0, "promptTokens": 0}
+    if baseline:
+        stats["baselineTokens"] = 0
+    for patient_index, (patient_id, patient_ehr) in enumerate(patients):
+        patient_trials = [trial for trial_index, trial in enumerate(trials) if eligible_pairs[patient_index, trial_index]]
+        logger.debug("Processing patient: %s (%s trials)", patient_id, len(patient_trials))
+
+        if patient_trials:
+            for new_trial_info in evaluate_patient_trials(patient_id, patient_ehr, patient_trials, max_prompt_tokens,
+                                                          llm, stats):
+                sink.add(patient_id, new_trial_info)
+        sink.flush(patient_id)
+
+    if owns_sink:
+        sink.close()
+
+    pairs = max(stats["pairs"], 1)
+    stats["tokensPerPair"] = stats["promptTokens"] / pairs
+    logger.info("Evaluated %s pairs with %s requests: %.0f prompt tokens per pair batched",
+                stats['pairs'], stats['requests'], stats['tokensPerPair'])
+    if baseline:
+        stats["baselineTokensPerPair"] = stats["baselineTokens"] / pairs
+        logger.info("About %.0f prompt tokens per pair with one prompt per pair", stats['baselineTokensPerPair'])
+    return stats
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Batched patient-trial eligibility matching.")
+    parser.add_argument('--patients', required=True, help="Directory of processed patient JSON files or a feature store.")
+    parser.add_argument('--trials', required=True, help="Directory of trial criteria text files or a compiled criteria file.")
+    parser.add_argument('--output', required=True, help="Directory for the eligibility JSON files.")
+    parser.add_argument('--max-prompt-tokens', type=int, default=DEFAULT_MAX_PROMPT_TOKENS,
+                        help="Maximum prompt tokens per batched request.")
+    parser.add_argument('--top-k', type=int, help="Only evaluate each patient against its top-K retrieved trials.")
+    parser.add_argument('--index', help="File where the retrieval index is persisted.")
+    parser.add_argument('--csv', help="study-links.csv, whose brief summaries are indexed.")
+    parser.add_argument('--embedding-dir', help="Shortlist trials by embedding similarity, caching the embeddings here.")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="Stream the results to eligibility.jsonl instead of per-patient files.")
+    parser.add_argument('--baseline', action='store_true',
+                        help="Also estimate the prompt tokens of one prompt per pair, for comparison.")
+    parser.add_argument('--summary-tokens', type=int, default=model.DEFAULT_SUMMARY_TOKENS,
+                        help="Token budget of the patient summary sent in prompts; 0 sends the raw EHR data.")
+
+    args = parser.parse_args()
+
+    model.configure_patient_summary(args.summary_tokens or None)
+    with ResultSink(args.output, jsonl=args.jsonl) as result_sink:
+        process_patients_and_trials_batched(args.patients, args.trials, args.output, args.max_prompt_tokens,
+                                            top_k=args.top_k, index_path=args.index, csv_path=args.csv,
+                                            embedding_dir=args.embedding_dir, sink=result_sink,
+                                            baseline=args.baseline)
+    if model.patient_summary_tokens is not None:
+        model.prompt_size_stats.report()
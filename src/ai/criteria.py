@@ -0,0 +1,314 @@
+import os
+import re
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+import logging
+from src.metrics import configure_logging
+from src.ai.prefilter import parse_other_criteria
+
+logger = logging.getLogger(__name__)
+
+# Compiled criteria file layout:
+#   MAGIC | one JSON record per line | JSON index {trialId: [offset, length]} | footer
+# The footer holds the index offset, the index length and MAGIC again, so a reader can
+# memory-map the file and decode only the records it needs.
+MAGIC = b'PTMCRIT1'
+FOOTER = struct.Struct('<QQ8s')
+
+# Section headings such as 'Inclusion Criteria:', 'Key Exclusion Criteria' or
+# 'Inclusion Criteria for Mothers in Aim 1:'
+HEADING_PATTERN = re.compile(r'^(?:key\s+)?(inclusion|exclusion)\s+criteria\b(.*)$', re.IGNORECASE)
+
+# List markers in front of a criterion: '1:', '2.', '3)', '1.2.', '-', '*', '•', 'a)', '(b)'
+MARKER_PATTERN = re.compile(r'^(?:\d+(?:\.\d+)*\s*[:.)]|[-*•·]|\(?[a-zA-Z]\))\s+')
+
+# Items that only say a section is empty
+EMPTY_ITEMS = {'none', 'none.', 'n/a', 'na', 'not applicable'}
+
+def is_compiled_criteria(path):
+    """Check whether a path is a compiled criteria file.
+
+    Args:
+        path (str): The path to check.
+
+    Returns:
+        bool: True if the file starts with the compiled criteria magic bytes.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def _split_items(body):
+    """Split the inclusion/exclusion text of a criteria file into criteria and the study population.
+
+    Returns:
+        tuple: (items, study_population) where items is a list of (kind, group, text) tuples
+        in file order, kind being 'inclusion' or 'exclusion'.
+    """
+    items = []
+    population_lines = []
+    kind, group = 'inclusion', None
+    in_population = False
+
+    for line in body.split('\n'):
+        line = line.strip()
+        if not line or line == 'Description':
+            continue
+        if line == 'Study Population':
+            in_population = True
+            continue
+
+        heading = HEADING_PATTERN.match(line)
+        if heading:
+            rest = heading.group(2).strip()
+            inline_text = None
+            if rest in ('', ':'):
+                is_heading = True
+                rest = ''
+            elif rest.startswith(':'):
+                # 'Inclusion Criteria: adults over 18' carries its first criterion inline
+                is_heading = True
+                inline_text, rest = rest[1:].strip(), ''
+            else:
+                is_heading = rest.endswith(':') and len(rest) <= 100
+            if is_heading:
+                kind, group = heading.group(1).lower(), rest.rstrip(':').strip() or None
+                in_population = False
+                if inline_text:
+                    items.append((kind, group, inline_text))
+                continue
+
+        if in_population:
+            population_lines.append(line)
+            continue
+
+        marker = MARKER_PATTERN.match(line)
+        text = line[marker.end():].strip() if marker else line
+        if not text:
+            continue
+
+        # A wrapped line continues the previous criterion: no marker, the previous text does
+        # not end a sentence, and the line starts in lower case or with a number
+        if (not marker and items and items[-1][0] == kind and items[-1][1] == group
+                and not re.search(r'[.;:!?]$', items[-1][2]) and (text[0].islower() or text[0].isdigit())):
+            items[-1] = (kind, group, f"{items[-1][2]} {text}")
+        else:
+            items.append((kind, group, text))
+
+    items = [item for item in items if item[2].lower() not in EMPTY_ITEMS]
+    return items, ' '.join(population_lines) or None
+
+def parse_criteria_text(trial_criteria, trial_id):
+    """Compile the text of a scraped criteria file into a structured record.
+
+    Args:
+        trial_criteria (str): The full text of a <trial_id>_criteria.txt file.
+        trial_id (str): The NCT number of the trial.
+
+    Returns:
+        dict: The record, with 'trialId', 'studyTitle', 'inclusion' and 'exclusion' lists of
+        criteria, 'studyPopulation' (None if absent), 'minAge' and 'maxAge' in years, 'sexes',
+        'healthyVolunteers' and the 'contentHash' of the source text. Each criterion is a
+        dictionary with an 'id' unique within the trial ('I1', 'I2', ... and 'E1', ...), its
+        'text' and the 'group' of its heading (e.g. 'for Mothers in Aim 1'), or None.
+    """
+    study_title, body = None, trial_criteria
+    if trial_criteria.startswith('Study Title:'):
+        title_line, _, body = trial_criteria.partition('\n')
+        study_title = title_line[len('Study Title:'):].strip()
+
+    body = body.split('Inclusion/Exclusion Criteria:', 1)[-1]
+    body = body.rpartition('Other Criteria:')[0] if 'Other Criteria:' in body else body
+    items, study_population = _split_items(body)
+
+    record = {
+        "trialId": trial_id,
+        "studyTitle": study_title,
+        "inclusion": [],
+        "exclusion": [],
+        "studyPopulation": study_population,
+    }
+    for kind, group, text in items:
+        criteria = record[kind]
+        criteria.append({"id": f"{kind[0].upper()}{len(criteria) + 1}", "text": text, "group": group})
+
+    record.update(parse_other_criteria(trial_criteria))
+    record["contentHash"] = hashlib.sha256(trial_criteria.encode('utf-8')).hexdigest()
+    return record
+
+def iter_criteria(record):
+    """Iterate over all criteria of a record, inclusion criteria first.
+
+    Args:
+        record (dict): A compiled criteria record.
+
+    Returns:
+        iterator: (kind, criterion) tuples, kind being 'inclusion' or 'exclusion'.
+    """
+    for kind in ('inclusion', 'exclusion'):
+        for criterion in record[kind]:
+            yield kind, criterion
+
+def format_age(years):
+    """Render an age in years compactly, e.g. 18.0 -> '18', 0.5 -> '0.5'."""
+    return f"{years:g}"
+
+def render_criteria_text(record, criterion_ids=None):
+    """Render a compiled record as compact prompt text addressing every criterion by ID.
+
+    Args:
+        record (dict): A compiled criteria record.
+        criterion_ids (iterable, optional): Only render these criteria. Defaults to all.
+
+    Returns:
+        str: The title, one '- <id>: <text>' line per criterion under the inclusion and
+        exclusion headings, and the age, sex and healthy volunteer eligibility.
+    """
+    wanted = set(criterion_ids) if criterion_ids is not None else None
+    lines = [f"Study Title: {record['studyTitle']}"]
+    for kind, heading in (('inclusion', 'Inclusion Criteria:'), ('exclusion', 'Exclusion Criteria:')):
+        lines.append(heading)
+        for criterion in record[kind]:
+            if wanted is not None and criterion["id"] not in wanted:
+                continue
+            group = f" ({criterion['group']})" if criterion["group"] else ''
+            lines.append(f"- {criterion['id']}{group}: {criterion['text']}")
+
+    lines.append("Other Criteria:")
+    min_age, max_age = record["minAge"], record["maxAge"]
+    if min_age is not None and max_age is not None:
+        lines.append(f"Ages Eligible for Study: {format_age(min_age)} to {format_age(max_age)} years")
+    elif min_age is not None:
+        lines.append(f"Ages Eligible for Study: {format_age(min_age)} years and older")
+    elif max_age is not None:
+        lines.append(f"Ages Eligible for Study: up to {format_age(max_age)} years")
+    lines.append(f"Sexes Eligible for Study: {record['sexes']}")
+    if record["healthyVolunteers"] is not None:
+        lines.append(f"Accepts Healthy Volunteers: {'Yes' if record['healthyVolunteers'] else 'No'}")
+    return '\n'.join(lines)
+
+def compile_criteria(trial_dir, output_path):
+    """Compile every criteria file of a directory into a single indexed file.
+
+    Args:
+        trial_dir (str): Directory containing <trial_id>_criteria.txt files.
+        output_path (str): The compiled criteria file to write.
+
+    Returns:
+        dict: The number of 'trials' and 'criteria' compiled and the file size in 'bytes'.
+
+    Records are written sorted by trial ID. The file is written to a temporary path and moved
+    into place, so readers never see a partial file.
+    """
+    records = []
+    for trial_file in sorted(os.listdir(trial_dir)):
+        if trial_file.endswith('_criteria.txt'):
+            with open(os.path.join(trial_dir, trial_file)) as f:
+                records.append(parse_criteria_text(f.read(), trial_file.split('_')[0]))
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    index = {}
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for record in records:
+            data = json.dumps(record, ensure_ascii=False).encode('utf-8')
+            index[record["trialId"]] = [f.tell(), len(data)]
+            f.write(data + b'\n')
+        index_offset = f.tell()
+        index_data = json.dumps(index).encode('utf-8')
+        f.write(index_data)
+        f.write(FOOTER.pack(index_offset, len(index_data), MAGIC))
+    os.replace(tmp_path, output_path)
+
+    summary = {
+        "trials": len(records),
+        "criteria": sum(len(record["inclusion"]) + len(record["exclusion"]) for record in records),
+        "bytes": os.path.getsize(output_path),
+    }
+    logger.info("Compiled %s criteria from %s trials into %s", summary['criteria'], summary['trials'], output_path)
+    return summary
+
+class CompiledCriteria:
+    """
+    Read-only, memory-mapped access to a compiled criteria file.
+
+    Only the index is decoded when the file is opened; records are decoded on access.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The compiled criteria file.
+
+        Raises:
+            ValueError: If the file is not a compiled criteria file.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < len(MAGIC) + FOOTER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a compiled criteria file")
+        index_offset, index_length, magic = FOOTER.unpack(self._map[-FOOTER.size:])
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+        self._index = json.loads(self._map[index_offset:index_offset + index_length])
+
+    def trial_ids(self):
+        """The trial IDs in file order."""
+        return list(self._index)
+
+    def get(self, trial_id):
+        """Decode the record of one trial.
+
+        Args:
+            trial_id (str): The NCT number of the trial.
+
+        Returns:
+            dict: The record, or None if the trial is not in the file.
+        """
+        location = self._index.get(trial_id)
+        if location is None:
+            return None
+        offset, length = location
+        return json.loads(self._map[offset:offset + length])
+
+    def __contains__(self, trial_id):
+        return trial_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        for trial_id in self._index:
+            yield self.get(trial_id)
+
+    def close(self):
+        """Unmap and close the file."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == "__main__":
+    configure_logging()
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compile scraped trial criteria into a single indexed file.")
+    parser.add_argument('--trial-dir', default=os.path.join(current_dir, '..', '..', 'data', 'raw', 'scraped'),
+                        help="Directory containing the <trial_id>_criteria.txt files.")
+    parser.add_argument('--output', default=os.path.join(current_dir, '..', '..', 'data', 'processed', 'criteria.bin'),
+                        help="The compiled criteria file to write.")
+    args = parser.parse_args()
+
+    compile_criteria(args.trial_dir, args.output)
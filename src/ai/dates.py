@@ -0,0 +1,147 @@
+from datetime import datetime
+from functools import lru_cache
+
+# Timestamp formats found in the CCDA exports
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+HL7_FORMAT = '%Y%m%d%H%M%S'
+
+# Upper bound on the number of memoized timestamps per format
+MEMO_SIZE = 65536
+
+# Reference timestamp shared by every age and "days ago" computation of a run
+_reference_time = None
+
+def set_reference_time(reference_time=None):
+    """Fix the reference timestamp used as "today" for the rest of the run.
+
+    Args:
+        reference_time (datetime, optional): The timestamp to use. Defaults to the current time.
+
+    Returns:
+        datetime: The reference timestamp now in effect.
+    """
+    global _reference_time
+    _reference_time = reference_time if reference_time is not None else datetime.today()
+    return _reference_time
+
+def get_reference_time():
+    """Return the reference timestamp, fixing it to the current time on first use.
+
+    Returns:
+        datetime: The reference timestamp of the run.
+    """
+    if _reference_time is None:
+        return set_reference_time()
+    return _reference_time
+
+def reset_reference_time():
+    """Forget the reference timestamp so the next call to get_reference_time fixes a new one."""
+    global _reference_time
+    _reference_time = None
+
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_iso_timestamp(value):
+    """Parse a '%Y-%m-%dT%H:%M:%SZ' timestamp such as '2023-01-01T00:00:00Z'.
+
+    Args:
+        value (str): The timestamp string.
+
+    Returns:
+        datetime: The parsed timestamp.
+
+    Raises:
+        ValueError: If the value is not in the expected format.
+
+    Well-formed values are sliced into integers directly; anything else goes through
+    datetime.strptime so errors are reported exactly as before.
+    """
+    if (len(value) == 20 and value[4] == '-' and value[7] == '-' and value[10] == 'T'
+            and value[13] == ':' and value[16] == ':' and value[19] == 'Z'):
+        try:
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(value, ISO_FORMAT)
+
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_hl7_timestamp(value):
+    """Parse a '%Y%m%d%H%M%S' timestamp such as '19981016020326'.
+
+    Args:
+        value (str): The timestamp string.
+
+    Returns:
+        datetime: The parsed timestamp.
+
+    Raises:
+        ValueError: If the value is not in the expected format.
+    """
+    if len(value) == 14 and value.isdigit():
+        try:
+            return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                            int(value[8:10]), int(value[10:12]), int(value[12:14]))
+        except ValueError:
+            pass
+    return datetime.strptime(value, HL7_FORMAT)
+
+def duration_days(start_date_str, stop_date_str):
+    """Number of days between two ISO timestamps, inclusive of both dates.
+
+    Args:
+        start_date_str (str): The start timestamp.
+        stop_date_str (str): The stop timestamp.
+
+    Returns:
+        int: The inclusive duration in days.
+
+    Raises:
+        ValueError: If either timestamp is malformed.
+    """
+    return (parse_iso_timestamp(stop_date_str) - parse_iso_timestamp(start_date_str)).days + 1
+
+def days_since(date_str):
+    """Number of days between an ISO timestamp and the reference timestamp.
+
+    Args:
+        date_str (str): The timestamp.
+
+    Returns:
+        int: The number of whole days elapsed.
+
+    Raises:
+        ValueError: If the timestamp is malformed.
+    """
+    return (get_reference_time() - parse_iso_timestamp(date_str)).days
+
+def age_in_years(birth_time_str):
+    """Age in whole years at the reference timestamp.
+
+    Args:
+        birth_time_str (str): The birth time in the format 'YYYYMMDDHHMMSS'.
+
+    Returns:
+        int: The age in years.
+    """
+    birth_time = parse_hl7_timestamp(birth_time_str)
+    today = get_reference_time()
+    return today.year - birth_time.year - ((today.month, today.day) < (birth_time.month, birth_time.day))
+
+def age_in_fractional_years(birth_time_str):
+    """Age in years at the reference timestamp, including the fraction of the current year.
+
+    Args:
+        birth_time_str (str): The birth time in the format 'YYYYMMDDHHMMSS'.
+
+    Returns:
+        float: The whole years of age_in_years plus the days since the last birthday over 365.25,
+        so ages given in months or weeks can be compared with it.
+    """
+    birth_time = parse_hl7_timestamp(birth_time_str)
+    years = age_in_years(birth_time_str)
+    try:
+        last_birthday = birth_time.date().replace(year=birth_time.year + years)
+    except ValueError:
+        # Born on February 29, the birthday falls on March 1 in common years
+        last_birthday = datetime(birth_time.year + years, 3, 1).date()
+    return years + (get_reference_time().date() - last_birthday).days / 365.25
@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import logging
+import numpy as np
+from src.metrics import configure_logging
+from src.utils import write_json_atomic
+from src.ai.criteria import parse_criteria_text
+from src.ai.retrieval import load_brief_summaries, trial_document, read_trial_directory
+
+logger = logging.getLogger(__name__)
+
+# Small sentence-embedding model that runs on CPU (384 dimensions)
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# Files of an embedding index directory: the vector matrix and the trial ID and content hash of each row
+VECTORS_FILE = 'vectors.npy'
+META_FILE = 'vectors.json'
+
+def normalize_rows(vectors):
+    """Scale each row to unit length, so inner products are cosine similarities.
+
+    Args:
+        vectors (numpy.ndarray): Matrix of row vectors.
+
+    Returns:
+        numpy.ndarray: The normalized float32 matrix. All-zero rows are left as they are.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+class SentenceEncoder:
+    """
+    Mean-pooled sentence embeddings from a local transformers model, on CPU by default.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=32, max_length=256, device='cpu'):
+        """
+        Args:
+            model_name (str): Hugging Face model name or local directory.
+            batch_size (int): Number of texts encoded per forward pass.
+            max_length (int): Texts are truncated to this many tokens.
+            device (str): The torch device to run the model on.
+        """
+        # torch and transformers are only needed when texts are actually encoded
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(device).eval()
+
+    def encode(self, texts):
+        """Embed texts in batches.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            numpy.ndarray: One unit-length float32 row per text.
+        """
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors='pt').to(self.device)
+            with self.torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            # Average the token vectors, ignoring padding
+            mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            batches.append(pooled.cpu().numpy())
+        if not batches:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        return normalize_rows(np.vstack(batches))
+
+def patient_text(patient_ehr):
+    """Text embedded for a patient: the distinct descriptions of their problem list.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        str: The descriptions without their SNOMED semantic tags, joined by '; '.
+    """
+    descriptions = {row.get('Description') for row in patient_ehr.get('Problems') or []}
+    return '; '.join(sorted(re.sub(r'\s*\([^)]*\)\s*$', '', d) for d in descriptions if d))
+
+class EmbeddingIndex:
+    """
+    Trial embeddings in a memory-mapped matrix, cached by content hash, with top-K search.
+    """
+
+    def __init__(self, index_dir):
+        """
+        Args:
+            index_dir (str): Directory holding the vector matrix and its metadata. The cache
+                is loaded if it exists.
+        """
+        self.index_dir = index_dir
+        self.vectors_path = os.path.join(index_dir, VECTORS_FILE)
+        self.meta_path = os.path.join(index_dir, META_FILE)
+        self.model_name = None
+        self.trial_ids = []
+        self.hashes = []
+        self.vectors = None
+        self._approximate = None
+        self._load()
+
+    def _load(self):
+        """Memory-map the matrix, discarding a cache whose metadata does not match it."""
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.vectors_path)):
+            return
+        with open(self.meta_path, 'r') as f:
+            meta = json.load(f)
+        vectors = np.load(self.vectors_path, mmap_mode='r')
+        if vectors.shape[0] != len(meta["trialIds"]):
+            logger.warning("Embedding index in %s is inconsistent, rebuilding it", self.index_dir)
+            return
+        self.model_name = meta["model"]
+        self.trial_ids = meta["trialIds"]
+        self.hashes = meta["hashes"]
+        self.vectors = vectors
+
+    def update(self, trials, encoder, brief_summaries=None):
+        """Embed new and changed trials and drop the ones that are gone.
+
+        Trials whose document hash is cached are not re-encoded. Changing the encoder's
+        model re-encodes every trial.
+
+        Args:
+            trials (list): Dictionaries with the 'trialId' and 'criteria' text of each trial, and
+                optionally its compiled criteria 'record', as returned by model.load_trials.
+            encoder (SentenceEncoder): Encoder of the trial documents.
+            brief_summaries (dict, optional): Brief summaries keyed by NCT number.
+
+        Returns:
+            dict: The number of trials 'encoded', 'cached' and 'removed'.
+        """
+        brief_summaries = brief_summaries or {}
+        cached = {}
+        if self.model_name == encoder.model_name:
+            cached = {(trial_id, content_hash): row
+                      for row, (trial_id, content_hash) in enumerate(zip(self.trial_ids, self.hashes))}
+
+        trial_ids, hashes, sources, documents = [], [], [], []
+        for trial in trials:
+            record = trial.get("record") or parse_criteria_text(trial["criteria"], trial["trialId"])
+            document = trial_document(record, brief_summaries.get(trial["trialId"]))
+            content_hash = hashlib.sha256(document.encode('utf-8')).hexdigest()
+            trial_ids.append(trial["trialId"])
+            hashes.append(content_hash)
+            row = cached.get((trial["trialId"], content_hash))
+            sources.append(row)
+            if row is None:
+                documents.append(document)
+
+        encoded = encoder.encode(documents) if documents else None
+        summary = {
+            "encoded": len(documents),
+            "cached": len(trials) - len(documents),
+            "removed": len(set(self.trial_ids) - set(trial_ids)),
+        }
+        if summary["encoded"] or summary["removed"] or trial_ids != self.trial_ids:
+            dimension = encoded.shape[1] if encoded is not None else self.vectors.shape[1]
+            self._write(trial_ids, hashes, sources, encoded, dimension, encoder.model_name)
+
+        logger.info("Embedding index: %s encoded, %s cached, %s removed",
+                    summary['encoded'], summary['cached'], summary['removed'])
+        return summary
+
+    def _write(self, trial_ids, hashes, sources, encoded, dimension, model_name):
+        """Write the new matrix row by row from the cache and the fresh embeddings, then swap it in."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = f"{self.vectors_path}.tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(trial_ids), dimension))
+        new_row = 0
+        for row, source in enumerate(sources):
+            if source is None:
+                matrix[row] = encoded[new_row]
+                new_row += 1
+            else:
+                matrix[row] = self.vectors[source]
+        matrix.flush()
+        del matrix
+
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        write_json_atomic(self.meta_path, {"model": model_name, "trialIds": trial_ids, "hashes": hashes}, indent=None)
+        self._approximate = None
+        self._load()
+
+    def _approximate_index(self):
+        """Build a faiss HNSW index over the vectors, or return None if faiss is not installed."""
+        if self._approximate is None:
+            try:
+                import faiss
+            except ImportError:
+                logger.warning("faiss is not installed, using brute-force search")
+                self._approximate = False
+                return None
+            index = faiss.IndexHNSWFlat(self.vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            index.add(np.ascontiguousarray(self.vectors))
+            self._approximate = index
+        return self._approximate or None
+
+    def search(self, query, top_k, trial_ids=None, approximate=False):
+        """Find the trials most similar to a query vector.
+
+        Args:
+            query (numpy.ndarray): A unit-length query vector.
+            top_k (int): Number of trials to return.
+            trial_ids (iterable, optional): Only return these trials.
+            approximate (bool): Search an approximate faiss index instead of scanning every
+                vector. Falls back to the brute-force scan when faiss is not installed.
+
+        Returns:
+            list: (trial_id, cosine similarity) tuples, best first.
+        """
+        if self.vectors is None or not self.trial_ids:
+            return []
+        allowed = set(trial_ids) if trial_ids is not None else None
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+
+        index = self._approximate_index() if approximate else None
+        if index is not None:
+            # Ask for enough neighbours that filtering still leaves top_k of them
+            k = min(len(self.trial_ids), top_k + (len(self.trial_ids) - len(allowed) if allowed is not None else 0))
+            scores, rows = index.search(query, k)
+            results = [(self.trial_ids[row], float(score)) for row, score in zip(rows[0], scores[0])
+                       if row >= 0 and (allowed is None or self.trial_ids[row] in allowed)]
+            return results[:top_k]
+
+        scores = self.vectors @ query[0]
+        if allowed is not None:
+            scores = np.where([trial_id in allowed for trial_id in self.trial_ids], scores, -np.inf)
+        count = min(top_k, int(np.isfinite(scores).sum()))
+        if count == 0:
+            return []
+        rows = np.argpartition(-scores, count - 1)[:count]
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+        return [(self.trial_ids[row], float(scores[row])) for row in rows]
+
+def update_embedding_index(index_dir, trials, encoder, csv_path=None):
+    """Load the embedding index of a directory and bring it up to date with the trials.
+
+    The command line and retrieval.restrict_to_candidates both build the index here, so the
+    trial documents, and their cached hashes, carry the same brief summaries.
+
+    Args:
+        index_dir (str): Directory of the embedding index.
+        trials (list): Trials as returned by model.load_trials.
+        encoder (SentenceEncoder): Encoder of the trial documents.
+        csv_path (str, optional): The study links CSV with the brief summaries.
+
+    Returns:
+        EmbeddingIndex: The updated index.
+    """
+    brief_summaries = load_brief_summaries(csv_path) if csv_path else None
+    index = EmbeddingIndex(index_dir)
+    index.update(trials, encoder, brief_summaries)
+    return index
+
+def shortlist_candidates(index, patients, trials, top_k, encoder, approximate=False):
+    """Mark the top-K most similar trials of every patient.
+
+    Args:
+        index (EmbeddingIndex): The trial embeddings.
+        patients (list): (patient_id, patient_ehr) tuples.
+        trials (list): Trials as returned by model.load_trials.
+        top_k (int): Number of candidate trials per patient.
+        encoder (SentenceEncoder): Encoder of the patient problem lists.
+        approximate (bool): Use the approximate faiss index, see EmbeddingIndex.search.
+
+    Returns:
+        numpy.ndarray: Boolean matrix of shape (len(patients), len(trials)), True for candidate pairs.
+    """
+    columns = {trial["trialId"]: column for column, trial in enumerate(trials)}
+    candidates = np.zeros((len(patients), len(trials)), dtype=bool)
+    queries = encoder.encode([patient_text(patient_ehr) for _, patient_ehr in patients])
+    for row, query in enumerate(queries):
+        for trial_id, _ in index.search(query, top_k, trial_ids=columns, approximate=approximate):
+            candidates[row, columns[trial_id]] = True
+    return candidates
+
+if __name__ == "__main__":
+    configure_logging()
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build or update the trial embedding index.")
+    parser.add_argument('--trial-dir', default=os.path.join(current_dir, '..', '..', 'data', 'raw', 'scraped'),
+                        help="Directory containing the <trial_id>_criteria.txt files.")
+    parser.add_argument('--csv', default=os.path.join(current_dir, '..', '..', 'data', 'raw', 'study-links.csv'),
+                        help="The study links CSV with the brief summaries.")
+    parser.add_argument('--index-dir', default=os.path.join(current_dir, '..', '..', 'data', 'processed', 'embeddings'),
+                        help="Directory of the embedding index.")
+    parser.add_argument('--model', default=EMBEDDING_MODEL, help="Sentence-embedding model name or directory.")
+    parser.add_argument('--batch-size', type=int, default=32, help="Texts encoded per forward pass.")
+    args = parser.parse_args()
+
+    update_embedding_index(args.index_dir, read_trial_directory(args.trial_dir),
+                           SentenceEncoder(args.model, batch_size=args.batch_size), args.csv)
@@ -0,0 +1,134 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+# Criterion IDs in the trial blocks of a batched prompt, e.g. '- I3: Age 18 or older' or '- E1 (for Mothers): ...'
+CRITERION_ID_PATTERN = re.compile(r'^\s*- ([IE]\d+)\b', re.MULTILINE)
+TRIAL_BLOCK_PATTERN = re.compile(r'^\s*Trial (NCT\w+):$', re.MULTILINE)
+
+def stable_fraction(*parts):
+    """Map strings to a number in [0, 1) that is the same on every run and platform."""
+    digest = hashlib.sha256('\0'.join(parts).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic offline stand-in for ChatOpenAI, for benchmarks and runs without an API key.
+
+    It recognises the keyword, evaluation and batched prompts of src/ai and answers them in the
+    format their parsers expect. Each criterion is answered "No" with probability no_rate,
+    decided by a hash of the prompt and the criterion, so reruns give identical answers.
+    Every call sleeps for the configured latency and reports token usage like the real API.
+    """
+
+    latency: float = 0.0
+    latency_per_1k_tokens: float = 0.0
+    no_rate: float = 0.05
+    completion_tokens: Optional[int] = None
+    call_seconds: List[float] = []
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    @property
+    def _identifying_params(self):
+        # The verdicts depend on no_rate, so it is part of the LLM cache key
+        return {"no_rate": self.no_rate}
+
+    def answer(self, prompt):
+        """Build the response text of a rendered prompt.
+
+        Args:
+            prompt (str): The rendered prompt.
+
+        Returns:
+            str: A JSON object per trial and criterion ID for batched prompts, a JSON
+            "criteria" list with one verdict per keyword for evaluation prompts, one keyword
+            per criterion for keyword prompts, and 'Yes' otherwise.
+        """
+        if 'Respond with a single JSON object' in prompt:
+            blocks = TRIAL_BLOCK_PATTERN.split(prompt)
+            return json.dumps({
+                trial_id: {criterion_id: self._verdict(prompt, trial_id, criterion_id)
+                           for criterion_id in CRITERION_ID_PATTERN.findall(block)}
+                for trial_id, block in zip(blocks[1::2], blocks[2::2])
+            })
+
+        if 'Criteria Keywords:' in prompt:
+            keywords = prompt.split('Criteria Keywords:', 1)[1].split('Patient Information:', 1)[0]
+            section, verdicts = "Inclusion", []
+            for line in keywords.splitlines():
+                keyword = line.strip().lstrip('-*0123456789. ').strip()
+                if keyword.endswith(':'):
+                    header = keyword.split()[0].rstrip(':')
+                    section = header if header in ("Inclusion", "Exclusion") else "Other"
+                elif keyword:
+                    verdicts.append({"section": section, "criterion": keyword,
+                                     "verdict": self._verdict(prompt, keyword), "reason": ""})
+            return json.dumps({"criteria": verdicts})
+
+        if 'Trial Criteria:' in prompt:
+            criteria = prompt.split('Trial Criteria:', 1)[1].split('For each criterion, identify', 1)[0]
+            lines = []
+            for line in criteria.splitlines():
+                line = line.strip()
+                if line.endswith('Criteria:'):
+                    lines.append(line)
+                elif line and line[0] in '-*0123456789':
+                    words = re.findall(r'[A-Za-z][A-Za-z\-]+', line)
+                    if words:
+                        lines.append(f"- {' '.join(words[:3])}")
+            return '\n'.join(lines)
+
+        return 'Yes'
+
+    def _verdict(self, prompt, *parts):
+        return "No" if stable_fraction(prompt, *parts) < self.no_rate else "Yes"
+
+    def _respond(self, messages):
+        """Render the answer and its usage, and return it with the simulated latency."""
+        prompt = '\n'.join(str(message.content) for message in messages)
+        content = self.answer(prompt)
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = self.completion_tokens if self.completion_tokens is not None else max(1, len(content) // 4)
+        delay = self.latency + self.latency_per_1k_tokens * (prompt_tokens + completion_tokens) / 1000
+        usage = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay, usage
+
+    def _record(self, start, usage):
+        with self._lock:
+            self.call_seconds.append(time.perf_counter() - start)
+            self.prompt_tokens += usage["input_tokens"]
+            self.output_tokens += usage["output_tokens"]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        start = time.perf_counter()
+        result, delay, usage = self._respond(messages)
+        if delay:
+            time.sleep(delay)
+        self._record(start, usage)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None,
+                         **kwargs: Any) -> ChatResult:
+        start = time.perf_counter()
+        result, delay, usage = self._respond(messages)
+        if delay:
+            await asyncio.sleep(delay)
+        self._record(start, usage)
+        return result
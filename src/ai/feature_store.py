@@ -0,0 +1,213 @@
+import os
+import json
+import re
+import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Key shared by every table of the store
+PATIENT_ID = 'Patient ID'
+
+# Demographic fields stored as one row per patient
+DEMOGRAPHIC_FIELDS = ['Patient ID', 'Given Name', 'Gender', 'Birth Time', 'Age', 'Race', 'Ethnic Group', 'Language']
+
+DEMOGRAPHICS_FILE = 'demographics.arrow'
+SECTION_FILE_PREFIX = 'section_'
+
+def section_file_name(section_title):
+    """Name of the Arrow IPC file holding a section in long format.
+
+    Args:
+        section_title (str): The section title, e.g. 'Vital Signs'.
+
+    Returns:
+        str: The file name, e.g. 'section_vital_signs.arrow'.
+    """
+    slug = re.sub(r'[^a-z0-9]+', '_', section_title.lower()).strip('_')
+    return f"{SECTION_FILE_PREFIX}{slug}.arrow"
+
+def is_feature_store(path):
+    """Check whether a directory holds a columnar patient feature store.
+
+    Args:
+        path (str): The directory to check.
+
+    Returns:
+        bool: True if the directory contains the demographics table.
+    """
+    return os.path.isfile(os.path.join(path, DEMOGRAPHICS_FILE))
+
+def _write_table(table, path):
+    """Write a table as an uncompressed Arrow IPC file, atomically, so it can be memory-mapped."""
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def _section_schema(section_title, rows):
+    """Build the schema of a long-format section table from its rows.
+
+    Columns keep the order in which keys first appear. Numeric day counts (keys ending
+    in ' Days') are integers; every other column is a string.
+    """
+    columns = [PATIENT_ID]
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    fields = [pa.field(column, pa.int64() if column.endswith(' Days') else pa.string()) for column in columns]
+    return pa.schema(fields, metadata={'section': section_title})
+
+def build_feature_store(patient_records, store_directory):
+    """Write patient data dictionaries as a columnar feature store.
+
+    Args:
+        patient_records (iterable): Patient data dictionaries as produced by the preprocessor.
+        store_directory (str): Directory where the Arrow IPC files are written.
+
+    Returns:
+        dict: The number of patients and the number of rows written per section.
+
+    The store holds one demographics table with a row per patient and, for every section,
+    a long-format table with one row per section entry keyed by 'Patient ID'.
+    """
+    os.makedirs(store_directory, exist_ok=True)
+
+    demographics = []
+    section_rows = {}
+    for patient_data in patient_records:
+        patient_id = patient_data.get(PATIENT_ID)
+        demographics.append({field: patient_data.get(field) for field in DEMOGRAPHIC_FIELDS})
+        for key, value in patient_data.items():
+            if isinstance(value, list):
+                section_rows.setdefault(key, []).extend(dict(row, **{PATIENT_ID: patient_id}) for row in value)
+
+    demographics_schema = pa.schema(
+        [pa.field(field, pa.int64() if field == 'Age' else pa.string()) for field in DEMOGRAPHIC_FIELDS]
+    )
+    _write_table(pa.Table.from_pylist(demographics, schema=demographics_schema),
+                 os.path.join(store_directory, DEMOGRAPHICS_FILE))
+
+    # Drop section tables left over from a previous build
+    wanted_files = {section_file_name(section_title) for section_title in section_rows}
+    for file_name in os.listdir(store_directory):
+        if file_name.startswith(SECTION_FILE_PREFIX) and file_name.endswith('.arrow') and file_name not in wanted_files:
+            os.remove(os.path.join(store_directory, file_name))
+
+    for section_title, rows in section_rows.items():
+        schema = _section_schema(section_title, rows)
+        _write_table(pa.Table.from_pylist(rows, schema=schema),
+                     os.path.join(store_directory, section_file_name(section_title)))
+
+    logger.info("Feature store written to %s: %s patients, %s sections",
+                store_directory, len(demographics), len(section_rows))
+    return {"patients": len(demographics), "sections": {title: len(rows) for title, rows in section_rows.items()}}
+
+def build_feature_store_from_json(json_directory, store_directory):
+    """Build the feature store from a directory of {patient_id}_data.json files.
+
+    Args:
+        json_directory (str): Directory containing the processed patient JSON files.
+        store_directory (str): Directory where the Arrow IPC files are written.
+
+    Returns:
+        dict: The summary returned by build_feature_store.
+    """
+    def records():
+        for file_name in sorted(os.listdir(json_directory)):
+            if file_name.endswith('_data.json'):
+                with open(os.path.join(json_directory, file_name)) as f:
+                    yield json.load(f)
+
+    return build_feature_store(records(), store_directory)
+
+def _read_table(path, columns=None, patient_ids=None):
+    """Memory-map an Arrow IPC table and keep only the requested columns and patients."""
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select([PATIENT_ID] + [c for c in columns if c != PATIENT_ID and c in table.column_names])
+    if patient_ids is not None:
+        table = table.filter(pc.is_in(table[PATIENT_ID], value_set=pa.array(list(patient_ids), type=pa.string())))
+    return table
+
+def list_sections(store_directory):
+    """List the section titles available in a feature store.
+
+    Args:
+        store_directory (str): The feature store directory.
+
+    Returns:
+        list: The section titles.
+    """
+    titles = []
+    for file_name in sorted(os.listdir(store_directory)):
+        if file_name.startswith(SECTION_FILE_PREFIX) and file_name.endswith('.arrow'):
+            schema = pa.ipc.open_file(pa.memory_map(os.path.join(store_directory, file_name), 'r')).schema
+            titles.append(schema.metadata[b'section'].decode('utf-8'))
+    return titles
+
+def load_demographics(store_directory, columns=None, patient_ids=None):
+    """Load the demographics table.
+
+    Args:
+        store_directory (str): The feature store directory.
+        columns (list, optional): Columns to load besides 'Patient ID'. Defaults to all.
+        patient_ids (iterable, optional): Patients to keep. Defaults to all.
+
+    Returns:
+        pyarrow.Table: The demographics rows.
+    """
+    return _read_table(os.path.join(store_directory, DEMOGRAPHICS_FILE), columns, patient_ids)
+
+def load_section(store_directory, section_title, columns=None, patient_ids=None):
+    """Load the long-format table of one section.
+
+    Args:
+        store_directory (str): The feature store directory.
+        section_title (str): The section title, e.g. 'Medications'.
+        columns (list, optional): Columns to load besides 'Patient ID'. Defaults to all.
+        patient_ids (iterable, optional): Patients to keep. Defaults to all.
+
+    Returns:
+        pyarrow.Table: The section rows, or None if the store has no such section.
+    """
+    path = os.path.join(store_directory, section_file_name(section_title))
+    if not os.path.exists(path):
+        return None
+    return _read_table(path, columns, patient_ids)
+
+def load_patient_records(store_directory, patient_ids=None, demographic_columns=None, sections=None,
+                         section_columns=None):
+    """Rebuild patient data dictionaries from the feature store for a batch of patients.
+
+    Args:
+        store_directory (str): The feature store directory.
+        patient_ids (iterable, optional): Patients to load. Defaults to all.
+        demographic_columns (list, optional): Demographic fields to load. Defaults to all.
+        sections (list, optional): Section titles to load. Defaults to every section in the store.
+        section_columns (dict, optional): Columns to load per section title. Defaults to all.
+
+    Returns:
+        list: (patient_id, patient_data) tuples in the order of the demographics table.
+    """
+    demographics = load_demographics(store_directory, demographic_columns, patient_ids)
+    records = [(row[PATIENT_ID], row) for row in demographics.to_pylist()]
+    by_id = {patient_id: patient_data for patient_id, patient_data in records}
+
+    for section_title in (sections if sections is not None else list_sections(store_directory)):
+        columns = (section_columns or {}).get(section_title)
+        table = load_section(store_directory, section_title, columns, patient_ids)
+        if table is None:
+            continue
+        for patient_data in by_id.values():
+            patient_data[section_title] = []
+        for row in table.to_pylist():
+            patient_data = by_id.get(row.pop(PATIENT_ID))
+            if patient_data is not None:
+                patient_data[section_title].append(row)
+
+    return records
@@ -0,0 +1,166 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from src.metrics import metrics
+
+# Default upper bound for the cache size on disk (response bytes)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def make_cache_key(model_name, temperature, prompt):
+    """Build the content address of a prompt for a given model configuration.
+
+    Args:
+        model_name (str): The name of the chat model, e.g. 'gpt-4o-mini'.
+        temperature (float): The sampling temperature used for the call.
+        prompt (str): The fully rendered prompt.
+
+    Returns:
+        str: The hex SHA-256 digest identifying the request.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{model_name}\x00{float(temperature)!r}\x00".encode('utf-8'))
+    digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+class LLMCache:
+    """Persistent, content-addressed cache of LLM responses stored in SQLite.
+
+    Entries are keyed by model name, temperature and a hash of the prompt. When the
+    total size of the stored responses exceeds max_bytes, the least recently used
+    entries are evicted. Setting bypass disables both lookups and writes.
+    """
+
+    def __init__(self, cache_path, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+        """Open (or create) the cache database.
+
+        Args:
+            cache_path (str): Path of the SQLite database file.
+            max_bytes (int): Maximum total size of cached responses in bytes.
+            bypass (bool): If True, the cache is neither read nor written.
+        """
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+        self._conn.commit()
+        self._size = self._total_size()
+
+    def _total_size(self):
+        """Return the total size in bytes of all stored responses."""
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return row[0]
+
+    def get(self, model_name, temperature, prompt):
+        """Look up a cached response.
+
+        Args:
+            model_name (str): The name of the chat model.
+            temperature (float): The sampling temperature.
+            prompt (str): The fully rendered prompt.
+
+        Returns:
+            str: The cached response text, or None on a miss or when bypassed.
+        """
+        if self.bypass:
+            return None
+
+        key = make_cache_key(model_name, temperature, prompt)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc('llm_cache_lookups_total', result='miss')
+                return None
+
+            self.hits += 1
+            metrics.inc('llm_cache_lookups_total', result='hit')
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, model_name, temperature, prompt, response):
+        """Store a response and evict least recently used entries if the cache is full.
+
+        Args:
+            model_name (str): The name of the chat model.
+            temperature (float): The sampling temperature.
+            prompt (str): The fully rendered prompt.
+            response (str): The response text returned by the model.
+        """
+        if self.bypass:
+            return
+
+        key = make_cache_key(model_name, temperature, prompt)
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, temperature, response, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, float(temperature), response, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits within max_bytes."""
+        # Other processes may share the database, so start from the real size
+        self._size = self._total_size()
+        cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC")
+        evicted = []
+        for key, size in cursor:
+            if self._size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        """Return the hit/miss counters and the current size of the cache.
+
+        Returns:
+            dict: Hits, misses, number of entries and stored bytes.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "sizeBytes": self._size,
+        }
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._size = 0
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -1,28 +1,218 @@
 import json
 import os
+import time
+import hashlib
+import logging
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage
 from dotenv import load_dotenv
+from src.metrics import configure_logging, metrics
+from src.utils import write_json_atomic
+from src.ai.llm_cache import LLMCache, DEFAULT_MAX_BYTES
+from src.ai.prefilter import parse_other_criteria, prefilter_pairs, report_prefilter
+from src.ai.feature_store import is_feature_store, load_patient_records
+from src.ai.preprocess import refresh_relative_values
+from src.ai.criteria import CompiledCriteria, is_compiled_criteria, render_criteria_text
+from src.ai.patient_summary import DEFAULT_SUMMARY_TOKENS, PromptSizeStats, summarize_patient
+from src.ai.tokens import count_tokens
+from src.ai.retrieval import restrict_to_candidates
+from src.ai.results import ResultSink, merge_eligibility_file
+from src.ai.rule_engine import RuleStats, resolve_criteria, render_criteria_keywords
+from src.ai.verdicts import (EVALUATION_RESPONSE_FORMAT, ResponseFormatError, parse_verdicts,
+                             verdicts_to_eligibility_dict)
+
+logger = logging.getLogger(__name__)
+
+# Chat model configuration shared by every prompt
+MODEL_NAME = 'gpt-4o-mini'
+TEMPERATURE = 0
+
+# Patient fields and sections used in the evaluation prompt
+RELEVANT_DEMOGRAPHICS = ["Gender", "Age", "Race", "Ethnic Group", "Language"]
+RELEVANT_SECTIONS = ["Vital Signs", "Medications", "Problems", "Surgeries", "Immunizations"]
+
+# Chat model returned by get_llm instead of ChatOpenAI, set with configure_llm
+llm_override = None
+
+# Persistent LLM response cache, enabled with configure_llm_cache
+llm_cache = None
+
+# Token budget of the compact patient summary sent in prompts, enabled with configure_patient_summary
+patient_summary_tokens = None
+prompt_size_stats = PromptSizeStats()
+
+# Patient context of the patient rendered last, with the budget it was rendered for; the runners
+# evaluate each patient against all its trials in a row
+_context_cache = (None, None, None)
+
+# Statistics of the local rule engine, which is enabled with configure_rule_engine
+rule_stats = None
+
+def configure_llm_cache(cache_path, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+    """Enable the on-disk LLM response cache used by call_llm.
 
-# Load environment variables
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
+    Args:
+        cache_path (str): Path of the SQLite database holding the cached responses.
+        max_bytes (int): Maximum total size of cached responses before LRU eviction.
+        bypass (bool): If True, every prompt is sent to the model and nothing is cached.
 
-def identify_criteria_keywords(trial_criteria):
-    """Identify relevant keywords from clinical trial criteria.
+    Returns:
+        LLMCache: The configured cache.
+    """
+    global llm_cache
+    llm_cache = LLMCache(cache_path, max_bytes=max_bytes, bypass=bypass)
+    return llm_cache
+
+def configure_patient_summary(max_tokens=DEFAULT_SUMMARY_TOKENS):
+    """Send a compact, token-budgeted patient summary in prompts instead of the raw EHR data.
 
     Args:
-        trial_criteria (str): The criteria text from a clinical trial.
+        max_tokens (int, optional): Token budget of the summary. None sends the raw data again.
 
     Returns:
-        str: A response from the language model identifying relevant keywords or attributes 
-        from the provided trial criteria.
+        PromptSizeStats: New statistics of the patient context size in the prompts that follow.
+    """
+    global patient_summary_tokens, prompt_size_stats
+    patient_summary_tokens = max_tokens
+    prompt_size_stats = PromptSizeStats()
+    return prompt_size_stats
 
-    This function communicates with a language model to extract significant keywords 
-    related to patient eligibility criteria from the input trial criteria.
+def configure_rule_engine(enabled=True):
+    """Decide the numeric and temporal criteria locally and only send the others to the model.
+
+    Args:
+        enabled (bool): Use the rule engine of src/ai/rule_engine.py. False sends every criterion
+            to the model again.
+
+    Returns:
+        RuleStats: New statistics of the criteria resolved without an LLM call, or None.
+    """
+    global rule_stats
+    rule_stats = RuleStats() if enabled else None
+    return rule_stats
+
+def configure_llm(llm):
+    """Use another chat model for all prompts, e.g. the offline fake of src/ai/fake_llm.py.
+
+    Args:
+        llm (BaseChatModel, optional): The chat model get_llm returns. None restores ChatOpenAI.
+    """
+    global llm_override
+    llm_override = llm
+
+def get_llm(**kwargs):
+    """Create the chat model used for all prompts.
+
+    Args:
+        **kwargs: Extra ChatOpenAI options, e.g. base_url or max_retries. They are ignored
+            when another chat model is set with configure_llm.
+
+    Returns:
+        ChatOpenAI: The configured chat model.
+    """
+    if llm_override is not None:
+        return llm_override
+    # Load the API key from the environment or a .env file when a model is first needed, not on import
+    load_dotenv()
+    return ChatOpenAI(temperature=TEMPERATURE, model=MODEL_NAME, openai_api_key=os.getenv("OPENAI_API_KEY"), **kwargs)
+
+# Identifying parameters of a chat model that do not change its answers
+NEUTRAL_MODEL_PARAMS = {'model_name', 'model', 'temperature', 'stream', 'n'}
+
+def cache_identity(llm=None, response_format=None):
+    """The model name and temperature an LLM cache entry of a call is stored under.
+
+    Args:
+        llm (BaseChatModel, optional): The chat model called, possibly with bound options.
+            Defaults to the model get_llm returns.
+        response_format (dict, optional): Structured output format requested from the model.
+
+    Returns:
+        tuple: (model_name, temperature). The name is the effective model's name, followed by
+        its bound options, the response format and any other identifying parameter that
+        changes its answers, so that different models and formats never share entries.
+    """
+    llm = llm if llm is not None else llm_override
+    if llm is None:
+        name, temperature, options = MODEL_NAME, TEMPERATURE, {}
+    else:
+        options = {}
+        # Unwrap the bindings of llm.bind(...), the outermost options winning
+        while hasattr(llm, 'bound') and hasattr(llm, 'kwargs'):
+            options = {**llm.kwargs, **options}
+            llm = llm.bound
+        params = dict(getattr(llm, '_identifying_params', None) or {})
+        name = params.get('model_name') or params.get('model') or getattr(llm, '_llm_type', type(llm).__name__)
+        temperature = params.get('temperature')
+        temperature = TEMPERATURE if temperature is None else temperature
+        options.update((key, value) for key, value in params.items() if key not in NEUTRAL_MODEL_PARAMS)
+    if response_format is not None:
+        options['response_format'] = response_format
+    if options:
+        name = f"{name}|{json.dumps(options, sort_keys=True, default=str)}"
+    return name, temperature
+
+def record_llm_call(prompt, response, seconds):
+    """Count a chat model call, its latency and its token usage in the metrics registry.
+
+    Args:
+        prompt (str): The rendered prompt.
+        response (AIMessage): The model response. Its usage metadata gives the token counts;
+            without it they are counted with the tokenizer.
+        seconds (float): The call duration.
+    """
+    usage = getattr(response, 'usage_metadata', None) or {}
+    metrics.inc('llm_calls_total')
+    metrics.observe('llm_call_seconds', seconds)
+    metrics.inc('llm_prompt_tokens_total', usage.get('input_tokens') or count_tokens(prompt))
+    metrics.inc('llm_completion_tokens_total', usage.get('output_tokens') or count_tokens(response.content))
+
+def call_llm(prompt, llm=None, response_format=None, validate=None):
+    """Send a rendered prompt to the chat model, going through the response cache if enabled.
+
+    Args:
+        prompt (str): The fully rendered prompt.
+        llm (ChatOpenAI, optional): The chat model to call. Defaults to get_llm().
+        response_format (dict, optional): Structured output format requested from the model,
+            e.g. verdicts.EVALUATION_RESPONSE_FORMAT.
+        validate (callable, optional): Called with the response text before it is cached. Its
+            exception is raised to the caller, and the invalid response is not cached, so that
+            calling again asks the model again.
+
+    Returns:
+        AIMessage: The model response, rebuilt from the cache on a hit.
+    """
+    model_name, temperature = cache_identity(llm, response_format)
+    if llm_cache is not None:
+        cached_response = llm_cache.get(model_name, temperature, prompt)
+        if cached_response is not None:
+            return AIMessage(content=cached_response)
+
+    chat_model = llm or get_llm()
+    if response_format is not None:
+        chat_model = chat_model.bind(response_format=response_format)
+    start = time.perf_counter()
+    response = chat_model.invoke(prompt)
+    record_llm_call(prompt, response, time.perf_counter() - start)
+    if validate is not None:
+        validate(response.content)
+
+    if llm_cache is not None:
+        llm_cache.set(model_name, temperature, prompt, response.content)
+
+    return response
+
+def build_keywords_prompt(trial_criteria):
+    """Render the keyword extraction prompt for a trial.
+
+    Args:
+        trial_criteria (str): The criteria text from a clinical trial.
+
+    Returns:
+        str: The fully rendered prompt.
     """
-    print("Identifying criteria keywords...")
     system_message = """
     You are a clinical trial assistant.
     Your task is to read the inclusion, exclusion, and other criteria of a clinical trial, and identify relevant keywords from each criterion.
@@ -32,8 +222,6 @@ def identify_criteria_keywords(trial_criteria):
     For each criterion, respond with the most relevant keyword or attribute it is concerned with.
     """
 
-    llm = ChatOpenAI(temperature=0, model='gpt-4o-mini', openai_api_key=openai_api_key)
-
     prompt_template = PromptTemplate(
         input_variables=["criteria"],
         template=f"""
@@ -45,8 +233,24 @@ def identify_criteria_keywords(trial_criteria):
         """
     )
     
-    prompt = prompt_template.format(criteria=trial_criteria)
-    response = llm(prompt)
+    return prompt_template.format(criteria=trial_criteria)
+
+def identify_criteria_keywords(trial_criteria):
+    """Identify relevant keywords from clinical trial criteria.
+
+    Args:
+        trial_criteria (str): The criteria text from a clinical trial.
+
+    Returns:
+        str: A response from the language model identifying relevant keywords or attributes 
+        from the provided trial criteria.
+
+    This function communicates with a language model to extract significant keywords 
+    related to patient eligibility criteria from the input trial criteria.
+    """
+    logger.debug("Identifying criteria keywords...")
+    prompt = build_keywords_prompt(trial_criteria)
+    response = call_llm(prompt)
     
     return response
 
@@ -63,7 +267,7 @@ def extract_relevant_patient_data(patient_ehr):
     This function retrieves specific data points from the patient EHR that 
     are necessary for assessing eligibility for clinical trials.
     """
-    print("Extracting relevant patient data...")
+    logger.debug("Extracting relevant patient data...")
     relevant_patient_data = {
         "Gender": patient_ehr.get("Gender"),
         "Age": patient_ehr.get("Age"),
@@ -78,21 +282,43 @@ def extract_relevant_patient_data(patient_ehr):
     }
     return relevant_patient_data
 
-def evaluate_criteria_by_keywords(criteria_keywords, patient_ehr):
-    """Evaluate patient eligibility based on identified keywords and EHR data.
+def format_patient_context(patient_ehr, record_stats=True):
+    """Render the patient information of a prompt.
 
     Args:
-        criteria_keywords (str): Identified keywords from trial criteria.
         patient_ehr (dict): A dictionary containing patient EHR data.
+        record_stats (bool): Record the context size; off for prompts that are only measured.
 
     Returns:
-        str: A response from the language model indicating whether the patient meets 
-        the inclusion or exclusion criteria based on the identified keywords.
+        dict or str: The relevant patient data or, when configure_patient_summary is enabled,
+        its compact summary. The size of both is then recorded in prompt_size_stats.
+    """
+    if patient_summary_tokens is None:
+        return extract_relevant_patient_data(patient_ehr)
+
+    # The summary and both token counts are computed once per patient
+    global _context_cache
+    cached_ehr, cached_budget, context = _context_cache
+    if cached_ehr is not patient_ehr or cached_budget != patient_summary_tokens:
+        summary = summarize_patient(patient_ehr, patient_summary_tokens)
+        context = (summary, count_tokens(str(extract_relevant_patient_data(patient_ehr))), count_tokens(summary))
+        _context_cache = (patient_ehr, patient_summary_tokens, context)
+    summary, raw_tokens, summary_tokens = context
+    if record_stats:
+        prompt_size_stats.record(raw_tokens, summary_tokens)
+    return summary
+
+def build_evaluation_prompt(criteria_keywords, patient_ehr, record_stats=True):
+    """Render the eligibility evaluation prompt for a patient and a trial.
 
-    This function uses a language model to compare patient data against clinical trial 
-    criteria keywords and provide an eligibility assessment for each criterion.
+    Args:
+        criteria_keywords (str): Identified keywords from trial criteria.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        record_stats (bool): Record the patient context size, see format_patient_context.
+
+    Returns:
+        str: The fully rendered prompt.
     """
-    print("Evaluating criteria by keywords...")
     system_message = """
     You are a clinical trial assistant.
     Your task is to compare the patient's information (Gender, Age, Race, Ethnic Group, Language, Vital Signs) 
@@ -109,9 +335,7 @@ def evaluate_criteria_by_keywords(criteria_keywords, patient_ehr):
     - "Yes" if there is no information available to determine eligibility.
     """
 
-    llm = ChatOpenAI(temperature=0, model='gpt-4o-mini', openai_api_key=openai_api_key)
-
-    relevant_patient_data = extract_relevant_patient_data(patient_ehr)
+    relevant_patient_data = format_patient_context(patient_ehr, record_stats)
 
     prompt_template = PromptTemplate(
         input_variables=["criteria_keywords", "patient_data"],
@@ -124,45 +348,189 @@ def evaluate_criteria_by_keywords(criteria_keywords, patient_ehr):
 
         For each criterion keyword, respond with:
         - "Yes" if the patient meets the criterion
-        - "No" if the patient does not meet the criterion and reason
+        - "No" if the patient does not meet the criterion, with the reason
         
         While evaluating one criteria, consider only the respective criteria but not any other criteria.
         
-        The format of response should be as below:
-        
-        Inclusion Criteria:
-        - Keyword Placeholder 1: Yes 
-        - Keyword Placeholder 2: No 
-        .
-        .
-        .
-        
-        Exclusion Criteria:
-        - Keyword Placeholder 1: No
-        - Keyword Placeholder 2: Yes
-        .
-        .
-        .
+        Respond with a JSON object and nothing else, with one entry per criterion keyword in a "criteria" list:
+        {{{{"criteria": [
+            {{{{"section": "Inclusion", "criterion": "Keyword Placeholder 1", "verdict": "Yes", "reason": ""}}}},
+            {{{{"section": "Exclusion", "criterion": "Keyword Placeholder 2", "verdict": "No", "reason": "Short reason"}}}}
+        ]}}}}
         
-        While giving the response, do not output the whole criteria mentioned in the txt file. Instead, just give the keyword and the response.
+        The "section" is "Inclusion", "Exclusion" or "Other". Do not output the whole criteria mentioned in the txt file.
+        Instead, just give the keyword as the "criterion".
       """
     )
 
-    prompt = prompt_template.format(
+    return prompt_template.format(
         criteria_keywords=criteria_keywords,
         patient_data=relevant_patient_data
     )
+
+def evaluate_criteria_by_keywords(criteria_keywords, patient_ehr):
+    """Evaluate patient eligibility based on identified keywords and EHR data.
+
+    Args:
+        criteria_keywords (str): Identified keywords from trial criteria.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        AIMessage: A response from the language model indicating whether the patient meets
+        the inclusion or exclusion criteria based on the identified keywords, as a JSON object
+        of verdicts.EVALUATION_SCHEMA.
+
+    Raises:
+        ResponseFormatError: If the response does not follow the schema. It is not cached, so
+        evaluating the pair again asks the model again.
+
+    This function uses a language model to compare patient data against clinical trial 
+    criteria keywords and provide an eligibility assessment for each criterion.
+    """
+    logger.debug("Evaluating criteria by keywords...")
+    prompt = build_evaluation_prompt(criteria_keywords, patient_ehr)
     
-    response = llm(prompt)
+    response = call_llm(prompt, response_format=EVALUATION_RESPONSE_FORMAT, validate=parse_verdicts)
     
     return response
 
-def process_patient_eligibility(trial_criteria, patient_ehr):
+def hash_criteria_text(trial_criteria):
+    """Compute a stable content hash for a trial's criteria text.
+
+    Args:
+        trial_criteria (str): The criteria text from a clinical trial.
+
+    Returns:
+        str: The hex SHA-256 digest of the criteria text.
+    """
+    return hashlib.sha256(trial_criteria.encode('utf-8')).hexdigest()
+
+def load_trials(trial_dir):
+    """Read every trial criteria file in a directory, or a compiled criteria file, once.
+
+    Args:
+        trial_dir (str): Directory containing trial criteria text files, or a compiled
+            criteria file written by src/ai/criteria.py.
+
+    Returns:
+        list: A list of dictionaries with the trial ID, file path, study title, criteria text
+        and parsed age/sex eligibility, sorted by trial ID.
+
+    From a compiled criteria file, the criteria text is the compact rendering that addresses
+    each criterion by ID, and the compiled 'record' is kept alongside it.
+    """
+    if is_compiled_criteria(trial_dir):
+        with CompiledCriteria(trial_dir) as compiled:
+            return [
+                {
+                    "trialId": record["trialId"],
+                    "path": trial_dir,
+                    "studyTitle": record["studyTitle"],
+                    "criteria": render_criteria_text(record),
+                    "otherCriteria": {key: record[key] for key in ("minAge", "maxAge", "sexes", "healthyVolunteers")},
+                    "record": record,
+                }
+                for record in compiled
+            ]
+
+    trials = []
+    for trial_file in sorted(os.listdir(trial_dir)):
+        if trial_file.endswith('_criteria.txt'):
+            trial_path = os.path.join(trial_dir, trial_file)
+            with open(trial_path) as f:
+                trial_criteria = f.read()
+            trials.append({
+                "trialId": os.path.basename(trial_file).split('_')[0],
+                "path": trial_path,
+                "studyTitle": extract_study_title(trial_path),
+                "criteria": trial_criteria,
+                "otherCriteria": parse_other_criteria(trial_criteria),
+            })
+    return trials
+
+def load_patients(patient_dir, patient_ids=None):
+    """Read the processed patient EHRs from a directory of JSON files or a feature store.
+
+    Args:
+        patient_dir (str): Directory containing patient EHR JSON files, or a columnar
+            feature store written by the preprocessor.
+        patient_ids (iterable, optional): Patients to load. Defaults to all.
+
+    Returns:
+        list: A list of (patient_id, patient_ehr) tuples sorted by file name, or in store order.
+
+    From a feature store, only the demographics and sections used in the evaluation prompt
+    are loaded. The age and last-usage values are recomputed at the current reference time,
+    since the preprocessor reuses unchanged outputs from earlier runs.
+    """
+    if is_feature_store(patient_dir):
+        records = load_patient_records(patient_dir, patient_ids,
+                                       demographic_columns=RELEVANT_DEMOGRAPHICS + ["Birth Time"],
+                                       sections=RELEVANT_SECTIONS)
+        for _, patient_ehr in records:
+            refresh_relative_values(patient_ehr)
+        return records
+
+    wanted_ids = set(patient_ids) if patient_ids is not None else None
+    patients = []
+    for patient_file in sorted(os.listdir(patient_dir)):
+        if patient_file.endswith('.json'):
+            patient_id = patient_file.split('_')[0]
+            if wanted_ids is not None and patient_id not in wanted_ids:
+                continue
+            with open(os.path.join(patient_dir, patient_file)) as f:
+                patients.append((patient_id, refresh_relative_values(json.load(f))))
+    return patients
+
+def precompute_trial_keywords(trials, keywords_path=None):
+    """Identify criteria keywords once per trial instead of once per patient-trial pair.
+
+    Args:
+        trials (list): Trials as returned by load_trials.
+        keywords_path (str, optional): JSON file used to persist the keywords between runs.
+            Entries whose criteria hash still matches the current text are reused as is.
+
+    Returns:
+        dict: A dictionary keyed by trial ID, each value holding the criteria hash and
+        the extracted keywords.
+
+    The keyword extraction only depends on the trial text, so the result is stored keyed by
+    NCT number and the hash of the criteria text, and reused for every patient.
+    """
+    trial_keywords = {}
+    if keywords_path and os.path.exists(keywords_path):
+        with open(keywords_path, 'r') as f:
+            trial_keywords = json.load(f)
+
+    updated = False
+    for trial in trials:
+        criteria_hash = hash_criteria_text(trial["criteria"])
+        entry = trial_keywords.get(trial["trialId"])
+        if entry is not None and entry.get("criteriaHash") == criteria_hash:
+            continue
+
+        logger.debug("Precomputing criteria keywords for trial %s...", trial['trialId'])
+        response = identify_criteria_keywords(trial["criteria"])
+        trial_keywords[trial["trialId"]] = {
+            "criteriaHash": criteria_hash,
+            "keywords": response.content,
+        }
+        updated = True
+
+    if keywords_path and updated:
+        # Written atomically, since work queue workers on other hosts may be reading it
+        write_json_atomic(keywords_path, trial_keywords, indent=2)
+
+    return trial_keywords
+
+def process_patient_eligibility(trial_criteria, patient_ehr, criteria_keywords=None):
     """Process the eligibility of a patient for a given clinical trial.
 
     Args:
         trial_criteria (str): The inclusion and exclusion criteria of the clinical trial.
         patient_ehr (dict): A dictionary containing patient EHR data.
+        criteria_keywords (str, optional): Keywords precomputed for this trial. When omitted
+            they are identified from trial_criteria.
 
     Returns:
         str: A response indicating the evaluation results of the patient's eligibility 
@@ -171,8 +539,9 @@ def process_patient_eligibility(trial_criteria, patient_ehr):
     This function orchestrates the process of identifying relevant keywords from trial 
     criteria and evaluating them against the patient's EHR to determine eligibility.
     """
-    print("Processing patient eligibility...")
-    criteria_keywords = identify_criteria_keywords(trial_criteria)
+    logger.debug("Processing patient eligibility...")
+    if criteria_keywords is None:
+        criteria_keywords = identify_criteria_keywords(trial_criteria).content
     
     eligibility_results = evaluate_criteria_by_keywords(criteria_keywords, patient_ehr)
     
@@ -188,23 +557,25 @@ def parse_eligibility_results(eligibility_results):
         dict: A dictionary containing eligibility criteria as keys and their evaluation 
         results as values.
 
-    This function separates the inclusion and exclusion criteria results from the 
-    language model's response into a structured dictionary.
+    The structured JSON response is validated into typed verdicts (see src/ai/verdicts.py).
+    Responses in the earlier '- <criterion>: <answer>' text format are still parsed line by line.
     """
-    print("Parsing eligibility results...")
-    inclusion_criteria, exclusion_criteria = eligibility_results.split('Exclusion Criteria:')
-    
+    logger.debug("Parsing eligibility results...")
+    try:
+        return verdicts_to_eligibility_dict(parse_verdicts(eligibility_results))
+    except ResponseFormatError:
+        pass
+
     eligibility_dict = {}
     
-    for line in inclusion_criteria.split('\n'):
+    # Inclusion and exclusion answers share the '- <criterion>: <answer>' form; the answer is
+    # taken after the last ': ' so criteria containing colons are kept whole, and lines
+    # without an answer or a missing section are tolerated
+    for line in eligibility_results.split('\n'):
         if line.strip().startswith('-'):
-            key, value = line.strip('- ').split(': ')
-            eligibility_dict[key.strip()] = value.strip()
-    
-    for line in exclusion_criteria.split('\n'):
-        if line.strip().startswith('-'):
-            key, value = line.strip('- ').split(': ')
-            eligibility_dict[key.strip()] = value.strip()
+            key, separator, value = line.strip().lstrip('- ').rpartition(': ')
+            if separator and key.strip():
+                eligibility_dict[key.strip()] = value.strip()
     
     return eligibility_dict
 
@@ -221,7 +592,7 @@ def extract_ids(patient_ehr_path, trial_criteria_path):
     This function retrieves IDs from the filenames of the patient EHR and trial criteria 
     files, which are used for further processing and identification.
     """
-    print("Extracting IDs from file paths...")
+    logger.debug("Extracting IDs from file paths...")
     patient_id = os.path.basename(patient_ehr_path).split('_')[0]
     
     trial_id = os.path.basename(trial_criteria_path).split('_')[0]
@@ -240,7 +611,7 @@ def extract_study_title(trial_criteria_path):
     This function reads the first line of the trial criteria file to extract 
     the study title, which is used in the output JSON.
     """
-    print("Extracting study title from trial criteria...")
+    logger.debug("Extracting study title from trial criteria...")
     with open(trial_criteria_path, 'r') as f:
         first_line = f.readline().strip()
         
@@ -262,7 +633,7 @@ def create_eligibility_json(patient_id, trial_id, study_title, eligibility_dict)
     Returns:
         dict: A JSON-like dictionary representing the trial's eligibility for the patient.
     """
-    print(f"Creating JSON structure for patient {patient_id} and trial {trial_id}...")
+    logger.debug("Creating JSON structure for patient %s and trial %s...", patient_id, trial_id)
     
     eligibility_json = {
         "trialId": trial_id,
@@ -284,35 +655,99 @@ def determine_overall_eligibility(eligibility_dict):
     Returns:
         str: "Yes" if the patient meets all criteria, otherwise "No".
     """
-    print("Determining overall eligibility...")
+    logger.debug("Determining overall eligibility...")
     
     return "Yes" if all(value == 'Yes' for value in eligibility_dict.values()) else "No"
 
 def save_eligibility_json(output_filename, new_trial_info):
     """
-    Save the eligibility information to a JSON file, appending to existing data if the file exists.
+    Save the eligibility information to a JSON file, merging it with the existing data if the file exists.
+
+    Every call rewrites the whole file; runners collect their results in a results.ResultSink
+    and write each patient once instead.
 
     Args:
         output_filename (str): The path to the output JSON file.
-        new_trial_info (dict): The new trial eligibility information to be saved.
+        new_trial_info (dict): The new trial eligibility information to be saved. It replaces
+            an existing entry of the same trial.
     """
-    # Check if output file already exists
-    if os.path.exists(output_filename):
-        # Read existing data
-        with open(output_filename, 'r') as f:
-            existing_data = json.load(f)
+    merge_eligibility_file(output_filename, [new_trial_info])
+
+def apply_rules(trial, patient_ehr, criteria_keywords):
+    """Decide what the rule engine can of a pair before it is sent to the model.
+
+    Args:
+        trial (dict): The trial, as returned by load_trials.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        criteria_keywords (str): The trial's precomputed criteria keywords, or None.
+
+    Returns:
+        tuple: (verdicts, needs_llm, criteria_keywords). The verdicts decided by the rules, whether
+        the model must still evaluate the pair, and the keywords to send it. When the rules decide
+        some criteria, only the undecided ones are sent, listed by their text; when they decide
+        none, the trial's keywords are sent as before. A decided 'No' settles the pair.
+    """
+    if rule_stats is None:
+        return {}, True, criteria_keywords
+
+    resolution = resolve_criteria(trial, patient_ehr)
+    if not resolution.verdicts:
+        needs_llm = True
     else:
-        # If no existing data, start with an empty structure
-        existing_data = {"eligibleTrials": []}
+        needs_llm = bool(resolution.undecided) and not resolution.ineligible
+        if needs_llm:
+            criteria_keywords = render_criteria_keywords(resolution.undecided)
+    rule_stats.record(resolution, needs_llm)
+    return resolution.verdicts, needs_llm, criteria_keywords
 
-    # Append new trial info to eligibleTrials
-    existing_data["eligibleTrials"].append(new_trial_info)
+def evaluate_pair(patient_id, patient_ehr, trial, criteria_keywords=None, max_attempts=3):
+    """Evaluate one patient against one trial with the per-pair prompts.
 
-    # Write updated data back to file
-    with open(output_filename, 'w') as f:
-        json.dump(existing_data, f, indent=2)
+    An answer that does not follow the response schema is requested again for this pair
+    only; a pair that never gets a valid answer is skipped without stopping the run.
 
-def process_patients_and_trials(patient_dir, trial_dir, output_dir):
+    With configure_rule_engine, the criteria the rules decide are not sent to the model, see
+    apply_rules.
+
+    Args:
+        patient_id (str): The patient ID.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        trial (dict): The trial, as returned by load_trials.
+        criteria_keywords (str, optional): The trial's precomputed criteria keywords.
+        max_attempts (int): Number of evaluation requests before the pair is given up.
+
+    Returns:
+        dict: The trial's eligibility JSON structure (see create_eligibility_json) if the
+        patient is eligible, otherwise None.
+    """
+    rule_verdicts, needs_llm, criteria_keywords = apply_rules(trial, patient_ehr, criteria_keywords)
+    eligibility_dict = dict(rule_verdicts)
+    if needs_llm:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                eligibility_results = process_patient_eligibility(trial["criteria"], patient_ehr, criteria_keywords)
+                break
+            except ResponseFormatError as e:
+                metrics.inc('llm_invalid_responses_total')
+                logger.warning("Invalid answer for Trial %s (Patient %s), attempt %s of %s: %s",
+                               trial['trialId'], patient_id, attempt, max_attempts, e)
+        else:
+            metrics.inc('pairs_failed_total')
+            logger.warning("Giving up on Trial %s (Patient %s) after %s invalid answers",
+                           trial['trialId'], patient_id, max_attempts)
+            return None
+        eligibility_dict.update(parse_eligibility_results(eligibility_results))
+
+    # Determine overall eligibility
+    final_eligibility = determine_overall_eligibility(eligibility_dict)
+    logger.debug("Final Eligibility for Trial %s (Patient %s): %s", trial['trialId'], patient_id, final_eligibility)
+
+    if final_eligibility != "Yes":
+        return None
+    return create_eligibility_json(patient_id, trial["trialId"], trial["studyTitle"], eligibility_dict)
+
+def process_patients_and_trials(patient_dir, trial_dir, output_dir, keywords_path=None, top_k=None, index_path=None,
+                                csv_path=None, embedding_dir=None, sink=None):
     """
     Process patient EHR files against clinical trial criteria to determine eligibility.
 
@@ -320,62 +755,85 @@ def process_patients_and_trials(patient_dir, trial_dir, output_dir):
         patient_dir (str): Directory containing patient EHR JSON files.
         trial_dir (str): Directory containing trial criteria text files.
         output_dir (str): Directory where eligibility results will be saved.
+        keywords_path (str, optional): JSON file where the per-trial criteria keywords are persisted.
+        top_k (int, optional): If given, each patient is only evaluated against its top-K candidate
+            trials from the retrieval index (see src/ai/retrieval.py).
+        index_path (str, optional): File where the retrieval index is persisted and updated.
+        csv_path (str, optional): study-links.csv, whose brief summaries are indexed with the criteria.
+        embedding_dir (str, optional): Shortlist the top-K trials by embedding similarity, with the
+            trial embeddings cached in this directory, instead of by BM25 score.
+        sink (ResultSink, optional): Where eligible trials are collected. Defaults to a sink
+            writing one {patient_id}_eligibility.json per patient to output_dir.
     """
-    print(f"Processing patients in directory: {patient_dir}")
+    logger.info("Processing patients in directory: %s", patient_dir)
     
-    # Get all patient EHR files
-    patient_files = [f for f in os.listdir(patient_dir) if f.endswith('.json')]
+    # Read all patient EHRs and trials once
+    patients = load_patients(patient_dir)
+    trials = load_trials(trial_dir)
+
+    # Drop the pairs ruled out by the trial's age and sex eligibility before any LLM call
+    eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+    report_prefilter(eligible_pairs)
+    if top_k is not None:
+        eligible_pairs = restrict_to_candidates(eligible_pairs, patients, trials, top_k, index_path, csv_path,
+                                                embedding_dir)
+
+    # Extract keywords once, only for the trials some patient can still match
+    active_trials = [trial for index, trial in enumerate(trials) if eligible_pairs[:, index].any()]
+    trial_keywords = precompute_trial_keywords(active_trials, keywords_path)
     
-    # Iterate through each patient file
-    for patient_file in patient_files:
-        print(f"Processing file: {patient_file}")
-        
-        patient_path = os.path.join(patient_dir, patient_file)
-        
-        # Read the patient EHR
-        with open(patient_path) as f:
-            patient_ehr = json.load(f)
-        
-        # Extract patient ID from file name
-        patient_id = os.path.basename(patient_path).split('_')[0]
+    owns_sink = sink is None
+    if owns_sink:
+        sink = ResultSink(output_dir)
+
+    # Iterate through each patient
+    for patient_index, (patient_id, patient_ehr) in enumerate(patients):
+        logger.info("Processing patient: %s", patient_id)
         
-        # Iterate through each trial criteria file in trial directory
-        for trial_file in os.listdir(trial_dir):
-            if trial_file.endswith('_criteria.txt'):
-                print(f"Processing trial file: {trial_file}")
-                
-                trial_path = os.path.join(trial_dir, trial_file)
-                
-                # Read trial criteria
-                with open(trial_path) as f:
-                    trial_criteria = f.read()
-                
-                # Extract trial ID and study title
-                trial_id = os.path.basename(trial_file).split('_')[0]
-                study_title = extract_study_title(trial_path)
-
-                # Process eligibility for this patient and trial
-                eligibility_results = process_patient_eligibility(trial_criteria, patient_ehr)
-                eligibility_dict = parse_eligibility_results(eligibility_results)
-
-                # Determine overall eligibility
-                final_eligibility = determine_overall_eligibility(eligibility_dict)
-
-                # Print final eligibility for this trial
-                print(f"Final Eligibility for Trial {trial_id} (Patient {patient_id}): {final_eligibility}")
-
-                if final_eligibility == "Yes":
-                    # Create JSON structure only if eligible
-                    new_trial_info = create_eligibility_json(patient_id, trial_id, study_title, eligibility_dict)
-                    
-                    # Save JSON file under output directory (appending eligible trials)
-                    output_filename = os.path.join(output_dir, f"{patient_id}_eligibility.json")
-                    save_eligibility_json(output_filename, new_trial_info)
-
-# Define directories for patients and trials
-patient_directory = '/Users/bharathbeeravelly/Desktop/patient-trials-matching/data/processed/patients_small'
-trial_directory = '/Users/bharathbeeravelly/Desktop/patient-trials-matching/data/raw/scraped_small'
-output_directory = '/Users/bharathbeeravelly/Desktop/patient-trials-matching/data/outputs_small'
-
-# Run the processing function
-process_patients_and_trials(patient_directory, trial_directory, output_directory)
\ No newline at end of file
+        # Iterate through each trial left by the prefilter
+        for trial_index, trial in enumerate(trials):
+            if not eligible_pairs[patient_index, trial_index]:
+                continue
+
+            logger.debug("Processing trial file: %s", os.path.basename(trial['path']))
+
+            # Process eligibility for this patient and trial; the JSON structure is only created if eligible
+            new_trial_info = evaluate_pair(patient_id, patient_ehr, trial, trial_keywords[trial["trialId"]]["keywords"])
+            if new_trial_info is not None:
+                sink.add(patient_id, new_trial_info)
+
+        # Write the patient's eligible trials once, after all its trials are evaluated
+        sink.flush(patient_id)
+
+    if owns_sink:
+        sink.close()
+
+# This block runs only if this script is executed directly
+if __name__ == "__main__":
+    configure_logging()
+    # Define directories for patients and trials, relative to the project's data directory
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+    patient_directory = os.path.join(data_directory, 'processed', 'patients_small')
+    trial_directory = os.path.join(data_directory, 'raw', 'scraped_small')
+    output_directory = os.path.join(data_directory, 'outputs_small')
+    keywords_file = os.path.join(data_directory, 'processed', 'trial_keywords.json')
+    cache_file = os.getenv("LLM_CACHE_PATH", os.path.join(data_directory, 'cache', 'llm_cache.sqlite'))
+
+    # Reruns over unchanged patients and trials are answered from the cache
+    configure_llm_cache(cache_file, bypass=os.getenv("LLM_CACHE_BYPASS", "0") == "1")
+
+    # Prompts carry a compact patient summary; LLM_SUMMARY_TOKENS=0 sends the raw EHR data
+    summary_tokens = int(os.getenv("LLM_SUMMARY_TOKENS", DEFAULT_SUMMARY_TOKENS))
+    configure_patient_summary(summary_tokens or None)
+
+    # Numeric and temporal criteria are decided locally; LLM_RULES=0 sends every criterion to the model
+    configure_rule_engine(os.getenv("LLM_RULES", "1") == "1")
+
+    # Run the processing function
+    process_patients_and_trials(patient_directory, trial_directory, output_directory, keywords_file)
+    logger.info("LLM cache stats: %s", llm_cache.stats())
+    if patient_summary_tokens is not None:
+        prompt_size_stats.report()
+    if rule_stats is not None:
+        rule_stats.report()
+    metrics.report()
@@ -0,0 +1,225 @@
+import re
+import threading
+import logging
+from src.ai.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Default token budget of a patient summary
+DEFAULT_SUMMARY_TOKENS = 1500
+
+# Demographic fields written on the first line of the summary
+SUMMARY_DEMOGRAPHICS = ["Gender", "Age", "Race", "Ethnic Group", "Language"]
+
+# Sections in the order they are written; when the summary is over budget, entries are dropped
+# from the last sections first, oldest entries first
+SUMMARY_SECTIONS = ["Vital Signs", "Problems", "Medications", "Surgeries", "Immunizations"]
+
+DAYS_PATTERN = re.compile(r'(\d+) days')
+
+def _day(timestamp):
+    """The date part of an ISO timestamp, e.g. '2015-12-18'."""
+    return timestamp[:10] if timestamp else '?'
+
+def _days(value):
+    """The number of days in a '<n> days' or '<n> days ago' string, or None."""
+    match = DAYS_PATTERN.match(value or '')
+    return int(match.group(1)) if match else None
+
+def _recency(row, last_key):
+    """Render how long ago an entry ended: 'ended 120 days ago', or its stop date."""
+    days = _days(row.get(last_key))
+    return f"ended {days} days ago" if days is not None else f"ended {_day(row.get('Stop'))}"
+
+def summarize_vital_signs(rows):
+    """Keep the latest reading of each vital sign.
+
+    Args:
+        rows (list): The 'Vital Signs' rows of a patient.
+
+    Returns:
+        list: (sort key, line) tuples such as 'Body Weight: 48.2 kg (2023-10-06)', newest first.
+    """
+    latest = {}
+    for row in rows:
+        description = row.get('Description')
+        if description and (description not in latest or (row.get('Start') or '') >= (latest[description].get('Start') or '')):
+            latest[description] = row
+    lines = [(row.get('Start') or '', f"{description}: {row.get('Value')} ({_day(row.get('Start'))})")
+             for description, row in latest.items()]
+    return sorted(lines, reverse=True)
+
+def summarize_courses(rows, duration_key, last_key):
+    """Collapse repeated entries of the same description into one line each.
+
+    Args:
+        rows (list): The rows of a section, e.g. 'Medications' or 'Problems'.
+        duration_key (str): The key holding the '<n> days' duration of an entry.
+        last_key (str): The key holding the '<n> days ago' recency of an entry.
+
+    Returns:
+        list: (sort key, line) tuples, current entries first, then by recency. A line gives
+        the number of courses, the first start and last stop dates, the total duration and
+        the recency, e.g. 'Natazia 28 Day Pack: 3 courses 2015-09-30 to 2018-09-14 (1083 days
+        total, ended 2200 days ago)' or 'ferrous sulfate 325 MG Oral Tablet: since 2016-12-16'.
+    """
+    courses = {}
+    for row in rows:
+        description = row.get('Description')
+        if description:
+            courses.setdefault(description, []).append(row)
+
+    lines = []
+    for description, entries in courses.items():
+        entries.sort(key=lambda row: row.get('Start') or '')
+        current = any(row.get('Stop') is None for row in entries)
+        latest = max(entries, key=lambda row: row.get('Stop') or '')
+        total_days = sum(_days(row.get(duration_key)) or 0 for row in entries)
+        prefix = f"{len(entries)} courses " if len(entries) > 1 else ''
+        total = f"{total_days} days{' total' if len(entries) > 1 else ''}"
+
+        if current:
+            line = f"{description}: {prefix}since {_day(entries[0].get('Start'))}"
+            if len(entries) > 1 and total_days:
+                line += f" ({total})"
+            lines.append(('9999', line))
+        else:
+            lines.append((latest.get('Stop') or '',
+                          f"{description}: {prefix}{_day(entries[0].get('Start'))} to {_day(latest.get('Stop'))} "
+                          f"({total}, {_recency(latest, last_key)})"))
+    return sorted(lines, reverse=True)
+
+def summarize_events(rows):
+    """Deduplicate point-in-time entries such as procedures or immunizations.
+
+    Args:
+        rows (list): The rows of a section, e.g. 'Surgeries' or 'Immunizations'.
+
+    Returns:
+        list: (sort key, line) tuples, newest first, e.g. 'Depression screening (procedure): x9, last 2023-10-06'.
+    """
+    events = {}
+    for row in rows:
+        description = row.get('Description')
+        if description:
+            count, last = events.get(description, (0, ''))
+            events[description] = (count + 1, max(last, row.get('Start') or ''))
+    lines = [(last, f"{description}: {'x' + str(count) + ', ' if count > 1 else ''}last {_day(last)}")
+             for description, (count, last) in events.items()]
+    return sorted(lines, reverse=True)
+
+def summarize_sections(patient_ehr):
+    """Build the summary lines of every section of a patient.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        dict: Lists of lines keyed by section title, newest entries first.
+    """
+    summarizers = {
+        "Problems": lambda rows: summarize_courses(rows, 'Duration', 'Last'),
+        "Medications": lambda rows: summarize_courses(rows, 'Duration of Usage', 'Last Usage'),
+        "Vital Signs": summarize_vital_signs,
+        "Surgeries": summarize_events,
+        "Immunizations": summarize_events,
+    }
+    return {
+        section: [line for _, line in summarizers[section](patient_ehr.get(section) or [])]
+        for section in SUMMARY_SECTIONS
+    }
+
+def summarize_patient(patient_ehr, max_tokens=DEFAULT_SUMMARY_TOKENS):
+    """Render a compact text summary of a patient for prompts.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+        max_tokens (int, optional): Token budget of the summary. None keeps every line.
+
+    Returns:
+        str: One demographics line, then one line per deduplicated entry under each section
+        heading. When over budget, the oldest entries of the last sections are dropped first
+        and replaced by a count of the omitted entries.
+    """
+    demographics = ', '.join(f"{field}: {patient_ehr.get(field)}" for field in SUMMARY_DEMOGRAPHICS)
+    sections = summarize_sections(patient_ehr)
+
+    def render(kept):
+        lines = [demographics]
+        for section in SUMMARY_SECTIONS:
+            section_lines = sections[section]
+            if not section_lines:
+                continue
+            lines.append(f"{section}:")
+            lines.extend(f"- {line}" for line in section_lines[:kept[section]])
+            omitted = len(section_lines) - kept[section]
+            if omitted:
+                lines.append(f"- ({omitted} older entries omitted)")
+        return '\n'.join(lines)
+
+    kept = {section: len(lines) for section, lines in sections.items()}
+    summary = render(kept)
+    if max_tokens is None:
+        return summary
+
+    # Drop whole entries, subtracting their own token counts, and re-count the rendered text
+    # once it should fit, since the omitted-entries notes add a few tokens
+    line_tokens = {section: [count_tokens(f"- {line}\n") for line in lines] for section, lines in sections.items()}
+    total = count_tokens(summary)
+    while total > max_tokens:
+        section = next((section for section in reversed(SUMMARY_SECTIONS) if kept[section] > 0), None)
+        if section is None:
+            break
+        kept[section] -= 1
+        total -= line_tokens[section][kept[section]]
+        if total <= max_tokens:
+            summary = render(kept)
+            total = count_tokens(summary)
+    return render(kept)
+
+class PromptSizeStats:
+    """
+    Thread-safe record of the patient context size in prompts, raw and summarized.
+    """
+
+    def __init__(self):
+        self.prompts = 0
+        self.raw_tokens = 0
+        self.summary_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, raw_tokens, summary_tokens):
+        """Count the patient context of one prompt.
+
+        Args:
+            raw_tokens (int): Tokens of the full patient data.
+            summary_tokens (int): Tokens of the summary sent instead.
+        """
+        with self._lock:
+            self.prompts += 1
+            self.raw_tokens += raw_tokens
+            self.summary_tokens += summary_tokens
+
+    def summary(self):
+        """Averages per prompt and the overall reduction.
+
+        Returns:
+            dict: 'prompts', 'rawTokensPerPrompt', 'summaryTokensPerPrompt' and 'reduction'
+            (the fraction of patient context tokens saved).
+        """
+        with self._lock:
+            prompts = max(self.prompts, 1)
+            return {
+                "prompts": self.prompts,
+                "rawTokensPerPrompt": self.raw_tokens / prompts,
+                "summaryTokensPerPrompt": self.summary_tokens / prompts,
+                "reduction": 1 - self.summary_tokens / self.raw_tokens if self.raw_tokens else 0.0,
+            }
+
+    def report(self):
+        """Log the prompt size line and return the summary."""
+        stats = self.summary()
+        logger.info("Patient context in %s prompts: %.0f tokens summarized vs %.0f raw (%.0f%% smaller)",
+                    stats['prompts'], stats['summaryTokensPerPrompt'], stats['rawTokensPerPrompt'],
+                    stats['reduction'] * 100)
+        return stats
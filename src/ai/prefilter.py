@@ -0,0 +1,169 @@
+import re
+import logging
+import numpy as np
+from src.metrics import metrics
+from src.ai.dates import age_in_fractional_years
+
+logger = logging.getLogger(__name__)
+
+# Conversion factors from the age units used on ClinicalTrials.gov to years
+AGE_UNITS = {
+    'year': 1.0,
+    'month': 1.0 / 12,
+    'week': 7.0 / 365.25,
+    'day': 1.0 / 365.25,
+    'hour': 1.0 / (365.25 * 24),
+    'minute': 1.0 / (365.25 * 24 * 60),
+}
+
+# Months and weeks converted to years are off by up to a couple of days from calendar ages
+AGE_MARGIN = 3 * AGE_UNITS['day']
+
+# Patient gender codes from the CCDA administrativeGenderCode mapped to trial sexes
+GENDER_CODES = {'F': 'Female', 'M': 'Male'}
+
+AGE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(Year|Month|Week|Day|Hour|Minute)s?', re.IGNORECASE)
+
+def parse_age(age_text):
+    """Convert an age such as '18 Years' or '6 Months' to years.
+
+    Args:
+        age_text (str): The age text from a trial's criteria.
+
+    Returns:
+        float: The age in years, or None if no age could be read.
+    """
+    match = AGE_PATTERN.search(age_text)
+    if match is None:
+        return None
+    return float(match.group(1)) * AGE_UNITS[match.group(2).lower()]
+
+def parse_age_range(age_line):
+    """Parse an 'Ages Eligible for Study' value into a minimum and maximum age.
+
+    Args:
+        age_line (str): A value such as '18 Years to 70 Years (Adult, Older Adult )',
+            '18 Years and older', or 'up to 17 Years'.
+
+    Returns:
+        tuple: (min_age, max_age) in years, either of which may be None when unbounded.
+    """
+    # Drop the age group labels in parentheses
+    age_line = age_line.split('(')[0].strip()
+
+    if ' to ' in age_line:
+        lower, upper = age_line.split(' to ', 1)
+        return parse_age(lower), parse_age(upper)
+    if age_line.lower().startswith('up to'):
+        return None, parse_age(age_line)
+    if 'older' in age_line.lower():
+        return parse_age(age_line), None
+    return None, None
+
+def parse_other_criteria(trial_criteria):
+    """Parse the 'Other Criteria' block of a scraped criteria file.
+
+    Args:
+        trial_criteria (str): The full text of a trial criteria file.
+
+    Returns:
+        dict: A dictionary with 'minAge' and 'maxAge' in years (None when unbounded),
+        'sexes' ('All', 'Female' or 'Male') and 'healthyVolunteers' (True, False or None
+        when not stated).
+    """
+    other_criteria = {"minAge": None, "maxAge": None, "sexes": "All", "healthyVolunteers": None}
+
+    _, found, block = trial_criteria.rpartition('Other Criteria:')
+    if not found:
+        return other_criteria
+
+    lines = [line.strip() for line in block.split('\n') if line.strip()]
+    for index, line in enumerate(lines[:-1]):
+        value = lines[index + 1]
+        if line == 'Ages Eligible for Study':
+            other_criteria["minAge"], other_criteria["maxAge"] = parse_age_range(value)
+        elif line == 'Sexes Eligible for Study':
+            if value in ('All', 'Female', 'Male'):
+                other_criteria["sexes"] = value
+        elif line == 'Accepts Healthy Volunteers':
+            if value in ('Yes', 'No'):
+                other_criteria["healthyVolunteers"] = value == 'Yes'
+
+    return other_criteria
+
+def patient_age_bounds(patient):
+    """The youngest and oldest age in years a patient can have, given its record.
+
+    Args:
+        patient (dict): A patient EHR dictionary with 'Birth Time' and/or 'Age'.
+
+    Returns:
+        tuple: (youngest, oldest) in years. Both are the fractional age when the birth time is
+        known; a whole-year 'Age' alone spans that year of age. (nan, nan) if neither is known.
+    """
+    if patient.get("Birth Time"):
+        try:
+            age = age_in_fractional_years(patient["Birth Time"])
+            return age, age
+        except ValueError:
+            pass
+    if patient.get("Age") is not None:
+        return float(patient["Age"]), patient["Age"] + 1 - AGE_UNITS['day']
+    return np.nan, np.nan
+
+def prefilter_pairs(patients, trials):
+    """Prune the patient x trial matrix using the age and sex eligibility of each trial.
+
+    Args:
+        patients (list): Patient EHR dictionaries with 'Birth Time' or 'Age', and 'Gender'.
+        trials (list): Trials with their parsed 'otherCriteria' (see parse_other_criteria).
+
+    Returns:
+        numpy.ndarray: A boolean matrix of shape (len(patients), len(trials)) that is True
+        for the pairs that still need an eligibility evaluation.
+
+    Missing patient ages or genders and unbounded trial ages never eliminate a pair. Ages are
+    compared in fractional years, so minimums in months or weeks apply to infants too.
+    """
+    age_bounds = np.array([patient_age_bounds(patient) for patient in patients], dtype=float).reshape(-1, 2)
+    youngest, oldest = age_bounds[:, 0], age_bounds[:, 1]
+    sexes = np.array([GENDER_CODES.get(patient.get("Gender"), '') for patient in patients], dtype=object)
+
+    min_ages = np.array([
+        trial["otherCriteria"]["minAge"] if trial["otherCriteria"]["minAge"] is not None else -np.inf
+        for trial in trials
+    ], dtype=float)
+    max_ages = np.array([
+        trial["otherCriteria"]["maxAge"] if trial["otherCriteria"]["maxAge"] is not None else np.inf
+        for trial in trials
+    ], dtype=float)
+    trial_sexes = np.array([trial["otherCriteria"]["sexes"] for trial in trials], dtype=object)
+
+    # A maximum is inclusive of its whole year, so a patient aged 70.9 is within '18 Years to 70 Years'
+    unknown_age = np.isnan(youngest)[:, None]
+    age_ok = unknown_age | ((oldest[:, None] + AGE_MARGIN >= min_ages[None, :])
+                            & (youngest[:, None] - AGE_MARGIN < max_ages[None, :] + 1))
+
+    sex_ok = ((trial_sexes == 'All')[None, :]
+              | (sexes == '')[:, None]
+              | (sexes[:, None] == trial_sexes[None, :]))
+
+    return age_ok & sex_ok
+
+def report_prefilter(mask):
+    """Log how many patient-trial pairs the prefilter eliminated.
+
+    Args:
+        mask (numpy.ndarray): The boolean matrix returned by prefilter_pairs.
+
+    Returns:
+        dict: The total, kept and eliminated number of pairs.
+    """
+    total = int(mask.size)
+    kept = int(mask.sum())
+    report = {"total": total, "kept": kept, "eliminated": total - kept}
+    metrics.inc('pairs_total', total)
+    metrics.inc('pairs_pruned_total', report['eliminated'], stage='prefilter')
+    logger.info("Prefilter eliminated %s of %s patient-trial pairs (%s left for evaluation)",
+                report['eliminated'], total, report['kept'])
+    return report
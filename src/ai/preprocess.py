@@ -1,12 +1,21 @@
 import os
 import json
+import time
+import hashlib
+import logging
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import requests
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from dotenv import load_dotenv
+from src.metrics import configure_logging, metrics
+from src.utils import write_json_atomic
+from src.ai.dates import age_in_years, duration_days, days_since, set_reference_time
+from src.ai.feature_store import build_feature_store_from_json
+
+logger = logging.getLogger(__name__)
 
 # Namespace for the XML
 ns = {'hl7': 'urn:hl7-org:v3'}
@@ -14,6 +23,17 @@ ns = {'hl7': 'urn:hl7-org:v3'}
 # Sections of interest in the XML data
 sections = ['Allergies and Adverse Reactions', 'Medications', 'Diagnostic Results', 'Problems', 'Surgeries', 'Vital Signs', 'Immunizations']
 
+# Fully qualified tag of a table cell
+TD_TAG = f"{{{ns['hl7']}}}td"
+
+# Column schema per section: the (key, td position) pairs read from each row, and the keys of the
+# duration and last-usage values derived from the Start/Stop columns (None if not computed)
+DEFAULT_SECTION_COLUMNS = ((('Start', 0), ('Stop', 1), ('Description', 2)), ('Duration', 'Last'))
+SECTION_COLUMNS = {
+    'Medications': ((('Start', 0), ('Stop', 1), ('Description', 2)), ('Duration of Usage', 'Last Usage')),
+    'Vital Signs': ((('Start', 0), ('Stop', 1), ('Description', 2), ('Value', 4)), None),
+}
+
 def calculate_age(birth_time_str):
     """Calculate age based on birth time string.
 
@@ -21,11 +41,9 @@ def calculate_age(birth_time_str):
         birth_time_str (str): The birth time in the format 'YYYYMMDDHHMMSS'.
 
     Returns:
-        int: The calculated age.
+        int: The calculated age at the reference time of the run.
     """
-    birth_time = datetime.strptime(birth_time_str, '%Y%m%d%H%M%S')
-    today = datetime.today()
-    return today.year - birth_time.year - ((today.month, today.day) < (birth_time.month, birth_time.day))
+    return age_in_years(birth_time_str)
 
 def calculate_duration(start_date_str, stop_date_str):
     """Calculate the number of days between start and stop dates (inclusive).
@@ -39,9 +57,7 @@ def calculate_duration(start_date_str, stop_date_str):
     """
     if start_date_str and stop_date_str:
         try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%dT%H:%M:%SZ')
-            stop_date = datetime.strptime(stop_date_str, '%Y-%m-%dT%H:%M:%SZ')
-            duration = (stop_date - start_date).days + 1  # Inclusive of both start and stop dates
+            duration = duration_days(start_date_str, stop_date_str)  # Inclusive of both start and stop dates
             return f"{duration} days"  # Return the duration as a string
         except ValueError:
             return "Invalid date format"
@@ -59,14 +75,37 @@ def calculate_last_usage(stop_date_str):
     """
     if stop_date_str:
         try:
-            stop_date = datetime.strptime(stop_date_str, '%Y-%m-%dT%H:%M:%SZ')
-            today = datetime.today()
-            days_since_last_use = (today - stop_date).days
+            days_since_last_use = days_since(stop_date_str)
             return f"{days_since_last_use} days ago"
         except ValueError:
             return "Invalid date"
     return "Currently used"
 
+def calculate_day_counts(start_date_str, stop_date_str):
+    """Calculate the duration and the days since the stop date as numbers.
+
+    Args:
+        start_date_str (str): The start date in ISO format.
+        stop_date_str (str): The stop date in ISO format.
+
+    Returns:
+        tuple: (duration in days, days since the stop date). Each value is None when the
+        dates are missing or invalid; the second one is also None while still in use.
+    """
+    duration = None
+    last = None
+    if start_date_str and stop_date_str:
+        try:
+            duration = duration_days(start_date_str, stop_date_str)
+        except ValueError:
+            pass
+    if stop_date_str:
+        try:
+            last = days_since(stop_date_str)
+        except ValueError:
+            pass
+    return duration, last
+
 
 def extract_patient_details(root):
     """Extract basic patient details from the XML.
@@ -119,15 +158,20 @@ def extract_patient_details(root):
 
     return patient_data
 
-def extract_section_data(section_title, section, patient_data):
+def extract_section_data(section_title, section, patient_data, day_counts=False):
     """Extracts information from a given section and appends it to the patient_data dictionary.
 
     Args:
         section_title (str): The title of the section being extracted.
         section (ElementTree): The XML section element to extract data from.
         patient_data (dict): The patient data dictionary to update with the extracted information.
+        day_counts (bool): If True, the duration and last-usage values are also emitted as numbers
+            of days under the same keys suffixed with ' Days'.
+
+    The cells of each row are read in a single pass over its children and mapped to keys with
+    the column schema of the section (see SECTION_COLUMNS).
     """
-    print(f"Extracting Section: {section_title}")
+    logger.debug("Extracting Section: %s", section_title)
 
     # Use section_title as the data_key for patient_data
     data_key = section_title
@@ -135,57 +179,66 @@ def extract_section_data(section_title, section, patient_data):
     # Initialize the list for the specified data_key if it doesn't exist
     if data_key not in patient_data:
         patient_data[data_key] = []
+    section_rows = patient_data[data_key]
+
+    columns, derived_keys = SECTION_COLUMNS.get(section_title, DEFAULT_SECTION_COLUMNS)
+    width = max(position for _, position in columns) + 1
 
     # Extract the rows from the section (assuming table structure)
     rows = section.findall('.//hl7:tbody/hl7:tr', ns)
 
     for row in rows:
-        # Handle the "Medications" section specifically
-        if section_title == 'Medications':
-            start_date = row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None
-            stop_date = row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None
-            description = row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None
-
-            info = {
-                'Start': start_date,
-                'Stop': stop_date,
-                'Description': description,
-                'Duration of Usage': calculate_duration(start_date, stop_date),
-                'Last Usage': calculate_last_usage(stop_date)
-            }
-            patient_data[data_key].append(info)
-
-        # Handle the "Vital Signs" section specifically
-        elif section_title == 'Vital Signs':
-            info = {
-                'Start': row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None,
-                'Stop': row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None,
-                'Description': row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None,
-                'Value': row.find('hl7:td[5]', ns).text if row.find('hl7:td[5]', ns) is not None else None
-            }
-            patient_data[data_key].append(info)
-        
-        # Handle other sections
-        else:
-            # For other sections, only extract Start, Stop, and Description
-            start_date = row.find('hl7:td[1]', ns).text if row.find('hl7:td[1]', ns) is not None else None
-            stop_date = row.find('hl7:td[2]', ns).text if row.find('hl7:td[2]', ns) is not None else None
-            description = row.find('hl7:td[3]', ns).text if row.find('hl7:td[3]', ns) is not None else None
-            info = {
-                'Start': start_date,
-                'Stop': stop_date,
-                'Description': description,
-                'Duration': calculate_duration(start_date, stop_date),
-                'Last': calculate_last_usage(stop_date)
-            }
-            patient_data[data_key].append(info)
-
-def extract_all_sections(root, patient_data):
+        # Text of the td cells in order, padded so missing cells read as None
+        cells = [cell.text for cell in row if cell.tag == TD_TAG]
+        if len(cells) < width:
+            cells.extend([None] * (width - len(cells)))
+
+        info = {key: cells[position] for key, position in columns}
+        if derived_keys is not None:
+            duration_key, last_key = derived_keys
+            info[duration_key] = calculate_duration(cells[0], cells[1])
+            info[last_key] = calculate_last_usage(cells[1])
+            if day_counts:
+                info[f"{duration_key} Days"], info[f"{last_key} Days"] = calculate_day_counts(cells[0], cells[1])
+        section_rows.append(info)
+
+def refresh_relative_values(patient_data):
+    """Recompute the values relative to the reference time of a processed patient record.
+
+    Args:
+        patient_data (dict): A patient record as written by the preprocessor, or rebuilt from
+            the feature store. Updated in place.
+
+    Returns:
+        dict: The same record, with the age and the last-usage values (and their ' Days'
+        counterparts, when present) computed at the current reference time.
+
+    Outputs are reused across runs by the incremental mode, so these values are refreshed
+    when a record is read rather than trusted from the file.
+    """
+    if patient_data.get('Birth Time'):
+        patient_data['Age'] = calculate_age(patient_data['Birth Time'])
+    for section_title, rows in patient_data.items():
+        if not isinstance(rows, list):
+            continue
+        derived_keys = SECTION_COLUMNS.get(section_title, DEFAULT_SECTION_COLUMNS)[1]
+        if derived_keys is None:
+            continue
+        last_key = derived_keys[1]
+        for row in rows:
+            if last_key in row:
+                row[last_key] = calculate_last_usage(row.get('Stop'))
+            if f"{last_key} Days" in row:
+                row[f"{last_key} Days"] = calculate_day_counts(None, row.get('Stop'))[1]
+    return patient_data
+
+def extract_all_sections(root, patient_data, day_counts=False):
     """Extract all relevant sections (Allergies, Medications, etc.) from the XML.
 
     Args:
         root (ElementTree): The root of the XML tree.
         patient_data (dict): The patient data dictionary to update with extracted sections.
+        day_counts (bool): If True, numeric day counts are emitted alongside the strings.
     """
     structured_body = root.find('.//hl7:structuredBody', ns)
 
@@ -202,61 +255,392 @@ def extract_all_sections(root, patient_data):
                     for section_name in sections:
                         if section_name in section_title:
                             # Extract the section data
-                            extract_section_data(section_title, section, patient_data)
+                            extract_section_data(section_title, section, patient_data, day_counts)
+
+def parse_xml_file(xml_file_path, day_counts=False):
+    """Parse one CCDA XML file into a patient data dictionary by loading the whole tree.
+
+    Args:
+        xml_file_path (str): Path of the XML file.
+        day_counts (bool): If True, numeric day counts are emitted alongside the strings.
+
+    Returns:
+        dict: The patient details and the extracted sections.
+    """
+    tree = ET.parse(xml_file_path)
+    root = tree.getroot()
+
+    # Initialize patient_data dictionary for each XML file
+    patient_data = {}
+
+    # Extract basic patient details
+    patient_data.update(extract_patient_details(root))
+
+    # Extract additional sections (Allergies, Medications, etc.)
+    extract_all_sections(root, patient_data, day_counts)
+
+    return patient_data
+
+def _drop_element(elem, parent):
+    """Release a consumed element and detach it from its parent.
+
+    Args:
+        elem (Element): The element whose end event was just handled.
+        parent (Element): Its parent, or None for the root.
+    """
+    elem.clear()
+    # The element that just ended is always the parent's last child
+    if parent is not None and len(parent) and parent[-1] is elem:
+        del parent[-1]
+
+def parse_xml_streaming(xml_file_path, day_counts=False):
+    """Parse one CCDA XML file into a patient data dictionary with iterparse.
 
-def process_xml_files(xml_directory, output_directory):
+    Args:
+        xml_file_path (str): Path of the XML file.
+        day_counts (bool): If True, numeric day counts are emitted alongside the strings.
+
+    Returns:
+        dict: The patient details and the extracted sections, identical to the output of
+        extract_patient_details followed by extract_all_sections.
+
+    Only the recordTarget subtree and the structuredBody sections listed in `sections` are kept
+    in memory until they are extracted. Every other element is cleared and detached as soon as
+    its end tag is read, so peak memory stays close to the size of the largest wanted section.
+    """
+    tag_record_target = f"{{{ns['hl7']}}}recordTarget"
+    tag_structured_body = f"{{{ns['hl7']}}}structuredBody"
+    tag_component = f"{{{ns['hl7']}}}component"
+    tag_section = f"{{{ns['hl7']}}}section"
+    tag_title = f"{{{ns['hl7']}}}title"
+
+    patient_data = {}
+    details_found = False
+
+    stack = []
+    body = None  # the first structuredBody in document order
+    body_depth = None
+    section = None  # the section currently being read directly under a body component
+    section_has_title = False
+    section_title = None
+    section_wanted = None  # None until the section title has been read
+    component_has_section = False
+
+    for event, elem in ET.iterparse(xml_file_path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            depth = len(stack) - 1
+            if body is None and elem.tag == tag_structured_body:
+                body, body_depth = elem, depth
+            elif body is not None and depth == body_depth + 1 and stack[body_depth] is body:
+                component_has_section = False
+            elif (body is not None and depth == body_depth + 2 and stack[body_depth] is body
+                  and elem.tag == tag_section and stack[-2].tag == tag_component and not component_has_section):
+                component_has_section = True
+                section, section_has_title, section_title, section_wanted = elem, False, None, None
+            continue
+
+        depth = len(stack) - 1
+        parent = stack[-2] if depth > 0 else None
+        stack.pop()
+
+        # Patient details: keep the recordTarget subtree until it is complete
+        if depth > 1 and stack[1].tag == tag_record_target:
+            continue
+        if depth == 1 and elem.tag == tag_record_target:
+            if not details_found:
+                wrapper = ET.Element(stack[0].tag)
+                wrapper.append(elem)
+                details = extract_patient_details(wrapper)
+                if details:
+                    patient_data.update(details)
+                    details_found = True
+            _drop_element(elem, parent)
+            continue
+
+        # Body sections: decide from the title whether to keep the rest of the section
+        if section is not None and depth > body_depth + 2 and stack[body_depth + 2] is section:
+            if depth == body_depth + 3 and elem.tag == tag_title and not section_has_title:
+                section_has_title = True
+                section_title = (elem.text or '').strip()
+                section_wanted = any(section_name in section_title for section_name in sections)
+            if section_wanted is False:
+                _drop_element(elem, parent)
+            continue
+        if elem is section:
+            if section_wanted:
+                for section_name in sections:
+                    if section_name in section_title:
+                        extract_section_data(section_title, elem, patient_data, day_counts)
+            section = None
+            _drop_element(elem, parent)
+            continue
+
+        _drop_element(elem, parent)
+
+    return patient_data
+
+def file_fingerprint(file_path, with_hash=True):
+    """Describe a source file by its size, modification time and content hash.
+
+    Args:
+        file_path (str): Path of the file.
+        with_hash (bool): If False, the SHA-256 of the content is not computed.
+
+    Returns:
+        dict: The 'size', 'mtime' and (optionally) 'sha256' of the file.
+    """
+    stat = os.stat(file_path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+def load_manifest(manifest_path):
+    """Load the manifest of previously processed XML files.
+
+    Args:
+        manifest_path (str): Path of the manifest file.
+
+    Returns:
+        dict: Entries keyed by absolute source path, each with the source 'size', 'mtime',
+        'sha256', the 'options' it was processed with and the 'output' file it produced.
+        Empty if the manifest does not exist.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f).get("files", {})
+
+def manifest_options(streaming, day_counts):
+    """Describe the options that shape the output of a file, for its manifest entry.
+
+    Args:
+        streaming (bool): Whether the streaming parser is used.
+        day_counts (bool): Whether numeric day counts are emitted.
+
+    Returns:
+        dict: The options. The reference time is not part of them: the values relative to it
+        are recomputed when the output is read (see refresh_relative_values).
+    """
+    return {"streaming": streaming, "dayCounts": day_counts}
+
+def is_unchanged(xml_file_path, entry, options=None):
+    """Check whether a source file still matches its manifest entry and output.
+
+    Args:
+        xml_file_path (str): Absolute path of the XML file.
+        entry (dict): The manifest entry for the file, or None.
+        options (dict, optional): The manifest_options of the current run. An entry recorded
+            with other options is stale.
+
+    Returns:
+        bool: True if the file can be skipped. Size and mtime are compared first; the content
+        hash is only computed when they differ, so touched but identical files are skipped too.
+    """
+    if entry is None or not os.path.exists(entry["output"]):
+        return False
+    if options is not None and entry.get("options") != options:
+        return False
+    fingerprint = file_fingerprint(xml_file_path, with_hash=False)
+    if fingerprint["size"] == entry["size"] and fingerprint["mtime"] == entry["mtime"]:
+        return True
+    if fingerprint["size"] != entry["size"]:
+        return False
+    if file_fingerprint(xml_file_path)["sha256"] == entry["sha256"]:
+        entry["mtime"] = fingerprint["mtime"]
+        return True
+    return False
+
+def process_xml_file(xml_file_path, output_directory, streaming=False, day_counts=False, reference_time=None):
+    """Parse one XML file and write its patient data JSON atomically.
+
+    Args:
+        xml_file_path (str): Path of the XML file.
+        output_directory (str): The directory where the processed JSON file will be saved.
+        streaming (bool): If True, use parse_xml_streaming instead of the full-tree parser.
+        day_counts (bool): If True, numeric day counts are emitted alongside the strings.
+        reference_time (datetime, optional): The reference timestamp of the run. Worker processes
+            receive it with each task so every file is computed against the same "today".
+
+    Returns:
+        tuple: (xml_file_path, output_file_path, error). On success error is None; on failure
+        output_file_path is None and error describes the problem.
+    """
+    if reference_time is not None:
+        set_reference_time(reference_time)
+
+    try:
+        parse = parse_xml_streaming if streaming else parse_xml_file
+        with metrics.timer('preprocess_xml_parse_seconds'):
+            patient_data = parse(xml_file_path, day_counts)
+        for section, rows in patient_data.items():
+            if isinstance(rows, list):
+                metrics.inc('preprocess_section_rows_total', len(rows), section=section)
+
+        # Create JSON output file name based on patient ID (extension)
+        patient_id = patient_data.get('Patient ID', 'unknown')
+        output_file = f"{patient_id}_data.json"
+        output_file_path = os.path.join(output_directory, output_file)
+
+        # Write patient data to JSON
+        write_json_atomic(output_file_path, patient_data, indent=4)
+    except Exception as e:
+        return xml_file_path, None, f"{e.__class__.__name__}: {e}"
+
+    return xml_file_path, output_file_path, None
+
+def _process_xml_file_task(task):
+    """Unpack a process_xml_file argument tuple for the process pool."""
+    return process_xml_file(*task)
+
+def _process_xml_file_worker_task(task):
+    """Run a task in a worker process and return its result with the metrics it recorded."""
+    metrics.reset()
+    return _process_xml_file_task(task), metrics.snapshot()
+
+def process_xml_files(xml_directory, output_directory, streaming=False, workers=1, chunksize=4,
+                      incremental=False, manifest_path=None, day_counts=False, reference_time=None,
+                      store_directory=None):
     """Process multiple XML files in the specified directory.
 
     Args:
         xml_directory (str): The directory containing XML files to process.
         output_directory (str): The directory where the processed JSON files will be saved.
+        streaming (bool): If True, parse each file with parse_xml_streaming instead of
+            loading the whole document tree.
+        workers (int): Number of worker processes. With 1, files are processed in this process.
+        chunksize (int): Number of files submitted to a worker at a time.
+        incremental (bool): If True, only new or changed files, or files last processed with other
+            options, are processed, and the outputs of source files that disappeared are deleted.
+            Reused outputs keep the ages and day counts of their own run; readers refresh them
+            with refresh_relative_values.
+        manifest_path (str, optional): Manifest used by the incremental mode. Defaults to
+            '.preprocess-manifest' in the output directory.
+        day_counts (bool): If True, numeric day counts are emitted alongside the strings.
+        reference_time (datetime, optional): Timestamp used as "today" for ages and "days ago"
+            values. Defaults to the time the run starts, fixed for every file of the run.
+        store_directory (str, optional): If given, the processed patients are also written there
+            as a columnar feature store (see src/ai/feature_store.py).
 
     This function reads all XML files from the specified xml_directory, extracts patient details and relevant data sections,
     and saves the results as JSON files in the specified output_directory. Each JSON file is named based on the patient's ID
-    (extension) extracted from the XML data.
+    (extension) extracted from the XML data. Each file is written atomically, and a file that cannot be parsed is recorded
+    as a failure instead of aborting the run.
 
     Returns:
-        None: This function does not return any value. It writes output directly to the file system.
+        dict: A summary with the number of processed files, the failures (file and error),
+        the skipped and removed files in incremental mode, the elapsed seconds and the
+        throughput in files per second.
     
     Raises:
         FileNotFoundError: If the xml_directory does not exist or cannot be accessed.
-        ET.ParseError: If any XML file is not well-formed or cannot be parsed.
     """
-    for file_name in os.listdir(xml_directory):
-        if file_name.endswith('.xml'):
-            xml_file_path = os.path.join(xml_directory, file_name)
-            tree = ET.parse(xml_file_path)
-            root = tree.getroot()
-
-            # Initialize patient_data dictionary for each XML file
-            patient_data = {}
-
-            # Extract basic patient details
-            patient_data.update(extract_patient_details(root))
-
-            # Extract additional sections (Allergies, Medications, etc.)
-            extract_all_sections(root, patient_data)
-
-            # Create JSON output file name based on patient ID (extension)
-            patient_id = patient_data.get('Patient ID', 'unknown')
-            output_file = f"{patient_id}_data.json"
-            output_file_path = os.path.join(output_directory, output_file)
-
-            # Write patient data to JSON
-            with open(output_file_path, 'w') as json_file:
-                json.dump(patient_data, json_file, indent=4)
-
-            print(f"Processed {xml_file_path} and saved to {output_file_path}")
+    start_time = time.perf_counter()
+    reference_time = set_reference_time(reference_time)
+
+    xml_files = [
+        os.path.abspath(os.path.join(xml_directory, file_name))
+        for file_name in sorted(os.listdir(xml_directory)) if file_name.endswith('.xml')
+    ]
+
+    skipped = []
+    removed = []
+    if incremental:
+        if manifest_path is None:
+            manifest_path = os.path.join(output_directory, '.preprocess-manifest')
+        manifest = load_manifest(manifest_path)
+        options = manifest_options(streaming, day_counts)
+
+        # Delete the outputs of sources that no longer exist
+        current_files = set(xml_files)
+        for source_path in sorted(set(manifest) - current_files):
+            output_file_path = manifest.pop(source_path)["output"]
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)
+            removed.append(source_path)
+            logger.info("Removed %s (source %s is gone)", output_file_path, source_path)
+
+        changed = []
+        for xml_file in xml_files:
+            if is_unchanged(xml_file, manifest.get(xml_file), options):
+                skipped.append(xml_file)
+            else:
+                changed.append(xml_file)
+        xml_files = changed
+
+    tasks = [(xml_file, output_directory, streaming, day_counts, reference_time) for xml_file in xml_files]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = []
+            for result, worker_metrics in executor.map(_process_xml_file_worker_task, tasks, chunksize=chunksize):
+                results.append(result)
+                metrics.merge(worker_metrics)
+    else:
+        results = [_process_xml_file_task(task) for task in tasks]
+
+    processed = 0
+    failures = []
+    for xml_file_path, output_file_path, error in results:
+        if error is None:
+            processed += 1
+            logger.debug("Processed %s and saved to %s", xml_file_path, output_file_path)
+            if incremental:
+                previous = manifest.get(xml_file_path)
+                if previous is not None and previous["output"] != output_file_path and os.path.exists(previous["output"]):
+                    os.remove(previous["output"])
+                manifest[xml_file_path] = dict(file_fingerprint(xml_file_path), options=options,
+                                               output=output_file_path)
+        else:
+            failures.append({"file": xml_file_path, "error": error})
+            logger.warning("Failed to process %s: %s", xml_file_path, error)
+            if incremental:
+                # Forget the file so the next run retries it
+                manifest.pop(xml_file_path, None)
+
+    if incremental:
+        write_json_atomic(manifest_path, {"version": 2, "files": manifest}, indent=2)
+
+    # The store is a snapshot of every patient in the output directory, including skipped ones
+    if store_directory is not None:
+        build_feature_store_from_json(output_directory, store_directory)
+
+    for status, count in (('processed', processed), ('failed', len(failures)), ('skipped', len(skipped)),
+                          ('removed', len(removed))):
+        metrics.inc('preprocess_files_total', count, status=status)
+
+    elapsed = time.perf_counter() - start_time
+    summary = {
+        "processed": processed,
+        "failed": failures,
+        "skipped": skipped,
+        "removed": removed,
+        "seconds": round(elapsed, 3),
+        "filesPerSecond": round(len(tasks) / elapsed, 2) if elapsed > 0 else None,
+    }
+    logger.info("Preprocessing finished: %s processed, %s failed, %s unchanged and skipped, %s removed "
+                "in %ss (%s files/s, %s worker(s))", processed, len(failures), len(skipped), len(removed),
+                summary['seconds'], summary['filesPerSecond'], workers)
+    return summary
 
 # This block runs only if this script is executed directly
 if __name__ == "__main__":
-    # Define the directories
-    xml_directory = '/Users/bharathbeeravelly/Desktop/patient-trials-matching/data/raw/patients_ehr'
-    output_directory = '/Users/bharathbeeravelly/Desktop/patient-trials-matching/data/processed/patients_json'
+    configure_logging()
+    # Define the directories, relative to the project's data directory
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+    xml_directory = os.path.join(data_directory, 'raw', 'patients_ehr')
+    output_directory = os.path.join(data_directory, 'processed', 'patients_json')
+    store_directory = os.path.join(data_directory, 'processed', 'patients_store')
 
     # Ensure the output directory exists
     os.makedirs(output_directory, exist_ok=True)
 
-    # Process the XML files
-    process_xml_files(xml_directory, output_directory)
+    # Process the new and changed XML files on all available cores
+    process_xml_files(xml_directory, output_directory, workers=os.cpu_count() or 1, incremental=True,
+                      store_directory=store_directory)
 
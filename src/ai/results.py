@@ -0,0 +1,217 @@
+import os
+import json
+import argparse
+import logging
+from src.metrics import configure_logging
+from src.utils import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Name of the streaming results file written in JSON Lines mode
+RESULTS_JSONL = 'eligibility.jsonl'
+
+def eligibility_path(output_dir, patient_id):
+    """Path of the per-patient eligibility file.
+
+    Args:
+        output_dir (str): Directory of the eligibility results.
+        patient_id (str): The patient ID.
+
+    Returns:
+        str: The path of {patient_id}_eligibility.json.
+    """
+    return os.path.join(output_dir, f"{patient_id}_eligibility.json")
+
+def dedupe_trials(trials):
+    """Keep one entry per trial ID.
+
+    Args:
+        trials (list): Eligible trial dictionaries as built by model.create_eligibility_json.
+
+    Returns:
+        list: The trials in order of first appearance, each with its latest entry.
+    """
+    latest = {}
+    for trial in trials:
+        latest[trial["trialId"]] = trial
+    return list(latest.values())
+
+def read_eligibility_file(path):
+    """Read the eligible trials of a per-patient eligibility file.
+
+    Args:
+        path (str): The eligibility file path.
+
+    Returns:
+        list: The eligible trials, or an empty list if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)["eligibleTrials"]
+
+def write_eligibility_file(path, trials):
+    """Write a per-patient eligibility file atomically, replacing its previous content.
+
+    Args:
+        path (str): The eligibility file path.
+        trials (list): The patient's eligible trials, possibly none.
+    """
+    write_json_atomic(path, {"eligibleTrials": dedupe_trials(trials)}, indent=2)
+
+def merge_eligibility_file(path, trials):
+    """Merge trials into a per-patient eligibility file, atomically and without duplicates.
+
+    Args:
+        path (str): The eligibility file path.
+        trials (list): The new eligible trials; they replace existing entries with the same trial ID.
+    """
+    write_eligibility_file(path, read_eligibility_file(path) + list(trials))
+
+class ResultSink:
+    """
+    Collects eligible trials and writes each patient's results once.
+
+    In the default mode results are buffered per patient and the patient's
+    {patient_id}_eligibility.json is replaced with them when the patient is flushed, so it
+    lists exactly the trials of this run. In JSON Lines mode the eligibility.jsonl file is
+    truncated when the sink is created and every result is appended to it as it arrives,
+    which keeps memory flat for very large runs; consolidate_jsonl builds the per-patient
+    files from it afterwards.
+    """
+
+    def __init__(self, output_dir, jsonl=False):
+        """
+        Args:
+            output_dir (str): Directory of the eligibility results.
+            jsonl (bool): Stream the results to eligibility.jsonl instead of per-patient files.
+        """
+        self.output_dir = output_dir
+        self.jsonl = jsonl
+        self.pending = {}
+        self.written = 0
+        self._jsonl_file = None
+        os.makedirs(output_dir, exist_ok=True)
+        if jsonl:
+            self._jsonl_file = open(os.path.join(output_dir, RESULTS_JSONL), 'w')
+
+    def add(self, patient_id, trial_info):
+        """Record an eligible trial of a patient.
+
+        Args:
+            patient_id (str): The patient ID.
+            trial_info (dict): The trial dictionary built by model.create_eligibility_json.
+        """
+        if self._jsonl_file is not None:
+            self._jsonl_file.write(json.dumps({"patientId": patient_id, **trial_info}) + '\n')
+            self.written += 1
+        else:
+            self.pending.setdefault(patient_id, {})[trial_info["trialId"]] = trial_info
+
+    def flush(self, patient_id=None):
+        """Write the buffered results of one patient, or of every patient.
+
+        Args:
+            patient_id (str, optional): The patient to flush, whose file is written with an empty
+                list if it has no eligible trials. Defaults to every buffered patient.
+        """
+        if self._jsonl_file is not None:
+            self._jsonl_file.flush()
+            return
+        patient_ids = [patient_id] if patient_id is not None else list(self.pending)
+        for pid in patient_ids:
+            trials = self.pending.pop(pid, {})
+            write_eligibility_file(eligibility_path(self.output_dir, pid), trials.values())
+            self.written += len(trials)
+
+    def close(self):
+        """Flush every buffered result and close the JSON Lines file."""
+        self.flush()
+        if self._jsonl_file is not None:
+            self._jsonl_file.close()
+            self._jsonl_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def consolidate_jsonl(jsonl_path, output_dir, patient_ids=None, merge=False):
+    """Build the per-patient eligibility files from JSON Lines results files.
+
+    Args:
+        jsonl_path (str or list): The eligibility.jsonl file, or several files in this format,
+            such as the shard files of a work queue run.
+        output_dir (str): Directory where the {patient_id}_eligibility.json files are written.
+        patient_ids (iterable, optional): Patients whose files are written even without any
+            result, with an empty list, like the per-patient files of a direct run.
+        merge (bool): If True, the results are merged into existing files instead of replacing them.
+
+    Returns:
+        dict: The number of 'patients' written and of 'trials' they list. A truncated last
+        line, left by an interrupted run, is skipped.
+    """
+    jsonl_paths = [jsonl_path] if isinstance(jsonl_path, str) else jsonl_path
+    by_patient = {patient_id: [] for patient_id in (patient_ids or [])}
+    for path in jsonl_paths:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping an incomplete line in %s", path)
+                    continue
+                patient_id = result.pop("patientId")
+                by_patient.setdefault(patient_id, []).append(result)
+
+    os.makedirs(output_dir, exist_ok=True)
+    trials = 0
+    for patient_id, results in by_patient.items():
+        path = eligibility_path(output_dir, patient_id)
+        if merge:
+            merge_eligibility_file(path, results)
+        else:
+            write_eligibility_file(path, results)
+        trials += len(read_eligibility_file(path))
+    logger.info("Consolidated %s patients (%s eligible trials) into %s", len(by_patient), trials, output_dir)
+    return {"patients": len(by_patient), "trials": trials}
+
+def dedupe_output_dir(output_dir):
+    """Remove duplicate trial entries from existing per-patient eligibility files.
+
+    Args:
+        output_dir (str): Directory of the eligibility results.
+
+    Returns:
+        int: The number of duplicate entries removed.
+    """
+    removed = 0
+    for file_name in sorted(os.listdir(output_dir)):
+        if file_name.endswith('_eligibility.json'):
+            path = os.path.join(output_dir, file_name)
+            trials = read_eligibility_file(path)
+            unique = dedupe_trials(trials)
+            if len(unique) < len(trials):
+                write_json_atomic(path, {"eligibleTrials": unique}, indent=2)
+                removed += len(trials) - len(unique)
+    logger.info("Removed %s duplicate entries from %s", removed, output_dir)
+    return removed
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Maintain the eligibility result files.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    consolidate_parser = subparsers.add_parser('consolidate', help="Build per-patient files from eligibility.jsonl.")
+    consolidate_parser.add_argument('--jsonl', required=True, help="The eligibility.jsonl file.")
+    consolidate_parser.add_argument('--output', required=True, help="Directory for the eligibility JSON files.")
+    consolidate_parser.add_argument('--merge', action='store_true',
+                                    help="Merge the results into existing files instead of replacing them.")
+    dedupe_parser = subparsers.add_parser('dedupe', help="Remove duplicate trials from per-patient files.")
+    dedupe_parser.add_argument('--output', required=True, help="Directory of the eligibility JSON files.")
+    args = parser.parse_args()
+
+    if args.command == 'consolidate':
+        consolidate_jsonl(args.jsonl, args.output, merge=args.merge)
+    else:
+        dedupe_output_dir(args.output)
@@ -0,0 +1,343 @@
+import os
+import re
+import math
+import json
+import hashlib
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from src.metrics import configure_logging, metrics
+from src.utils import write_json_atomic
+from src.ai.criteria import parse_criteria_text
+
+logger = logging.getLogger(__name__)
+
+# Words that carry no condition, intervention or disease meaning: English stop words, eligibility
+# boilerplate, SNOMED semantic tags, dose forms and units, and social history findings
+STOP_WORDS = frozenset("""
+    a about above after again against all also am an and any are as at be because been before being below
+    between both but by can could did do does doing during each either else few for from further had has
+    have having he her here hers him his how however i if in into is it its itself just may me might more
+    most must no nor not now of off on once only or other our out over own per same shall she should so
+    some such than that the their them then there these they this those through to too under until up upon
+    very was we were what when where whether which while who whom why will with within without would you
+    your yes
+    study studies trial trials participant participants patient patients subject subjects criteria criterion
+    inclusion exclusion eligible eligibility include included including exclude excluded enroll enrolled
+    enrollment consent informed signed sign able unable willing history diagnosed diagnosis confirmed known
+    current currently prior previous previously visit screening baseline time day days week weeks month
+    months year years age aged old older adult adults male female men women sex gender least less greater
+    than equal investigator judgment opinion according following one two three four five six first second
+    new use used using based defined define clinical clinically significant significantly condition conditions
+    disease diseases disorder disorders finding findings situation procedure treatment treatments therapy
+    therapies receive received receiving require required research purpose aim aims evaluate assess effect
+    effects safety efficacy group groups randomized randomised phase control controlled open label
+    mg ml mcg kg g l hr unit units oral tablet tablets capsule capsules injection solution extended release
+    pack topical cream spray inhaler intrauterine system implant drug drugs medication medications dose doses
+    employment education transportation housing social contact record review due full-time part-time
+    served armed force access lack problem higher normal limited stress
+""".split())
+
+TOKEN_PATTERN = re.compile(r'[a-z][a-z0-9\-]+')
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def normalize_term(word):
+    """Map a lowercase word to its index term, folding plurals, e.g. 'tumors' -> 'tumor', 'therapies' -> 'therapy'."""
+    word = word.strip('-')
+    if len(word) > 4:
+        if word.endswith('ies'):
+            return word[:-3] + 'y'
+        if word.endswith('sses') or word.endswith('ss') or word.endswith('us') or word.endswith('is'):
+            return word
+        if word.endswith('s'):
+            return word[:-1]
+    return word
+
+def tokenize(text):
+    """Split text into condition, intervention and disease terms.
+
+    Args:
+        text (str): Criteria, summary or patient description text.
+
+    Returns:
+        list: The index terms, in order, without stop words, numbers and words under three letters.
+    """
+    terms = []
+    for word in TOKEN_PATTERN.findall((text or '').lower()):
+        term = normalize_term(word)
+        if len(term) >= 3 and term not in STOP_WORDS and word not in STOP_WORDS:
+            terms.append(term)
+    return terms
+
+def load_brief_summaries(csv_path):
+    """Read the 'Brief Summary' of every study in study-links.csv.
+
+    Args:
+        csv_path (str): Path of the study links CSV file.
+
+    Returns:
+        dict: Brief summaries keyed by NCT number. Empty if the file does not exist.
+    """
+    if not os.path.exists(csv_path):
+        return {}
+    df = pd.read_csv(csv_path, usecols=['NCT Number', 'Brief Summary'])
+    return {row['NCT Number']: row['Brief Summary'] for _, row in df.iterrows() if isinstance(row['Brief Summary'], str)}
+
+def trial_document(record, brief_summary=None):
+    """Text indexed for a trial: title, inclusion criteria and the brief summary.
+
+    Exclusion criteria are left out: a condition they name makes the trial a worse match, not a better one.
+
+    Args:
+        record (dict): A compiled criteria record.
+        brief_summary (str, optional): The study's brief summary.
+
+    Returns:
+        str: The document text.
+    """
+    parts = [record["studyTitle"] or '']
+    parts.extend(criterion["text"] for criterion in record["inclusion"])
+    parts.append(brief_summary or '')
+    return '\n'.join(parts)
+
+class TrialIndex:
+    """
+    Persistent inverted index from condition, intervention and disease terms to trials, scored with BM25.
+    """
+
+    def __init__(self, index_path=None):
+        """
+        Args:
+            index_path (str, optional): The JSON file the index is saved to. It is loaded if it
+                exists. Without it the index lives in memory only.
+        """
+        self.index_path = index_path
+        self.trials = {}
+        self.postings = {}
+        if index_path and os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                data = json.load(f)
+            self.trials = data["trials"]
+            self.postings = data["postings"]
+
+    def save(self):
+        """Write the index atomically to its JSON file, if it has one."""
+        if self.index_path is None:
+            return
+        write_json_atomic(self.index_path, {"trials": self.trials, "postings": self.postings}, indent=None)
+
+    def add(self, trial_id, text, content_hash):
+        """Index the document of a trial, replacing any previous version.
+
+        Args:
+            trial_id (str): The NCT number of the trial.
+            text (str): The document text.
+            content_hash (str): Hash of the sources of the document.
+        """
+        self.remove(trial_id)
+        terms = tokenize(text)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[trial_id] = frequency
+        self.trials[trial_id] = {"hash": content_hash, "length": len(terms), "terms": sorted(frequencies)}
+
+    def remove(self, trial_id):
+        """Drop a trial from the index.
+
+        Args:
+            trial_id (str): The NCT number of the trial.
+        """
+        entry = self.trials.pop(trial_id, None)
+        if entry is None:
+            return
+        for term in entry["terms"]:
+            trial_frequencies = self.postings.get(term)
+            if trial_frequencies is not None:
+                trial_frequencies.pop(trial_id, None)
+                if not trial_frequencies:
+                    del self.postings[term]
+
+    def update(self, trials, brief_summaries=None):
+        """Bring the index in line with a set of trials.
+
+        Only new trials and trials whose criteria or summary changed are re-indexed, and
+        trials that are no longer present are removed.
+
+        Args:
+            trials (list): Dictionaries with the 'trialId' and 'criteria' text of each trial, and
+                optionally its compiled criteria 'record', as returned by model.load_trials.
+            brief_summaries (dict, optional): Brief summaries keyed by NCT number.
+
+        Returns:
+            dict: The number of trials 'added', 'updated', 'removed' and 'unchanged'.
+        """
+        brief_summaries = brief_summaries or {}
+        summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        for trial in trials:
+            trial_id = trial["trialId"]
+            brief_summary = brief_summaries.get(trial_id, '')
+            content_hash = hashlib.sha256(f"{trial['criteria']}\0{brief_summary}".encode('utf-8')).hexdigest()
+
+            entry = self.trials.get(trial_id)
+            if entry is not None and entry["hash"] == content_hash:
+                summary["unchanged"] += 1
+                continue
+            summary["updated" if entry is not None else "added"] += 1
+            record = trial.get("record") or parse_criteria_text(trial["criteria"], trial_id)
+            self.add(trial_id, trial_document(record, brief_summary), content_hash)
+
+        for trial_id in sorted(set(self.trials) - {trial["trialId"] for trial in trials}):
+            self.remove(trial_id)
+            summary["removed"] += 1
+
+        logger.info("Retrieval index: %s added, %s updated, %s removed, %s unchanged",
+                    summary['added'], summary['updated'], summary['removed'], summary['unchanged'])
+        return summary
+
+    def search(self, terms, top_k=None, trial_ids=None):
+        """Rank trials by BM25 score against query terms.
+
+        Args:
+            terms (list): The query terms, repeated terms weigh more.
+            top_k (int, optional): Number of trials to return. Defaults to all matching trials.
+            trial_ids (iterable, optional): Only rank these trials.
+
+        Returns:
+            list: (trial_id, score) tuples with a positive score, best first, ties broken by trial ID.
+        """
+        allowed = set(trial_ids) if trial_ids is not None else None
+        total = len(self.trials)
+        if total == 0:
+            return []
+        average_length = sum(entry["length"] for entry in self.trials.values()) / total
+
+        query = {}
+        for term in terms:
+            query[term] = query.get(term, 0) + 1
+
+        scores = {}
+        for term, query_frequency in query.items():
+            trial_frequencies = self.postings.get(term)
+            if not trial_frequencies:
+                continue
+            idf = math.log(1 + (total - len(trial_frequencies) + 0.5) / (len(trial_frequencies) + 0.5))
+            for trial_id, frequency in trial_frequencies.items():
+                if allowed is not None and trial_id not in allowed:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self.trials[trial_id]["length"] / average_length
+                score = idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+                scores[trial_id] = scores.get(trial_id, 0.0) + score * query_frequency
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k] if top_k is not None else ranked
+
+def patient_terms(patient_ehr):
+    """Query terms of a patient from the descriptions of their problems and medications.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        list: The terms of every distinct 'Problems' and 'Medications' description.
+    """
+    descriptions = {row.get('Description') for section in ('Problems', 'Medications')
+                    for row in patient_ehr.get(section) or []}
+    terms = []
+    for description in sorted(d for d in descriptions if d):
+        # Drop the SNOMED semantic tag, e.g. '(disorder)'
+        terms.extend(tokenize(re.sub(r'\([^)]*\)\s*$', '', description)))
+    return terms
+
+def retrieve_candidates(index, patients, trials, top_k):
+    """Mark the top-K candidate trials of every patient.
+
+    Args:
+        index (TrialIndex): The retrieval index.
+        patients (list): (patient_id, patient_ehr) tuples.
+        trials (list): Trials as returned by model.load_trials.
+        top_k (int): Number of candidate trials per patient.
+
+    Returns:
+        numpy.ndarray: Boolean matrix of shape (len(patients), len(trials)), True for candidate pairs.
+    """
+    columns = {trial["trialId"]: index for index, trial in enumerate(trials)}
+    candidates = np.zeros((len(patients), len(trials)), dtype=bool)
+    for row, (_, patient_ehr) in enumerate(patients):
+        for trial_id, _ in index.search(patient_terms(patient_ehr), top_k, trial_ids=columns):
+            candidates[row, columns[trial_id]] = True
+    return candidates
+
+def read_trial_directory(trial_dir):
+    """Read the criteria files of a directory as trials for TrialIndex.update.
+
+    Args:
+        trial_dir (str): Directory containing <trial_id>_criteria.txt files.
+
+    Returns:
+        list: Dictionaries with the 'trialId' and 'criteria' text, sorted by trial ID.
+    """
+    trials = []
+    for trial_file in sorted(os.listdir(trial_dir)):
+        if trial_file.endswith('_criteria.txt'):
+            with open(os.path.join(trial_dir, trial_file)) as f:
+                trials.append({"trialId": trial_file.split('_')[0], "criteria": f.read()})
+    return trials
+
+def restrict_to_candidates(eligible_pairs, patients, trials, top_k, index_path=None, csv_path=None,
+                           embedding_dir=None):
+    """Keep only the prefiltered pairs whose trial is among the patient's top-K candidates.
+
+    Args:
+        eligible_pairs (numpy.ndarray): The prefilter mask, patients by trials.
+        patients (list): (patient_id, patient_ehr) tuples.
+        trials (list): Trials as returned by model.load_trials; the index is updated from them.
+        top_k (int): Number of candidate trials per patient.
+        index_path (str, optional): Where the index is persisted and updated incrementally.
+            Without it, the index is built in memory.
+        csv_path (str, optional): The study links CSV with the brief summaries.
+        embedding_dir (str, optional): If given, candidates are the most similar trials in the
+            embedding index of this directory (see src/ai/embeddings.py) instead of the BM25 ranking.
+
+    Returns:
+        numpy.ndarray: The restricted mask.
+    """
+    if embedding_dir is not None:
+        # Imported here so that the keyword index does not need torch and transformers
+        from src.ai.embeddings import SentenceEncoder, shortlist_candidates, update_embedding_index
+        encoder = SentenceEncoder()
+        index = update_embedding_index(embedding_dir, trials, encoder, csv_path)
+        candidates = shortlist_candidates(index, patients, trials, top_k, encoder)
+    else:
+        index = TrialIndex(index_path)
+        changes = index.update(trials, load_brief_summaries(csv_path) if csv_path else None)
+        if changes["added"] or changes["updated"] or changes["removed"]:
+            index.save()
+        candidates = retrieve_candidates(index, patients, trials, top_k)
+
+    restricted = eligible_pairs & candidates
+    metrics.inc('pairs_pruned_total', int(eligible_pairs.sum() - restricted.sum()), stage='retrieval')
+    logger.info("Retrieval kept %s of %s pairs (top %s trials per patient)",
+                int(restricted.sum()), int(eligible_pairs.sum()), top_k)
+    return restricted
+
+if __name__ == "__main__":
+    configure_logging()
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build or update the candidate-trial retrieval index.")
+    parser.add_argument('--trial-dir', default=os.path.join(current_dir, '..', '..', 'data', 'raw', 'scraped'),
+                        help="Directory containing the <trial_id>_criteria.txt files.")
+    parser.add_argument('--csv', default=os.path.join(current_dir, '..', '..', 'data', 'raw', 'study-links.csv'),
+                        help="The study links CSV with the brief summaries.")
+    parser.add_argument('--index', default=os.path.join(current_dir, '..', '..', 'data', 'processed', 'retrieval_index.json'),
+                        help="The index file to update.")
+    args = parser.parse_args()
+
+    trial_index = TrialIndex(args.index)
+    trial_index.update(read_trial_directory(args.trial_dir), load_brief_summaries(args.csv))
+    trial_index.save()
@@ -0,0 +1,432 @@
+import re
+import threading
+import logging
+from typing import NamedTuple, Tuple
+import numpy as np
+from src.metrics import metrics
+from src.ai.criteria import parse_criteria_text, iter_criteria
+from src.ai.dates import days_since
+
+logger = logging.getLogger(__name__)
+
+# Measurements a criterion can compare against: the pattern naming it in a criterion, the
+# pattern of the 'Vital Signs' descriptions holding it, and the units its values are in
+MEASURES = {
+    'bmi': (r'body mass index(?:\s*\(BMI\))?|BMI', r'^Body mass index \(BMI\) \[Ratio\]',
+            ('kg/m2', 'kg/m^2', 'kg/m²')),
+    'weight': (r'(?:body\s+)?weight', r'^Body Weight', ('kg',)),
+    'height': (r'(?:body\s+)?height', r'^Body Height', ('cm',)),
+    'heart rate': (r'heart\s+rate|pulse(?:\s+rate)?', r'^Heart rate', ('/min', 'bpm', 'beats per minute')),
+    'respiratory rate': (r'respiratory\s+rate', r'^Respiratory rate', ('/min', 'breaths per minute')),
+    'temperature': (r'(?:body\s+)?temperature', r'^Body temperature', ('°c',)),
+    'oxygen saturation': (r'oxygen\s+saturation|SpO2', r'^Oxygen saturation', ('%',)),
+    'systolic blood pressure': (r'systolic(?:\s+blood\s+pressure)?(?:\s*\(SBP\))?|SBP', r'^Systolic blood pressure',
+                                ('mmhg',)),
+    'diastolic blood pressure': (r'diastolic(?:\s+blood\s+pressure)?(?:\s*\(DBP\))?|DBP', r'^Diastolic blood pressure',
+                                 ('mmhg',)),
+    'hba1c': (r'HbA1c|hemoglobin\s+A1c|A1c', r'^Hemoglobin A1c', ('%',)),
+}
+MEASURE_NAMES = list(MEASURES)
+MEASURE_VITALS = [re.compile(vital, re.IGNORECASE) for _, vital, _ in MEASURES.values()]
+
+# Comparison phrases, longest first so that 'no less than' is not read as 'less than'
+COMPARISONS = [
+    (r'>=|≥|=>|greater than or equal to|more than or equal to|no less than|not less than|at least|minimum of', '>='),
+    (r'<=|≤|=<|less than or equal to|no more than|not more than|no greater than|at most|maximum of|up to', '<='),
+    (r'>|greater than|more than|higher than|above|over|exceeding', '>'),
+    (r'<|less than|lower than|below|under', '<'),
+]
+NUMBER = r'\d+(?:\.\d+)?'
+# Units the values may be given in; any other unit is left over and rules the comparison out
+UNIT = r'kg/m\^?2|kg/m²|kg|cm|/min|bpm|beats per minute|breaths per minute|mmhg|°c|%'
+
+COMPARISON_PATTERN = re.compile(
+    rf'\b(?P<measure>{"|".join(f"(?:{criterion})" for criterion, _, _ in MEASURES.values())})\b'
+    rf'(?P<filler>[^\d<>≤≥=]{{0,30}}?)\s*'
+    rf'(?:(?:between\s*)?(?P<low>{NUMBER})\s*(?:and|-|–|to)\s*(?P<high>{NUMBER})'
+    rf'|(?P<op>{"|".join(f"(?:{phrases})" for phrases, _ in COMPARISONS)})\s*(?P<value>{NUMBER}))'
+    rf'(?:\s*(?P<unit>{UNIT}))?',
+    re.IGNORECASE)
+OPERATOR_PATTERNS = [(re.compile(rf'^(?:{phrases})$', re.IGNORECASE), op) for phrases, op in COMPARISONS]
+
+# Words that may surround a comparison without changing its meaning
+FILLER_WORDS = {
+    'a', 'an', 'the', 'of', 'is', 'are', 'be', 'must', 'should', 'have', 'has', 'had', 'with', 'at', 'on',
+    'patient', 'patients', 'participant', 'participants', 'subject', 'subjects', 'value', 'level',
+    'screening', 'baseline', 'both', 'inclusive', 'measured', 'current', 'documented', 'bmi', 'sbp', 'dbp',
+}
+
+# Events 'within' a period, e.g. 'Stroke or seizure within 6 months of signing the ICF'
+WITHIN_PATTERN = re.compile(
+    r'^(?P<negated>(?:no|without)\s+)?(?P<events>[^,;()]+?)\s+'
+    r'(?:within\s+(?:the\s+)?(?:last\s+|past\s+|previous\s+|prior\s+)?|in\s+the\s+(?:last|past|previous|prior)\s+)'
+    r'(?P<count>\d+)\s*(?P<unit>day|week|month|year)s?'
+    r'(?:\s+(?:prior to|before|of)\s+[^,;]*)?[.;]?$',
+    re.IGNORECASE)
+EVENT_PREFIX_PATTERN = re.compile(
+    r'^(?:(?:a|any|known|prior|previous|recent|documented)\s+)*'
+    r'(?:(?:history|diagnosis|use|treatment|episode)\s+(?:of|with)\s+)?', re.IGNORECASE)
+EVENT_SPLIT_PATTERN = re.compile(r'\s*,\s*(?:or\s+)?|\s+and/or\s+|\s+or\s+', re.IGNORECASE)
+PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 30.44, 'year': 365.25}
+
+# Longest event name the rules match by themselves; longer phrases are left to the model
+MAX_EVENT_WORDS = 3
+
+# Words too generic to name an event on their own, e.g. 'Treatment within 30 days'
+GENERIC_EVENT_WORDS = {'disease', 'disorder', 'condition', 'illness', 'therapy', 'treatment', 'medication',
+                       'medications', 'drug', 'drugs', 'surgery', 'procedure', 'event', 'events'}
+
+# Alternative names of common events in the problem lists, keyed by the singular event name.
+# Events are matched on whole words, so any other name is left to the model
+EVENT_SYNONYMS = {
+    'stroke': ['cerebrovascular accident'],
+    'heart attack': ['myocardial infarction'],
+    'cancer': ['malignant neoplasm'],
+    'malignancy': ['malignant neoplasm'],
+    'seizure': ['epilepsy'],
+    'high blood pressure': ['hypertension'],
+    'blood clot': ['thrombosis', 'embolism'],
+}
+
+# Sections whose start and stop dates record events
+EVENT_SECTIONS = ["Problems", "Medications"]
+
+def _singular(word):
+    """Drop the plural 's' of a word, e.g. 'seizures' -> 'seizure', keeping words like 'mellitus' or 'metastasis'."""
+    if len(word) > 4 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def _words(text):
+    """Normalized words of a text: every word of three letters or more, lower-cased and singular."""
+    return {_singular(word) for word in re.findall(r'[a-z0-9]{3,}', text.lower())}
+
+class NumericCheck(NamedTuple):
+    """One comparison of a measurement with a range; unbounded sides are infinite."""
+    measure: int
+    low: float
+    low_inclusive: bool
+    high: float
+    high_inclusive: bool
+
+class CriterionRule(NamedTuple):
+    """A criterion the rules can evaluate: all its checks hold, or one of its events happened.
+
+    Each event is the set of normalized words an entry must contain, see _words.
+    """
+    criterion_id: str
+    kind: str
+    label: str
+    checks: Tuple[NumericCheck, ...] = ()
+    events: Tuple[frozenset, ...] = ()
+    window_days: float = 0.0
+    negated: bool = False
+
+def _parse_comparison(clause):
+    """Parse a clause holding exactly one comparison of a measurement, e.g. 'BMI >= 30 kg/m2'.
+
+    Returns:
+        NumericCheck: The check, or None if the clause says anything else.
+    """
+    match = COMPARISON_PATTERN.search(clause)
+    if match is None:
+        return None
+    measure = next(index for index, (criterion, _, _) in enumerate(MEASURES.values())
+                   if re.fullmatch(criterion, match.group('measure'), re.IGNORECASE))
+    unit = match.group('unit')
+    if unit and unit.lower() not in MEASURES[MEASURE_NAMES[measure]][2]:
+        return None
+
+    leftover = f"{clause[:match.start()]} {match.group('filler')} {clause[match.end():]}"
+    if any(word not in FILLER_WORDS for word in re.findall(r'[^\W\d_]+', leftover.lower())):
+        return None
+
+    if match.group('op') is None:
+        return NumericCheck(measure, float(match.group('low')), True, float(match.group('high')), True)
+    value = float(match.group('value'))
+    op = next(op for pattern, op in OPERATOR_PATTERNS if pattern.match(match.group('op')))
+    if op.startswith('>'):
+        return NumericCheck(measure, value, op == '>=', np.inf, False)
+    return NumericCheck(measure, -np.inf, False, value, op == '<=')
+
+def _parse_events(text):
+    """Parse an 'events within a period' criterion.
+
+    Returns:
+        tuple: (event word sets, window in days, negated), or None if the criterion says anything else.
+    """
+    match = WITHIN_PATTERN.match(text.strip())
+    if match is None:
+        return None
+    events = []
+    for name in EVENT_SPLIT_PATTERN.split(match.group('events')):
+        name = EVENT_PREFIX_PATTERN.sub('', name.strip()).lower()
+        words = name.split()
+        if not words or len(words) > MAX_EVENT_WORDS or not _words(name) or set(words) <= GENERIC_EVENT_WORDS:
+            return None
+        events.append(frozenset(_words(name)))
+        synonyms = EVENT_SYNONYMS.get(' '.join(_singular(word) for word in words), [])
+        events.extend(frozenset(_words(synonym)) for synonym in synonyms)
+    window_days = int(match.group('count')) * PERIOD_DAYS[match.group('unit').lower()]
+    return tuple(events), window_days, match.group('negated') is not None
+
+def compile_rule(criterion_id, kind, text):
+    """Recognize a machine-checkable criterion.
+
+    Args:
+        criterion_id (str): The criterion ID, e.g. 'I1'.
+        kind (str): 'inclusion' or 'exclusion'.
+        text (str): The criterion text.
+
+    Returns:
+        CriterionRule: The rule, or None if the criterion is not one of the recognized forms:
+        comparisons of measurements joined by 'and' ('BMI >= 30', 'HbA1c between 7 and 10',
+        'BMI of 21 - 30 kg/m2 and body weight no less than 50 kg'), or events within a period
+        ('Stroke or seizure within 6 months').
+    """
+    label = f"{criterion_id}: {text}"
+    # 'between 7 and 10' keeps its 'and'; other 'and's join separate comparisons
+    clauses = re.split(r'\s+and\s+(?=[^\W\d_])', text.strip().rstrip('.;'))
+    checks = [_parse_comparison(clause) for clause in clauses]
+    if all(checks):
+        return CriterionRule(criterion_id, kind, label, checks=tuple(checks))
+
+    parsed = _parse_events(text)
+    if parsed is not None:
+        events, window_days, negated = parsed
+        return CriterionRule(criterion_id, kind, label, events=events, window_days=window_days, negated=negated)
+    return None
+
+class TrialRules:
+    """
+    The machine-checkable criteria of a trial, with their numeric checks laid out as arrays.
+    """
+
+    def __init__(self, record):
+        """
+        Args:
+            record (dict): A compiled criteria record, see src/ai/criteria.py.
+        """
+        self.criteria = list(iter_criteria(record))
+        self.rules = [rule for rule in (compile_rule(criterion["id"], kind, criterion["text"])
+                                        for kind, criterion in self.criteria) if rule is not None]
+        checks = [(index, check) for index, rule in enumerate(self.rules) for check in rule.checks]
+        self.check_rule = np.array([index for index, _ in checks], dtype=int)
+        self.check_measure = np.array([check.measure for _, check in checks], dtype=int)
+        self.low = np.array([check.low for _, check in checks], dtype=float)
+        self.low_inclusive = np.array([check.low_inclusive for _, check in checks], dtype=bool)
+        self.high = np.array([check.high for _, check in checks], dtype=float)
+        self.high_inclusive = np.array([check.high_inclusive for _, check in checks], dtype=bool)
+        self.event_rules = [index for index, rule in enumerate(self.rules) if rule.events]
+        self.windows = np.array([self.rules[index].window_days for index in self.event_rules], dtype=float)
+
+def get_trial_rules(trial):
+    """Return the rules of a trial, compiling its criteria on first use.
+
+    Args:
+        trial (dict): A trial as returned by model.load_trials.
+
+    Returns:
+        TrialRules: The trial's rules, kept in the trial dictionary for the next patients.
+    """
+    if "rules" not in trial:
+        record = trial.get("record") or parse_criteria_text(trial["criteria"], trial["trialId"])
+        trial["rules"] = TrialRules(record)
+    return trial["rules"]
+
+class PatientFacts:
+    """
+    The latest measurement of every known measure and the event history of a patient, as arrays.
+    """
+
+    def __init__(self, patient_ehr):
+        """
+        Args:
+            patient_ehr (dict): A dictionary containing patient EHR data.
+        """
+        self.values = np.full(len(MEASURE_NAMES), np.nan)
+        latest = [''] * len(MEASURE_NAMES)
+        for row in patient_ehr.get("Vital Signs") or []:
+            description, value = row.get('Description') or '', (row.get('Value') or '').split(' ', 1)[0]
+            for index, pattern in enumerate(MEASURE_VITALS):
+                if pattern.match(description) and (row.get('Start') or '') >= latest[index]:
+                    try:
+                        self.values[index] = float(value)
+                    except ValueError:
+                        continue
+                    latest[index] = row.get('Start') or ''
+
+        # Days since the onset of each event; an entry without a start date is never recent
+        rows = [row for section in EVENT_SECTIONS for row in patient_ehr.get(section) or [] if row.get('Description')]
+        self.event_words = [_words(row['Description']) for row in rows]
+        self.days_since_start = np.array([self._days_since(row.get('Start')) for row in rows], dtype=float)
+
+    @staticmethod
+    def _days_since(start):
+        if not start:
+            return np.inf
+        try:
+            return float(max(days_since(start), 0))
+        except ValueError:
+            return np.inf
+
+# Facts of the patient evaluated last; the runners evaluate each patient against all its trials in a row
+_facts_cache = (None, None)
+
+def get_patient_facts(patient_ehr):
+    """Return the facts of a patient, reusing them while the same patient is evaluated.
+
+    Args:
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        PatientFacts: The patient's facts.
+    """
+    global _facts_cache
+    cached_ehr, facts = _facts_cache
+    if cached_ehr is not patient_ehr:
+        facts = PatientFacts(patient_ehr)
+        _facts_cache = (patient_ehr, facts)
+    return facts
+
+def evaluate_rules(trial_rules, facts):
+    """Evaluate every rule of a trial for a patient at once.
+
+    Args:
+        trial_rules (TrialRules): The trial's rules.
+        facts (PatientFacts): The patient's facts.
+
+    Returns:
+        numpy.ndarray: One value per rule: 1.0 if the criterion holds, 0.0 if it does not, and
+        NaN if the record cannot tell. A comparison is decided by the latest measurement and is
+        unknown without one. An event criterion is only decided by a matching 'Problems' or
+        'Medications' entry whose onset falls within the period. A missing entry may just be
+        named differently, and an older entry may still be ongoing, e.g. a chronic condition,
+        so both are left to the model.
+    """
+    truth = np.full(len(trial_rules.rules), np.nan)
+
+    if trial_rules.check_rule.size:
+        values = facts.values[trial_rules.check_measure]
+        in_range = (((values > trial_rules.low) | (trial_rules.low_inclusive & (values == trial_rules.low)))
+                    & ((values < trial_rules.high) | (trial_rules.high_inclusive & (values == trial_rules.high))))
+        # A criterion holds if all its comparisons do, and is known if all its measurements are
+        known = np.ones(len(trial_rules.rules), dtype=bool)
+        holds = np.ones(len(trial_rules.rules), dtype=bool)
+        np.logical_and.at(known, trial_rules.check_rule, ~np.isnan(values))
+        np.logical_and.at(holds, trial_rules.check_rule, in_range)
+        numeric = np.zeros(len(trial_rules.rules), dtype=bool)
+        numeric[trial_rules.check_rule] = True
+        truth[numeric & known] = holds[numeric & known]
+
+    if trial_rules.event_rules and facts.event_words:
+        # Entry x rule matrix: an entry matches when it names every word of one of the rule's events
+        matches = np.array([[any(event <= words for event in trial_rules.rules[index].events)
+                             for index in trial_rules.event_rules] for words in facts.event_words], dtype=bool)
+        recent = (matches & (facts.days_since_start[:, None] <= trial_rules.windows[None, :])).any(axis=0)
+        rule_indices = np.array(trial_rules.event_rules)[recent]
+        truth[rule_indices] = [not trial_rules.rules[index].negated for index in rule_indices]
+    return truth
+
+class RuleResolution(NamedTuple):
+    """The criteria of a patient-trial pair decided by the rules, and the ones left to the model."""
+    verdicts: dict
+    undecided: list
+    total: int
+
+    @property
+    def ineligible(self):
+        """True if a decided criterion already rules the patient out."""
+        return any(verdict == "No" for verdict in self.verdicts.values())
+
+def resolve_criteria(trial, patient_ehr):
+    """Decide the machine-checkable criteria of a trial for a patient.
+
+    Args:
+        trial (dict): A trial as returned by model.load_trials.
+        patient_ehr (dict): A dictionary containing patient EHR data.
+
+    Returns:
+        RuleResolution: The 'Yes'/'No' verdicts keyed by '<criterion ID>: <criterion text>', in
+        the sense of the evaluation prompts ('Yes' when an inclusion criterion is met or an
+        exclusion criterion is not), the (kind, criterion) tuples still to be evaluated by the
+        model, and the total number of criteria.
+    """
+    trial_rules = get_trial_rules(trial)
+    truth = evaluate_rules(trial_rules, get_patient_facts(patient_ehr))
+
+    verdicts = {}
+    decided_ids = set()
+    for index in np.flatnonzero(~np.isnan(truth)):
+        rule = trial_rules.rules[index]
+        verdicts[rule.label] = "Yes" if bool(truth[index]) == (rule.kind == 'inclusion') else "No"
+        decided_ids.add(rule.criterion_id)
+
+    undecided = [(kind, criterion) for kind, criterion in trial_rules.criteria if criterion["id"] not in decided_ids]
+    return RuleResolution(verdicts, undecided, len(trial_rules.criteria))
+
+def render_criteria_keywords(criteria):
+    """Render criteria as the keyword list of an evaluation prompt.
+
+    Args:
+        criteria (list): (kind, criterion) tuples, as in RuleResolution.undecided.
+
+    Returns:
+        str: The criteria texts under the 'Inclusion Criteria:' and 'Exclusion Criteria:' headings.
+    """
+    lines = []
+    for kind, heading in (('inclusion', 'Inclusion Criteria:'), ('exclusion', 'Exclusion Criteria:')):
+        lines.append(heading)
+        lines.extend(f"- {criterion['text']}" for criterion_kind, criterion in criteria if criterion_kind == kind)
+    return '\n'.join(lines)
+
+class RuleStats:
+    """
+    Thread-safe record of the criteria and pairs decided by the rules without an LLM call.
+    """
+
+    def __init__(self):
+        self.criteria = 0
+        self.resolved = 0
+        self.pairs = 0
+        self.pairs_without_llm = 0
+        self._lock = threading.Lock()
+
+    def record(self, resolution, llm_called):
+        """Count the criteria of one patient-trial pair.
+
+        Args:
+            resolution (RuleResolution): The pair's rule resolution.
+            llm_called (bool): Whether the model still had to evaluate the pair.
+        """
+        with self._lock:
+            self.criteria += resolution.total
+            self.resolved += len(resolution.verdicts)
+            self.pairs += 1
+            self.pairs_without_llm += not llm_called
+        metrics.inc('rule_criteria_total', len(resolution.verdicts), result='resolved')
+        metrics.inc('rule_criteria_total', resolution.total - len(resolution.verdicts), result='model')
+        metrics.inc('rule_pairs_total', result='model' if llm_called else 'resolved')
+
+    def summary(self):
+        """Counts and the fraction of criteria resolved without an LLM call.
+
+        Returns:
+            dict: 'criteria', 'resolved', 'resolvedFraction', 'pairs' and 'pairsWithoutLLM'.
+        """
+        with self._lock:
+            return {
+                "criteria": self.criteria,
+                "resolved": self.resolved,
+                "resolvedFraction": self.resolved / self.criteria if self.criteria else 0.0,
+                "pairs": self.pairs,
+                "pairsWithoutLLM": self.pairs_without_llm,
+            }
+
+    def report(self):
+        """Log the rule engine line and return the summary."""
+        stats = self.summary()
+        logger.info("Rules resolved %s of %s criteria (%.1f%%) without an LLM call; %s of %s pairs needed no call",
+                    stats['resolved'], stats['criteria'], stats['resolvedFraction'] * 100,
+                    stats['pairsWithoutLLM'], stats['pairs'])
+        return stats
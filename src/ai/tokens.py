@@ -0,0 +1,38 @@
+import logging
+from functools import lru_cache
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Chat model whose tokenizer is used to measure prompts (kept in sync with model.MODEL_NAME)
+TOKENIZER_MODEL = 'gpt-4o-mini'
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    """Load the tiktoken encoding of the chat model.
+
+    Returns:
+        tiktoken.Encoding: The encoding, or None if it cannot be loaded (tiktoken downloads
+        the encoding files on first use, which fails without network access).
+    """
+    try:
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except Exception as e:
+        logger.warning("tiktoken encoding for %s unavailable (%s), estimating four characters per token",
+                       TOKENIZER_MODEL, e.__class__.__name__)
+        return None
+
+def count_tokens(text):
+    """Count the tokens of a prompt with the chat model's tokenizer.
+
+    Args:
+        text (str): The prompt text.
+
+    Returns:
+        int: The number of tokens, or an estimate of four characters per token when the
+        encoding is unavailable.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
@@ -0,0 +1,95 @@
+from typing import List, Literal
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+# Structured output requested from the chat model for the per-pair evaluation: OpenAI's strict
+# JSON schema mode guarantees an object of this shape, and other models are asked for it in the prompt
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "criteria": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "section": {"type": "string", "enum": ["Inclusion", "Exclusion", "Other"]},
+                    "criterion": {"type": "string"},
+                    "verdict": {"type": "string", "enum": ["Yes", "No"]},
+                    "reason": {"type": "string"},
+                },
+                "required": ["section", "criterion", "verdict", "reason"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["criteria"],
+    "additionalProperties": False,
+}
+
+EVALUATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "eligibility_verdicts", "strict": True, "schema": EVALUATION_SCHEMA},
+}
+
+class ResponseFormatError(ValueError):
+    """The model's answer does not follow the requested response schema."""
+
+class CriterionVerdict(BaseModel):
+    """
+    The model's verdict on one criterion keyword.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    section: Literal["Inclusion", "Exclusion", "Other"]
+    criterion: str
+    verdict: Literal["Yes", "No"]
+    reason: str = ""
+
+class EligibilityVerdicts(BaseModel):
+    """
+    The verdicts of a patient-trial pair, as returned in the structured response.
+    """
+    criteria: List[CriterionVerdict]
+
+def parse_verdicts(content):
+    """Validate a structured evaluation response into typed verdicts.
+
+    The JSON text is validated in a single pass, without building an intermediate dictionary.
+
+    Args:
+        content (str): The model response text.
+
+    Returns:
+        EligibilityVerdicts: The per-criterion verdicts.
+
+    Raises:
+        ResponseFormatError: If the text is not a JSON object of EVALUATION_SCHEMA, or has no verdict.
+    """
+    content = content.strip()
+    if content.startswith('```'):
+        # Models without a schema mode sometimes wrap the JSON in a Markdown code fence
+        content = content.strip('`').removeprefix('json').strip()
+    try:
+        verdicts = EligibilityVerdicts.model_validate_json(content)
+    except ValidationError as e:
+        raise ResponseFormatError(f"Invalid eligibility response: {e.error_count()} schema error(s), "
+                                  f"first: {e.errors()[0]['msg']}") from None
+    if not verdicts.criteria:
+        raise ResponseFormatError("Invalid eligibility response: no criteria")
+    return verdicts
+
+def verdicts_to_eligibility_dict(verdicts):
+    """Map typed verdicts to the {criterion: 'Yes'/'No'} dictionary used for the results.
+
+    Args:
+        verdicts (EligibilityVerdicts): The validated verdicts.
+
+    Returns:
+        dict: The verdict of every criterion. A criterion named in several sections is 'No'
+        if any of its verdicts is 'No'.
+    """
+    eligibility_dict = {}
+    for verdict in verdicts.criteria:
+        key = verdict.criterion.strip()
+        if eligibility_dict.get(key) != "No":
+            eligibility_dict[key] = verdict.verdict
+    return eligibility_dict
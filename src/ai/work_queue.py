@@ -0,0 +1,616 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from src.metrics import configure_logging, metrics
+from src.utils import write_text_atomic
+from src.ai import model
+from src.ai.batching import DEFAULT_MAX_PROMPT_TOKENS, evaluate_patient_trials
+from src.ai.prefilter import prefilter_pairs, report_prefilter
+from src.ai.retrieval import restrict_to_candidates
+from src.ai.results import consolidate_jsonl
+
+logger = logging.getLogger(__name__)
+
+# States of a work unit
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# Default time a worker holds a unit without a heartbeat before other workers may take it over
+DEFAULT_LEASE_SECONDS = 300
+
+class LeaseLost(Exception):
+    """The worker no longer holds the lease of the unit it is evaluating."""
+
+def default_owner():
+    """Name of this worker in the queue: host name and process ID."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """
+    Durable queue of matching work units in a SQLite database.
+
+    A unit is a block of patient-trial pairs, e.g. a batch of patients against a batch of
+    trials. Workers lease a unit for a limited time and extend the lease with heartbeats while
+    they evaluate it; the unit of a worker that dies is leased again once its lease expires.
+    A unit that fails max_attempts times is marked failed and left for the 'retry' command.
+
+    Several processes, also on different hosts, can share the queue as long as the database
+    lives on a filesystem with working file locks. Lease expiry uses each host's clock, so the
+    hosts' clocks should be synchronized to well within the lease time.
+    """
+
+    def __init__(self, queue_path, max_attempts=3):
+        """Open (or create) the queue database.
+
+        Args:
+            queue_path (str): Path of the SQLite database file.
+            max_attempts (int): Number of leases after which a unit that did not complete is failed.
+        """
+        self.queue_path = queue_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(queue_path)), exist_ok=True)
+
+        # Transactions are managed explicitly, so that a lease is a single BEGIN IMMEDIATE ... COMMIT
+        self._conn = sqlite3.connect(queue_path, check_same_thread=False, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                pairs TEXT NOT NULL,
+                pair_count INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_expires REAL,
+                result_path TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_status ON units (status, lease_expires)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS patients (id TEXT PRIMARY KEY)")
+
+    def enqueue(self, units, patient_ids=()):
+        """Add work units.
+
+        Args:
+            units (list): Each unit is a list of [patient_id, trial_id] pairs.
+            patient_ids (iterable): Every patient of the plan, including those left without any pair.
+
+        Returns:
+            int: The number of units added.
+        """
+        now = time.time()
+        rows = [(json.dumps(pairs), len(pairs), STATUS_PENDING, now) for pairs in units]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("INSERT INTO units (pairs, pair_count, status, updated) VALUES (?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR IGNORE INTO patients (id) VALUES (?)",
+                                   [(patient_id,) for patient_id in patient_ids])
+            self._conn.execute("COMMIT")
+        return len(rows)
+
+    def lease(self, owner, lease_seconds=DEFAULT_LEASE_SECONDS, now=None):
+        """Take the next pending unit, or one whose lease expired.
+
+        Args:
+            owner (str): The worker taking the unit.
+            lease_seconds (float): How long the unit is held without a heartbeat.
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns:
+            dict: The unit's 'id', 'pairs' and 'attempts' (including this one), or None if no
+            unit is available.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Units whose workers died on every attempt are not handed out again
+                self._conn.execute(
+                    "UPDATE units SET status = ?, error = 'lease expired', updated = ? "
+                    "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                    (STATUS_FAILED, now, STATUS_LEASED, now, self.max_attempts))
+                row = self._conn.execute(
+                    "SELECT id, pairs, attempts FROM units "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (STATUS_PENDING, STATUS_LEASED, now)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE units SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                        "updated = ? WHERE id = ?",
+                        (STATUS_LEASED, owner, now + lease_seconds, now, row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "pairs": json.loads(row[1]), "attempts": row[2] + 1}
+
+    def _update_owned(self, unit_id, owner, assignments, values):
+        """Update a unit leased by owner; returns False if the lease was lost."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE units SET {assignments}, updated = ? WHERE id = ? AND status = ? AND owner = ?",
+                (*values, time.time(), unit_id, STATUS_LEASED, owner))
+        return cursor.rowcount == 1
+
+    def heartbeat(self, unit_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS, now=None):
+        """Extend the lease of a unit.
+
+        Args:
+            unit_id (int): The unit ID.
+            owner (str): The worker holding the lease.
+            lease_seconds (float): The new lease duration from now.
+            now (float, optional): The current time, defaults to time.time().
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+        now = time.time() if now is None else now
+        return self._update_owned(unit_id, owner, "lease_expires = ?", (now + lease_seconds,))
+
+    def complete(self, unit_id, owner, result_path):
+        """Mark a leased unit as done.
+
+        Args:
+            unit_id (int): The unit ID.
+            owner (str): The worker holding the lease.
+            result_path (str): The shard file with the unit's results.
+
+        Returns:
+            bool: False if the worker no longer holds the lease, e.g. because it expired and
+            another worker took the unit over.
+        """
+        return self._update_owned(unit_id, owner, "status = ?, result_path = ?, error = NULL",
+                                  (STATUS_DONE, result_path))
+
+    def fail(self, unit_id, owner, error):
+        """Give a leased unit back after an error.
+
+        The unit is leased again later, unless it used up its attempts.
+
+        Args:
+            unit_id (int): The unit ID.
+            owner (str): The worker holding the lease.
+            error (str): Description of the error.
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+        return self._update_owned(
+            unit_id, owner, "status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?",
+            (self.max_attempts, STATUS_FAILED, STATUS_PENDING, error))
+
+    def retry_failed(self):
+        """Put the failed units back in the queue with fresh attempts.
+
+        Returns:
+            int: The number of units requeued.
+        """
+        with self._lock:
+            cursor = self._conn.execute("UPDATE units SET status = ?, attempts = 0, updated = ? WHERE status = ?",
+                                        (STATUS_PENDING, time.time(), STATUS_FAILED))
+        return cursor.rowcount
+
+    def reset(self):
+        """Remove every unit and the patients of the plan."""
+        with self._lock:
+            self._conn.execute("DELETE FROM units")
+            self._conn.execute("DELETE FROM patients")
+
+    def progress(self):
+        """Count the units and pairs in each state.
+
+        Returns:
+            dict: The number of units per status ('pending', 'leased', 'done', 'failed'), the
+            'total' number of units, and 'pairsDone' out of 'pairsTotal'.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*), COALESCE(SUM(pair_count), 0) FROM units GROUP BY status").fetchall()
+        progress = {status: 0 for status in (STATUS_PENDING, STATUS_LEASED, STATUS_DONE, STATUS_FAILED)}
+        pairs = {}
+        for status, units, pair_count in rows:
+            progress[status] = units
+            pairs[status] = pair_count
+        progress["total"] = sum(units for _, units, _ in rows)
+        progress["pairsDone"] = pairs.get(STATUS_DONE, 0)
+        progress["pairsTotal"] = sum(pairs.values())
+        return progress
+
+    def failures(self):
+        """The failed units.
+
+        Returns:
+            list: (unit_id, attempts, error) tuples.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT id, attempts, error FROM units WHERE status = ? ORDER BY id",
+                                      (STATUS_FAILED,)).fetchall()
+
+    def result_paths(self):
+        """The shard files of the completed units, in unit order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT result_path FROM units WHERE status = ? ORDER BY id",
+                                      (STATUS_DONE,)).fetchall()
+        return [row[0] for row in rows]
+
+    def planned_patients(self):
+        """The patients of the plan whose units are all done.
+
+        Returns:
+            list: Patient IDs in plan order, including the patients without any unit.
+        """
+        with self._lock:
+            patient_ids = [row[0] for row in self._conn.execute("SELECT id FROM patients ORDER BY rowid")]
+            rows = self._conn.execute("SELECT pairs FROM units WHERE status != ?", (STATUS_DONE,)).fetchall()
+        unfinished = {patient_id for row in rows for patient_id, _ in json.loads(row[0])}
+        return [patient_id for patient_id in patient_ids if patient_id not in unfinished]
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+class Heartbeat:
+    """
+    Background thread extending a unit's lease while the unit is being evaluated.
+    """
+
+    def __init__(self, queue, unit_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Args:
+            queue (WorkQueue): The queue holding the unit.
+            unit_id (int): The leased unit.
+            owner (str): The worker holding the lease.
+            lease_seconds (float): The lease duration; the lease is extended three times per lease.
+        """
+        self.queue = queue
+        self.unit_id = unit_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(self.unit_id, self.owner, self.lease_seconds):
+                logger.warning("Lost the lease of unit %s", self.unit_id)
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def plan_work(queue, patient_dir, trial_dir, patient_batch=50, trial_batch=50, keywords_path=None, top_k=None,
+              index_path=None, csv_path=None, embedding_dir=None):
+    """Split the patient x trial workload into work units and enqueue them.
+
+    The prefilter and the optional retrieval run once here, so each unit only holds the pairs
+    left to evaluate; blocks without any pair are not enqueued.
+
+    Args:
+        queue (WorkQueue): The queue to fill. It must be empty.
+        patient_dir (str): Directory of processed patient JSON files, or a feature store.
+        trial_dir (str): Directory of trial criteria text files, or a compiled criteria file.
+        patient_batch (int): Number of patients per unit.
+        trial_batch (int): Number of trials per unit.
+        keywords_path (str, optional): If given, the criteria keywords of the trials used by the
+            per-pair mode are computed once here and persisted for the workers, which only read
+            them. Required for workers in the 'sequential' mode.
+        top_k (int, optional): Only evaluate each patient against its top-K candidate trials.
+        index_path (str, optional): File where the retrieval index is persisted and updated.
+        csv_path (str, optional): study-links.csv, whose brief summaries are indexed with the criteria.
+        embedding_dir (str, optional): Shortlist the top-K trials by embedding similarity instead of BM25.
+
+    Returns:
+        dict: The number of 'units' and 'pairs' enqueued.
+
+    Raises:
+        ValueError: If the queue already holds units.
+    """
+    if queue.progress()["total"]:
+        raise ValueError(f"The work queue {queue.queue_path} is already planned; reset it to plan again")
+
+    patients = model.load_patients(patient_dir)
+    trials = model.load_trials(trial_dir)
+    eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+    report_prefilter(eligible_pairs)
+    if top_k is not None:
+        eligible_pairs = restrict_to_candidates(eligible_pairs, patients, trials, top_k, index_path, csv_path,
+                                                embedding_dir)
+
+    if keywords_path:
+        active_trials = [trial for index, trial in enumerate(trials) if eligible_pairs[:, index].any()]
+        model.precompute_trial_keywords(active_trials, keywords_path)
+
+    units = []
+    for patient_start in range(0, len(patients), patient_batch):
+        for trial_start in range(0, len(trials), trial_batch):
+            block = eligible_pairs[patient_start:patient_start + patient_batch, trial_start:trial_start + trial_batch]
+            pairs = [[patients[patient_start + row][0], trials[trial_start + column]["trialId"]]
+                     for row, column in zip(*block.nonzero())]
+            if pairs:
+                units.append(pairs)
+
+    queue.enqueue(units, patient_ids=[patient_id for patient_id, _ in patients])
+    summary = {"units": len(units), "pairs": sum(len(pairs) for pairs in units)}
+    logger.info("Planned %s units with %s pairs in %s", summary['units'], summary['pairs'], queue.queue_path)
+    return summary
+
+def load_keywords(keywords_path):
+    """Read the criteria keywords persisted by plan_work, without ever writing them.
+
+    Args:
+        keywords_path (str, optional): The keywords file.
+
+    Returns:
+        dict: The keywords keyed by trial ID, in the format of model.precompute_trial_keywords.
+        Empty if the file is not given or does not exist.
+    """
+    if not keywords_path or not os.path.exists(keywords_path):
+        return {}
+    with open(keywords_path, 'r') as f:
+        return json.load(f)
+
+def unit_keywords(unit_trials, trial_keywords):
+    """Pick the planned keywords of a unit's trials.
+
+    Trials whose keywords are missing or were computed for another criteria text, e.g. because
+    the trials changed after planning, get their keywords identified for this unit only: the
+    shared keywords file is left to plan_work.
+
+    Args:
+        unit_trials (list): The trials of the unit.
+        trial_keywords (dict): The planned keywords, see load_keywords.
+
+    Returns:
+        dict: The keywords of every trial of the unit.
+    """
+    keywords, missing = {}, []
+    for trial in unit_trials:
+        entry = trial_keywords.get(trial["trialId"])
+        if entry is not None and entry.get("criteriaHash") == model.hash_criteria_text(trial["criteria"]):
+            keywords[trial["trialId"]] = entry
+        else:
+            missing.append(trial)
+    if missing:
+        logger.warning("%s trials have no planned keywords; identifying them for this unit only", len(missing))
+        keywords.update(model.precompute_trial_keywords(missing))
+    return keywords
+
+def evaluate_unit(unit, patient_dir, trials_by_id, mode='sequential', trial_keywords=None,
+                  max_prompt_tokens=DEFAULT_MAX_PROMPT_TOKENS, llm=None, lease=None):
+    """Evaluate the pairs of a work unit.
+
+    Args:
+        unit (dict): The leased unit, see WorkQueue.lease.
+        patient_dir (str): Directory of processed patient JSON files, or a feature store.
+        trials_by_id (dict): The trials keyed by trial ID, as returned by model.load_trials.
+        mode (str): 'sequential' evaluates each pair with the per-pair prompts, 'batched' packs
+            each patient's trials into batched prompts.
+        trial_keywords (dict, optional): The criteria keywords of the per-pair mode, see load_keywords.
+        max_prompt_tokens (int): Maximum number of prompt tokens per batched request.
+        llm (ChatOpenAI, optional): The chat model of the batched mode. Defaults to model.get_llm().
+        lease (Heartbeat, optional): The heartbeat of the unit's lease, checked before each patient.
+
+    Returns:
+        list: The eligibility JSON structures of the eligible pairs, each with its 'patientId'.
+
+    Raises:
+        LeaseLost: If the lease was lost, so another worker may be evaluating the unit.
+    """
+    trial_ids_by_patient = {}
+    for patient_id, trial_id in unit["pairs"]:
+        trial_ids_by_patient.setdefault(patient_id, []).append(trial_id)
+
+    unit_trials = [trials_by_id[trial_id] for trial_id in sorted({trial_id for _, trial_id in unit["pairs"]})]
+    if mode == 'sequential':
+        trial_keywords = unit_keywords(unit_trials, trial_keywords or {})
+
+    results = []
+    for patient_id, patient_ehr in model.load_patients(patient_dir, list(trial_ids_by_patient)):
+        if lease is not None and lease.lost:
+            raise LeaseLost(f"lost the lease of unit {unit['id']}")
+        patient_trials = [trials_by_id[trial_id] for trial_id in trial_ids_by_patient[patient_id]]
+        if mode == 'batched':
+            eligible = evaluate_patient_trials(patient_id, patient_ehr, patient_trials, max_prompt_tokens, llm)
+        else:
+            eligible = [model.evaluate_pair(patient_id, patient_ehr, trial, trial_keywords[trial["trialId"]]["keywords"])
+                        for trial in patient_trials]
+        results.extend({"patientId": patient_id, **trial_info} for trial_info in eligible if trial_info is not None)
+    return results
+
+def run_worker(queue_path, patient_dir, trial_dir, shard_dir, mode='sequential', keywords_path=None,
+               lease_seconds=DEFAULT_LEASE_SECONDS, owner=None, wait=True, poll_seconds=5.0, max_units=None,
+               max_prompt_tokens=DEFAULT_MAX_PROMPT_TOKENS, llm=None):
+    """Lease and evaluate work units until the queue is drained.
+
+    The results of each unit are written atomically to shard_dir/unit-<id>.jsonl, in the
+    format of the ResultSink JSON Lines mode, before the unit is marked done. An error fails
+    only the unit, which is retried later.
+
+    Args:
+        queue_path (str): The work queue database.
+        patient_dir (str): Directory of processed patient JSON files, or a feature store.
+        trial_dir (str): Directory of trial criteria text files, or a compiled criteria file.
+        shard_dir (str): Directory of the per-unit result files.
+        mode (str): 'sequential' or 'batched', see evaluate_unit.
+        keywords_path (str, optional): The criteria keywords persisted by plan_work. The file is
+            only read; trials missing from it are identified per unit, see unit_keywords.
+        lease_seconds (float): The lease duration, extended by heartbeats while a unit runs.
+        owner (str, optional): The worker name. Defaults to the host name and process ID.
+        wait (bool): Keep polling while other workers hold units, to take over those whose lease
+            expires. Without it the worker stops as soon as no unit is available.
+        poll_seconds (float): Polling interval when waiting.
+        max_units (int, optional): Stop after this many units.
+        max_prompt_tokens (int): Maximum number of prompt tokens per batched request.
+        llm (ChatOpenAI, optional): The chat model of the batched mode. Defaults to model.get_llm().
+
+    Returns:
+        dict: The number of units 'completed' and 'failed' by this worker, and 'lost', those whose
+        lease expired and was taken over by another worker before they were done.
+    """
+    owner = owner or default_owner()
+    queue = WorkQueue(queue_path)
+    trials_by_id = {trial["trialId"]: trial for trial in model.load_trials(trial_dir)}
+    trial_keywords = load_keywords(keywords_path) if mode == 'sequential' else None
+    os.makedirs(shard_dir, exist_ok=True)
+
+    summary = {"completed": 0, "failed": 0, "lost": 0}
+    while max_units is None or sum(summary.values()) < max_units:
+        unit = queue.lease(owner, lease_seconds)
+        if unit is None:
+            progress = queue.progress()
+            if wait and progress[STATUS_PENDING] + progress[STATUS_LEASED]:
+                time.sleep(poll_seconds)
+                continue
+            break
+
+        logger.info("Worker %s: unit %s with %s pairs (attempt %s)", owner, unit['id'], len(unit['pairs']),
+                    unit['attempts'])
+        with Heartbeat(queue, unit["id"], owner, lease_seconds) as heartbeat:
+            try:
+                with metrics.timer('work_unit_seconds'):
+                    results = evaluate_unit(unit, patient_dir, trials_by_id, mode, trial_keywords,
+                                            max_prompt_tokens, llm, heartbeat)
+                if heartbeat.lost:
+                    raise LeaseLost(f"lost the lease of unit {unit['id']}")
+                result_path = os.path.join(os.path.abspath(shard_dir), f"unit-{unit['id']:06d}.jsonl")
+                write_text_atomic(result_path, ''.join(json.dumps(result) + '\n' for result in results))
+            except LeaseLost:
+                # The unit is another worker's now: it is neither failed nor counted here
+                logger.warning("Worker %s: lost the lease of unit %s, leaving it to its new owner", owner, unit['id'])
+                metrics.inc('work_units_total', status='lost')
+                summary["lost"] += 1
+                continue
+            except Exception as e:
+                logger.warning("Worker %s: unit %s failed: %s: %s", owner, unit['id'], e.__class__.__name__, e)
+                metrics.inc('work_units_total', status='failed')
+                queue.fail(unit["id"], owner, f"{e.__class__.__name__}: {e}")
+                summary["failed"] += 1
+                continue
+
+        if not queue.complete(unit["id"], owner, result_path):
+            logger.warning("Worker %s: lost the lease of unit %s before completing it", owner, unit['id'])
+            metrics.inc('work_units_total', status='lost')
+            summary["lost"] += 1
+            continue
+        metrics.inc('work_units_total', status='done')
+        summary["completed"] += 1
+
+    queue.close()
+    return summary
+
+def report_progress(queue):
+    """Log the progress of a queue and its failed units.
+
+    Returns:
+        dict: The progress, see WorkQueue.progress.
+    """
+    progress = queue.progress()
+    logger.info("%s/%s units done (%s/%s pairs), %s leased, %s pending, %s failed", progress[STATUS_DONE],
+                progress["total"], progress["pairsDone"], progress["pairsTotal"], progress[STATUS_LEASED],
+                progress[STATUS_PENDING], progress[STATUS_FAILED])
+    for unit_id, attempts, error in queue.failures():
+        logger.warning("Unit %s failed after %s attempts: %s", unit_id, attempts, error)
+    return progress
+
+def merge_results(queue, output_dir):
+    """Merge the shard files of the completed units into the per-patient eligibility files.
+
+    Args:
+        queue (WorkQueue): The queue of the run.
+        output_dir (str): Directory where the {patient_id}_eligibility.json files are written.
+
+    Returns:
+        dict: The number of 'patients' written and of 'trials' they list, see results.consolidate_jsonl.
+
+    The files are replaced, as in a direct run: every planned patient whose units are all done
+    gets a file, with an empty list if no trial was found eligible.
+    """
+    progress = queue.progress()
+    if progress["total"] > progress[STATUS_DONE]:
+        logger.warning("Merging %s of %s units; the others are not done", progress[STATUS_DONE], progress["total"])
+    return consolidate_jsonl(queue.result_paths(), output_dir, patient_ids=queue.planned_patients())
+
+if __name__ == "__main__":
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Distributed patient-trial matching through a shared work queue.")
+    parser.add_argument('--queue', required=True, help="The work queue database, on a filesystem shared by the workers.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan', help="Split the workload into units and enqueue them.")
+    plan_parser.add_argument('--patients', required=True, help="Directory of processed patient JSON files or a feature store.")
+    plan_parser.add_argument('--trials', required=True, help="Directory of trial criteria text files or a compiled criteria file.")
+    plan_parser.add_argument('--keywords', help="JSON file of the criteria keywords, computed once for the workers. "
+                                                "Required unless the workers run in the batched mode.")
+    plan_parser.add_argument('--mode', choices=['sequential', 'batched'], default='sequential',
+                             help="The mode the workers will run in.")
+    plan_parser.add_argument('--patient-batch', type=int, default=50, help="Number of patients per unit.")
+    plan_parser.add_argument('--trial-batch', type=int, default=50, help="Number of trials per unit.")
+    plan_parser.add_argument('--top-k', type=int, help="Only evaluate each patient against its top-K retrieved trials.")
+    plan_parser.add_argument('--index', help="File where the retrieval index is persisted and updated.")
+    plan_parser.add_argument('--csv', help="study-links.csv, whose brief summaries are indexed with the criteria.")
+    plan_parser.add_argument('--reset', action='store_true', help="Drop the units of a previous plan first.")
+
+    work_parser = subparsers.add_parser('work', help="Evaluate units until the queue is drained.")
+    work_parser.add_argument('--patients', required=True, help="Directory of processed patient JSON files or a feature store.")
+    work_parser.add_argument('--trials', required=True, help="Directory of trial criteria text files or a compiled criteria file.")
+    work_parser.add_argument('--shards', required=True, help="Directory of the per-unit result files.")
+    work_parser.add_argument('--keywords', help="JSON file of the criteria keywords written by 'plan'.")
+    work_parser.add_argument('--mode', choices=['sequential', 'batched'], default='sequential',
+                             help="Send one prompt per pair or batch several trials per prompt.")
+    work_parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                             help="Time after which the unit of a silent worker is handed to another one.")
+    work_parser.add_argument('--no-wait', action='store_true', help="Stop as soon as no unit is available.")
+    work_parser.add_argument('--llm-cache', help="SQLite LLM response cache, e.g. on the shared filesystem.")
+    work_parser.add_argument('--summary-tokens', type=int, default=model.DEFAULT_SUMMARY_TOKENS,
+                             help="Token budget of the patient summary sent in prompts; 0 sends the raw EHR data.")
+    work_parser.add_argument('--no-rules', dest='rules', action='store_false',
+                             help="Send every criterion to the model instead of deciding numeric and temporal ones locally.")
+
+    subparsers.add_parser('status', help="Show the progress and the failed units.")
+    subparsers.add_parser('retry', help="Requeue the failed units.")
+    merge_parser = subparsers.add_parser('merge', help="Merge the shard results into per-patient files.")
+    merge_parser.add_argument('--output', required=True, help="Directory for the eligibility JSON files.")
+    args = parser.parse_args()
+
+    if args.command in ('plan', 'work') and args.mode == 'sequential' and not args.keywords:
+        parser.error("--keywords is required in the sequential mode; 'plan' computes the keywords once for the workers")
+
+    work_queue = WorkQueue(args.queue)
+    if args.command == 'plan':
+        if args.reset:
+            work_queue.reset()
+        plan_work(work_queue, args.patients, args.trials, args.patient_batch, args.trial_batch, args.keywords,
+                  args.top_k, args.index, args.csv)
+    elif args.command == 'work':
+        if args.llm_cache:
+            model.configure_llm_cache(args.llm_cache)
+        model.configure_patient_summary(args.summary_tokens or None)
+        rule_stats = model.configure_rule_engine(args.rules)
+        run_worker(args.queue, args.patients, args.trials, args.shards, args.mode, args.keywords,
+                   lease_seconds=args.lease_seconds, wait=not args.no_wait)
+        if rule_stats is not None:
+            rule_stats.report()
+    elif args.command == 'retry':
+        logger.info("Requeued %s failed units", work_queue.retry_failed())
+    elif args.command == 'merge':
+        merge_results(work_queue, args.output)
+    report_progress(work_queue)
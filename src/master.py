@@ -1,40 +1,246 @@
 import argparse
-import subprocess
 import os
 import sys
+import time
+import logging
+import unittest
+from contextlib import contextmanager
 
-def run_scraper():
-    print("Running the scraper...")
-    subprocess.run([sys.executable, os.path.join('scraping', 'scraper.py')])
+# Project root, added to the import path so the stages can be imported as src.* modules
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
 
-def run_preprocess():
-    print("Running the preprocessor...")
-    subprocess.run([sys.executable, os.path.join('ai', 'preprocess.py')])
+from src.metrics import configure_logging, metrics
 
-def run_model():
-    print("Running the model...")
-    subprocess.run([sys.executable, os.path.join('ai', 'model.py')])
+logger = logging.getLogger(__name__)
+
+# Data directory under which every stage reads and writes by default
+default_data_dir = os.path.join(project_root, 'data')
+
+def default_paths(data_dir=default_data_dir):
+    """Input and output locations of every stage under a data directory.
+
+    Args:
+        data_dir (str): The data directory.
+
+    Returns:
+        dict: The paths keyed by name; any of them can be overridden on the command line.
+    """
+    return {
+        "study_links": os.path.join(data_dir, 'raw', 'study-links.csv'),
+        "trials": os.path.join(data_dir, 'raw', 'scraped'),
+        "patients_xml": os.path.join(data_dir, 'raw', 'patients_ehr'),
+        "patients": os.path.join(data_dir, 'processed', 'patients_json'),
+        "patient_store": os.path.join(data_dir, 'processed', 'patients_store'),
+        "keywords": os.path.join(data_dir, 'processed', 'trial_keywords.json'),
+        "retrieval_index": os.path.join(data_dir, 'processed', 'retrieval_index.json'),
+        "llm_cache": os.path.join(data_dir, 'cache', 'llm_cache.sqlite'),
+        "outputs": os.path.join(data_dir, 'outputs'),
+    }
+
+@contextmanager
+def stage_timer(name, timings):
+    """Measure the wall time of a stage.
+
+    Args:
+        name (str): The stage name.
+        timings (dict): Receives the elapsed seconds under the stage name.
+    """
+    logger.info("Running the %s...", name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        logger.info("The %s finished in %.1fs", name, timings[name])
+
+def run_scraper(paths, backend='selenium', workers=4):
+    """Save the criteria of the studies in the study links CSV.
+
+    Args:
+        paths (dict): The pipeline paths, see default_paths.
+        backend (str): 'selenium' or 'http', see src.scraping.scraper.main.
+        workers (int): Number of concurrent browsers or HTTP requests.
+
+    Returns:
+        list: The NCT numbers whose fetch failed.
+    """
+    from src.scraping import scraper
+    return scraper.main(workers=workers, backend=backend, output_directory=paths["trials"],
+                        study_links_path=paths["study_links"])
+
+def run_preprocess(paths, workers=None):
+    """Convert the new and changed patient XML files to JSON and refresh the feature store.
+
+    Args:
+        paths (dict): The pipeline paths, see default_paths.
+        workers (int, optional): Number of worker processes. Defaults to the number of cores.
+
+    Returns:
+        dict: The preprocessing summary of src.ai.preprocess.process_xml_files.
+    """
+    from src.ai.preprocess import process_xml_files
+    os.makedirs(paths["patients"], exist_ok=True)
+    return process_xml_files(paths["patients_xml"], paths["patients"], workers=workers or os.cpu_count() or 1,
+                             incremental=True, store_directory=paths["patient_store"])
+
+def select_patient_dir(paths, patients_given=False):
+    """Choose where the model stage reads the patients from.
+
+    Args:
+        paths (dict): The pipeline paths, see default_paths.
+        patients_given (bool): The patients directory was passed explicitly, without a feature store.
+
+    Returns:
+        str: The feature store when the preprocessing stage built one, since loading it is much
+        faster than reading the JSON files one by one. An explicitly passed patients directory
+        is always used as is: nothing ties the default store to that directory's patients.
+    """
+    from src.ai.feature_store import is_feature_store
+
+    if patients_given or not is_feature_store(paths["patient_store"]):
+        return paths["patients"]
+    return paths["patient_store"]
+
+def run_model(paths, mode='sequential', top_k=None, summary_tokens=None, rules=True, patients_given=False):
+    """Match every patient with the trials and write the eligibility results.
+
+    Patients are read from the directory chosen by select_patient_dir.
+
+    Args:
+        paths (dict): The pipeline paths, see default_paths.
+        mode (str): 'sequential' sends one prompt per pair, 'batched' packs several trials into
+            each prompt and 'async' sends the per-pair prompts concurrently.
+        top_k (int, optional): Only evaluate each patient against its top-K retrieved trials.
+        summary_tokens (int, optional): Token budget of the patient summary in prompts.
+            0 sends the raw EHR data. Defaults to model.DEFAULT_SUMMARY_TOKENS.
+        rules (bool): Decide the numeric and temporal criteria with the rule engine and only send
+            the others to the model, in the 'sequential' and 'async' modes.
+        patients_given (bool): The patients directory was passed explicitly, see select_patient_dir.
+    """
+    from src.ai import model
+
+    model.configure_llm_cache(paths["llm_cache"])
+    model.configure_patient_summary(model.DEFAULT_SUMMARY_TOKENS if summary_tokens is None else summary_tokens or None)
+    model.configure_rule_engine(rules)
+    patient_dir = select_patient_dir(paths, patients_given)
+    logger.info("Reading the patients from %s", patient_dir)
+    os.makedirs(paths["outputs"], exist_ok=True)
+    retrieval = {"top_k": top_k, "index_path": paths["retrieval_index"], "csv_path": paths["study_links"]}
+
+    if mode == 'batched':
+        from src.ai.batching import process_patients_and_trials_batched
+        process_patients_and_trials_batched(patient_dir, paths["trials"], paths["outputs"], **retrieval)
+    elif mode == 'async':
+        from src.ai.async_engine import run_async_matching
+        run_async_matching(patient_dir, paths["trials"], paths["outputs"], keywords_path=paths["keywords"], **retrieval)
+    else:
+        model.process_patients_and_trials(patient_dir, paths["trials"], paths["outputs"], paths["keywords"], **retrieval)
+
+    logger.info("LLM cache stats: %s", model.llm_cache.stats())
+    if model.patient_summary_tokens is not None:
+        model.prompt_size_stats.report()
+    if model.rule_stats is not None:
+        model.rule_stats.report()
 
 def run_tests():
-    print("Running unit tests...")
-    subprocess.run([sys.executable, '-m', 'unittest', 'discover', '-s', 'ai', '-p', '*_test.py'])
+    """Run the unit tests in the tests directory.
 
-def main(scrape, preprocess, model, test):
+    Returns:
+        bool: True if every test passed.
+    """
+    suite = unittest.defaultTestLoader.discover(os.path.join(project_root, 'tests'), top_level_dir=project_root)
+    return unittest.TextTestRunner().run(suite).wasSuccessful()
+
+def report_timings(timings):
+    """Log the wall time of every stage that ran, and the total."""
+    for name, seconds in timings.items():
+        logger.info("%14s: %8.1fs", name, seconds)
+    logger.info("%14s: %8.1fs", 'total', sum(timings.values()))
+
+def main(scrape, preprocess, model, test, scrape_backend='selenium', data_dir=default_data_dir, paths=None,
+         workers=4, mode='sequential', top_k=None, summary_tokens=None, metrics_file=None, rules=True):
+    """Run the selected stages in order, in this process.
+
+    Args:
+        scrape (bool): Run the scraper.
+        preprocess (bool): Run the preprocessor.
+        model (bool): Run the eligibility model.
+        test (bool): Run the unit tests.
+        scrape_backend (str): 'selenium' or 'http'.
+        data_dir (str): The data directory the default paths are built from.
+        paths (dict, optional): Paths overriding the defaults, see default_paths.
+        workers (int): Number of concurrent scraping workers.
+        mode (str): Model run mode, see run_model.
+        top_k (int, optional): Retrieval shortlist size, see run_model.
+        summary_tokens (int, optional): Patient summary budget, see run_model.
+        metrics_file (str, optional): Where the run metrics are written in the Prometheus text
+            format. They are always logged at the end of the run.
+        rules (bool): Decide numeric and temporal criteria with the rule engine, see run_model.
+
+    Returns:
+        dict: The wall time in seconds of every stage that ran.
+
+    Raises:
+        SystemExit: With status 1, after the timings and metrics are reported, if a unit test failed.
+    """
+    overrides = paths or {}
+    patients_given = "patients" in overrides and "patient_store" not in overrides
+    paths = {**default_paths(data_dir), **overrides}
+    metrics.reset()
+    timings = {}
     if scrape:
-        run_scraper()
+        with stage_timer('scraper', timings):
+            run_scraper(paths, scrape_backend, workers)
     if preprocess:
-        run_preprocess()
+        with stage_timer('preprocessor', timings):
+            run_preprocess(paths)
     if model:
-        run_model()  # Only run the model if specified
+        with stage_timer('model', timings):
+            run_model(paths, mode, top_k, summary_tokens, rules, patients_given)
+    tests_passed = True
     if test:
-        run_tests()
+        with stage_timer('unit tests', timings):
+            tests_passed = run_tests()
+    if timings:
+        report_timings(timings)
+        metrics.report()
+    if metrics_file:
+        metrics.write_prometheus(metrics_file)
+    if not tests_passed:
+        logger.error("Some unit tests failed")
+        raise SystemExit(1)
+    return timings
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Master program to run scraping, preprocessing, and modeling.")
     parser.add_argument('--scrape', action='store_true', help="Run the scraper.")
+    parser.add_argument('--scrape-backend', choices=['selenium', 'http'], default='selenium',
+                        help="Scrape with a headless browser or fetch the study records over HTTP.")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent scraping workers.")
     parser.add_argument('--preprocess', action='store_true', help="Run the preprocessor.")
+    parser.add_argument('--model', action='store_true', help="Run the eligibility model.")
+    parser.add_argument('--mode', choices=['sequential', 'batched', 'async'], default='sequential',
+                        help="Send one prompt per pair, batch several trials per prompt, or send prompts concurrently.")
+    parser.add_argument('--top-k', type=int, help="Only evaluate each patient against its top-K retrieved trials.")
+    parser.add_argument('--summary-tokens', type=int,
+                        help="Token budget of the patient summary sent in prompts; 0 sends the raw EHR data.")
+    parser.add_argument('--no-rules', dest='rules', action='store_false',
+                        help="Send every criterion to the model instead of deciding numeric and temporal ones locally.")
     parser.add_argument('--test', action='store_true', help="Run unit tests.")
-    
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Minimum level of the log records; DEBUG shows every patient-trial pair.")
+    parser.add_argument('--log-json', action='store_true', help="Write the log records as JSON lines.")
+    parser.add_argument('--metrics-file', help="Write the run metrics to this file in the Prometheus text format.")
+    parser.add_argument('--data-dir', default=default_data_dir, help="Data directory of the default paths.")
+    for name in default_paths():
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help=f"Override the {name.replace('_', ' ')} path.")
+
     args = parser.parse_args()
-    
-    main(args.scrape, args.preprocess, args.test)
+    configure_logging(args.log_level, json_format=args.log_json)
+
+    overrides = {name: getattr(args, name) for name in default_paths() if getattr(args, name) is not None}
+    main(args.scrape, args.preprocess, args.model, args.test, scrape_backend=args.scrape_backend,
+         data_dir=args.data_dir, paths=overrides, workers=args.workers, mode=args.mode, top_k=args.top_k,
+         summary_tokens=args.summary_tokens, metrics_file=args.metrics_file, rules=args.rules)
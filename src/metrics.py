@@ -0,0 +1,222 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from src.utils import write_text_atomic
+
+# Upper bounds in seconds of the histogram buckets of every timer
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+# Attributes every log record has; anything else was passed in `extra` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+def _key(name, labels):
+    """Hashable key of a metric and its labels."""
+    return name, tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=None):
+    """Render labels in the Prometheus text format, e.g. '{section="Problems"}'."""
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    rendered = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for name, value in items)
+    return '{' + rendered + '}'
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and timers of a pipeline run.
+
+    Counters are monotonically increasing totals. Timers record durations in seconds as a
+    histogram with a count, a sum and cumulative buckets. Both can carry labels, e.g.
+    metrics.inc('preprocess_section_rows_total', 12, section='Problems').
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple): Upper bounds in seconds of the timer histogram buckets.
+        """
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter.
+
+        Args:
+            name (str): The counter name.
+            value (float): The amount to add.
+            **labels: The labels of the series.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration.
+
+        Args:
+            name (str): The timer name.
+            seconds (float): The duration.
+            **labels: The labels of the series.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(self.buckets)}
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    timer["buckets"][index] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time the enclosed block, also when it raises.
+
+        Args:
+            name (str): The timer name.
+            **labels: The labels of the series.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        """The current value of a counter series, 0 if it was never incremented."""
+        with self._lock:
+            return self.counters.get(_key(name, labels), 0)
+
+    def snapshot(self):
+        """Copy every series.
+
+        Returns:
+            dict: 'counters' and 'timers', each a list of series with their 'name', 'labels' and
+            values ('value' for counters; 'count', 'sum', 'max' and 'buckets' for timers).
+        """
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "timers": [{"name": name, "labels": dict(labels), "count": timer["count"], "sum": timer["sum"],
+                            "max": timer["max"], "buckets": list(timer["buckets"])}
+                           for (name, labels), timer in sorted(self.timers.items())],
+            }
+
+    def merge(self, snapshot):
+        """Add the series of a snapshot, e.g. one taken in a worker process.
+
+        Args:
+            snapshot (dict): A snapshot returned by snapshot(), with the same buckets.
+        """
+        with self._lock:
+            for series in snapshot["counters"]:
+                key = _key(series["name"], series["labels"])
+                self.counters[key] = self.counters.get(key, 0) + series["value"]
+            for series in snapshot["timers"]:
+                key = _key(series["name"], series["labels"])
+                timer = self.timers.get(key)
+                if timer is None:
+                    timer = self.timers[key] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(self.buckets)}
+                timer["count"] += series["count"]
+                timer["sum"] += series["sum"]
+                timer["max"] = max(timer["max"], series["max"])
+                timer["buckets"] = [a + b for a, b in zip(timer["buckets"], series["buckets"])]
+
+    def reset(self):
+        """Drop every series."""
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+
+    def to_prometheus(self):
+        """Render every series in the Prometheus text exposition format.
+
+        Returns:
+            str: Counters as counter metrics and timers as histograms in seconds.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for series in snapshot["counters"]:
+            if series["name"] not in typed:
+                lines.append(f"# TYPE {series['name']} counter")
+                typed.add(series["name"])
+            lines.append(f"{series['name']}{_format_labels(series['labels'].items())} {series['value']}")
+        for series in snapshot["timers"]:
+            name = series["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            labels = series["labels"].items()
+            for bound, count in zip(self.buckets, series["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {series['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text format atomically, e.g. for the node exporter's textfile collector.
+
+        Args:
+            path (str): The destination file, conventionally ending in .prom.
+        """
+        write_text_atomic(path, self.to_prometheus())
+
+    def report(self, logger=None):
+        """Log one line per series, at the end of a run.
+
+        Args:
+            logger (logging.Logger, optional): Defaults to the src.metrics logger.
+        """
+        logger = logger or logging.getLogger(__name__)
+        snapshot = self.snapshot()
+        for series in snapshot["counters"]:
+            logger.info("%s%s = %s", series["name"], _format_labels(series["labels"].items()), series["value"])
+        for series in snapshot["timers"]:
+            logger.info("%s%s: %d in %.3fs (mean %.4fs, max %.4fs)", series["name"],
+                        _format_labels(series["labels"].items()), series["count"], series["sum"],
+                        series["sum"] / series["count"], series["max"])
+
+# Registry shared by the pipeline modules
+metrics = MetricsRegistry()
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line, with the fields passed in `extra`.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level='INFO', json_format=False):
+    """Send the pipeline's log records to stderr.
+
+    Args:
+        level (str): The minimum level, e.g. 'DEBUG' to see every pair, 'INFO' for stage
+            summaries or 'WARNING' for problems only.
+        json_format (bool): Write one JSON object per record instead of plain text lines.
+    """
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logging.basicConfig(level=level.upper(), handlers=[handler], force=True)
@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import time
+import threading
+from datetime import datetime
+from src.utils import write_json_atomic
+
+# Name of the crawl state file kept next to the scraped criteria
+CRAWL_STATE_FILE = '.crawl-state.json'
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+def content_hash(text):
+    """
+    Compute the SHA-256 hex digest of a scraped criteria text.
+
+    Parameters:
+    text (str): The criteria text.
+
+    Returns:
+    str: The hex digest.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class CrawlState:
+    """
+    Per-study record of a crawl, checkpointed to a JSON file every few studies.
+
+    The file is rewritten once `save_every` studies were recorded since the last checkpoint, or
+    `save_interval` seconds after it, whichever comes first. Call save() at the end of a crawl to
+    write the remaining studies; a crash loses at most the studies of one batch, which the next
+    run fetches again.
+
+    Each entry is keyed by NCT number and holds the 'status' ('ok' or 'failed'), the 'fetchedAt'
+    time (ISO 8601), the 'contentHash' of the saved text, the 'output' file and the last 'error'.
+    """
+
+    def __init__(self, path, save_every=50, save_interval=30.0):
+        """
+        Parameters:
+        path (str): The crawl state file. It is loaded if it exists.
+        save_every (int): Number of recorded studies that triggers a checkpoint.
+        save_interval (float): Seconds after which a recorded study triggers a checkpoint.
+        """
+        self.path = path
+        self.entries = {}
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f).get('studies', {})
+
+    def save(self):
+        """Write the state file atomically."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        write_json_atomic(self.path, {'studies': self.entries}, indent=2)
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+
+    def _checkpoint(self):
+        """Count a recorded study and write the state file when a batch is complete."""
+        self._unsaved += 1
+        if self._unsaved >= self.save_every or time.monotonic() - self._last_save >= self.save_interval:
+            self._save()
+
+    def needs_fetch(self, nct_number, refresh_ttl=None, now=None):
+        """
+        Decide whether a study has to be (re)fetched.
+
+        Parameters:
+        nct_number (str): The NCT number of the study.
+        refresh_ttl (timedelta, optional): Successful entries older than this are fetched again.
+            Without it, successful entries are never refreshed.
+        now (datetime, optional): The current time, defaults to datetime.now().
+
+        Returns:
+        bool: True if the study was never fetched, failed, lost its output file or is stale.
+        """
+        entry = self.entries.get(nct_number)
+        if entry is None or entry['status'] != STATUS_OK:
+            return True
+        if not os.path.exists(entry['output']):
+            return True
+        if refresh_ttl is not None:
+            now = now or datetime.now()
+            return now - datetime.fromisoformat(entry['fetchedAt']) >= refresh_ttl
+        return False
+
+    def pending(self, studies, refresh_ttl=None, now=None):
+        """
+        Keep the studies that need to be fetched.
+
+        Parameters:
+        studies (list): (study_url, nct_number, nct_name) tuples.
+        refresh_ttl (timedelta, optional): See needs_fetch.
+        now (datetime, optional): See needs_fetch.
+
+        Returns:
+        list: The studies to fetch, in their original order.
+        """
+        now = now or datetime.now()
+        return [study for study in studies if self.needs_fetch(study[1], refresh_ttl, now)]
+
+    def save_criteria(self, nct_number, output_path, text, write):
+        """
+        Save a fetched criteria text and checkpoint the study as fetched.
+
+        The file is only rewritten when its content hash changed since the last fetch.
+
+        Parameters:
+        nct_number (str): The NCT number of the study.
+        output_path (str): The criteria file.
+        text (str): The criteria text.
+        write (callable): Writes text to output_path, e.g. src.utils.write_text_atomic.
+
+        Returns:
+        bool: True if the file was (re)written, False if its content was unchanged.
+        """
+        digest = content_hash(text)
+        with self._lock:
+            previous = self.entries.get(nct_number, {})
+            changed = previous.get('contentHash') != digest or not os.path.exists(output_path)
+            if changed:
+                write(output_path, text)
+            self.entries[nct_number] = {
+                'status': STATUS_OK,
+                'fetchedAt': datetime.now().isoformat(timespec='seconds'),
+                'contentHash': digest,
+                'output': output_path,
+                'error': None,
+            }
+            self._checkpoint()
+        return changed
+
+    def record_failure(self, nct_number, error):
+        """
+        Checkpoint a study whose fetch failed, keeping the previous hash and output if any.
+
+        Parameters:
+        nct_number (str): The NCT number of the study.
+        error (str): Description of the error.
+        """
+        with self._lock:
+            entry = dict(self.entries.get(nct_number, {}))
+            entry.update({
+                'status': STATUS_FAILED,
+                'fetchedAt': datetime.now().isoformat(timespec='seconds'),
+                'error': error,
+            })
+            entry.setdefault('contentHash', None)
+            entry.setdefault('output', None)
+            self.entries[nct_number] = entry
+            self._checkpoint()
+
+    def failed(self):
+        """NCT numbers whose last fetch failed."""
+        return sorted(nct for nct, entry in self.entries.items() if entry['status'] == STATUS_FAILED)
@@ -0,0 +1,196 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.metrics import metrics
+from src.utils import write_text_atomic
+from src.scraping.pool import HostPoliteness, ScrapeProgress
+
+logger = logging.getLogger(__name__)
+
+# ClinicalTrials.gov REST API (v2) serving one JSON document per study
+API_BASE_URL = 'https://clinicaltrials.gov/api/v2'
+
+# Only the modules needed for the criteria file are requested
+RECORD_FIELDS = 'protocolSection.identificationModule,protocolSection.eligibilityModule'
+
+# Labels shown on the study page for the API's enumerated values
+SEX_LABELS = {'ALL': 'All', 'FEMALE': 'Female', 'MALE': 'Male'}
+AGE_GROUP_LABELS = {'CHILD': 'Child', 'ADULT': 'Adult', 'OLDER_ADULT': 'Older Adult'}
+SAMPLING_METHOD_LABELS = {'PROBABILITY_SAMPLE': 'Probability Sample', 'NON_PROBABILITY_SAMPLE': 'Non-Probability Sample'}
+
+def make_session(pool_size=16, retries=3, backoff_factor=1.0):
+    """
+    Create an HTTP session with a pooled connection adapter and retries on transient errors.
+
+    Parameters:
+    pool_size (int): Number of keep-alive connections kept per host.
+    retries (int): Retries on connection errors, 429 and 5xx responses.
+    backoff_factor (float): Exponential backoff factor between retries.
+
+    Returns:
+    requests.Session: The configured session.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept': 'application/json'})
+    return session
+
+def fetch_study_record(session, nct_number, base_url=API_BASE_URL, timeout=30):
+    """
+    Fetch the JSON record of one study.
+
+    Parameters:
+    session (requests.Session): The pooled HTTP session.
+    nct_number (str): The NCT number of the clinical trial.
+    base_url (str): Base URL of the API.
+    timeout (float): Request timeout in seconds.
+
+    Returns:
+    dict: The study record.
+
+    Raises:
+    requests.HTTPError: If the API answers with an error status.
+    """
+    response = session.get(f"{base_url}/studies/{nct_number}", params={'fields': RECORD_FIELDS}, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+def format_age_range(eligibility):
+    """
+    Render the 'Ages Eligible for Study' line as shown on the study page.
+
+    Parameters:
+    eligibility (dict): The eligibilityModule of a study record.
+
+    Returns:
+    str: e.g. '18 Years to 80 Years (Adult,  Older Adult )', or None if nothing is stated.
+    """
+    minimum_age = eligibility.get('minimumAge')
+    maximum_age = eligibility.get('maximumAge')
+    if minimum_age and maximum_age:
+        age_range = f"{minimum_age} to {maximum_age}"
+    elif minimum_age:
+        age_range = f"{minimum_age} and older"
+    elif maximum_age:
+        age_range = f"up to {maximum_age}"
+    else:
+        age_range = ''
+
+    groups = [AGE_GROUP_LABELS.get(group, group) for group in eligibility.get('stdAges', [])]
+    if groups:
+        age_range = f"{age_range} ({',  '.join(groups)} )".strip()
+    return age_range or None
+
+def format_criteria_text(record, nct_name=None):
+    """
+    Build the text of a <nct_number>_criteria.txt file from a study record.
+
+    Parameters:
+    record (dict): The study record returned by fetch_study_record.
+    nct_name (str, optional): The study title; defaults to the record's brief title.
+
+    Returns:
+    str: The same layout the browser scraper writes: title, inclusion/exclusion criteria and
+    the 'Other Criteria' block with ages, sexes, healthy volunteers and sampling method.
+    """
+    protocol = record.get('protocolSection', {})
+    eligibility = protocol.get('eligibilityModule', {})
+    title = nct_name or protocol.get('identificationModule', {}).get('briefTitle', '')
+
+    inclusion_exclusion_text = eligibility.get('eligibilityCriteria', '').strip()
+    if eligibility.get('studyPopulation'):
+        inclusion_exclusion_text += f"\n\nStudy Population\n{eligibility['studyPopulation'].strip()}"
+
+    other_lines = []
+    age_range = format_age_range(eligibility)
+    if age_range:
+        other_lines += ['Ages Eligible for Study', age_range]
+    if eligibility.get('sex'):
+        other_lines += ['Sexes Eligible for Study', SEX_LABELS.get(eligibility['sex'], eligibility['sex'])]
+    if 'healthyVolunteers' in eligibility:
+        other_lines += ['Accepts Healthy Volunteers', 'Yes' if eligibility['healthyVolunteers'] else 'No']
+    if eligibility.get('samplingMethod'):
+        other_lines += ['Sampling Method',
+                        SAMPLING_METHOD_LABELS.get(eligibility['samplingMethod'], eligibility['samplingMethod'])]
+    other_criteria_text = '\n'.join(other_lines)
+
+    return f"Study Title: {title}\nInclusion/Exclusion Criteria:\n{inclusion_exclusion_text}\n\nOther Criteria:\n{other_criteria_text}"
+
+def fetch_criteria(session, nct_number, nct_name, output_directory, base_url=API_BASE_URL, crawl_state=None):
+    """
+    Fetch the criteria of one study over HTTP and save them without a browser.
+
+    Parameters:
+    session (requests.Session): The pooled HTTP session.
+    nct_number (str): The NCT number of the clinical trial.
+    nct_name (str): The title of the clinical trial.
+    output_directory (str): Where the <nct_number>_criteria.txt file is written.
+    base_url (str): Base URL of the API.
+    crawl_state (CrawlState, optional): If given, the outcome is checkpointed there.
+
+    Returns:
+    bool: True if the criteria were saved, False if the record could not be fetched.
+    """
+    try:
+        with metrics.timer('scrape_fetch_seconds', backend='http'):
+            record = fetch_study_record(session, nct_number, base_url)
+        file_name = f"{nct_number}_criteria.txt"
+        output_path = os.path.join(output_directory, file_name)
+        formatted_text = format_criteria_text(record, nct_name)
+        if crawl_state is not None:
+            crawl_state.save_criteria(nct_number, output_path, formatted_text, write_text_atomic)
+        else:
+            write_text_atomic(output_path, formatted_text)
+        logger.debug("Data for %s successfully written to %s", nct_number, file_name)
+        metrics.inc('scrape_studies_total', backend='http', status='saved')
+        return True
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("An error occurred for %s: %s", nct_number, e)
+        metrics.inc('scrape_studies_total', backend='http', status='failed')
+        if crawl_state is not None:
+            crawl_state.record_failure(nct_number, f"{e.__class__.__name__}: {e}")
+        return False
+
+def fetch_all(studies, output_directory, workers=8, base_url=API_BASE_URL, min_interval=0.0, session=None,
+              crawl_state=None):
+    """
+    Fetch the criteria of many studies concurrently over one pooled HTTP session.
+
+    Parameters:
+    studies (list): (study_url, nct_number, nct_name) tuples, as for the browser scraper.
+    output_directory (str): Where the <nct_number>_criteria.txt files are written.
+    workers (int): Number of concurrent requests.
+    base_url (str): Base URL of the API.
+    min_interval (float): Minimum seconds between two requests to the API host.
+    session (requests.Session, optional): Session to use; one is created if omitted.
+    crawl_state (CrawlState, optional): Checkpoints the outcome of every study.
+
+    Returns:
+    ScrapeProgress: The final counters, including the NCT numbers that failed.
+    """
+    session = session or make_session(pool_size=workers)
+    politeness = HostPoliteness(min_interval)
+    progress = ScrapeProgress(len(studies))
+
+    def fetch(study):
+        _, nct_number, nct_name = study
+        politeness.wait(base_url)
+        progress.record(nct_number, fetch_criteria(session, nct_number, nct_name, output_directory, base_url,
+                                                       crawl_state))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch, studies))
+    finally:
+        if crawl_state is not None:
+            crawl_state.save()
+
+    progress.report()
+    return progress
@@ -0,0 +1,216 @@
+import time
+import queue
+import threading
+import logging
+from urllib.parse import urlparse
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from src.scraping.scraper import scrape_criteria
+
+logger = logging.getLogger(__name__)
+
+def make_driver(headless=True):
+    """
+    Create a Chrome WebDriver suitable for a scraping worker.
+
+    Parameters:
+    headless (bool): Run Chrome without a visible window.
+
+    Returns:
+    webdriver.Chrome: The driver, with its window size set once so pages lay out as when maximized.
+    """
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--window-size=1920,1080')
+    return webdriver.Chrome(options=options)
+
+def driver_alive(driver):
+    """
+    Check whether a driver still answers commands.
+
+    Parameters:
+    driver (webdriver): The driver to probe.
+
+    Returns:
+    bool: False if the browser or its session is gone.
+    """
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+class HostPoliteness:
+    """
+    Enforce a minimum delay between requests to the same host across all workers.
+    """
+
+    def __init__(self, min_interval):
+        """
+        Parameters:
+        min_interval (float): Minimum number of seconds between two requests to one host.
+        """
+        self.min_interval = min_interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """
+        Block until a request to the host of url is allowed, and reserve that slot.
+
+        Parameters:
+        url (str): The URL about to be requested.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(host, now))
+            self._next_allowed[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class ScrapeProgress:
+    """
+    Thread-safe counters for the pages scraped by the pool.
+    """
+
+    def __init__(self, total):
+        """
+        Parameters:
+        total (int): Number of studies to scrape.
+        """
+        self.total = total
+        self.succeeded = 0
+        self.failed = []
+        self.restarts = 0
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, nct_number, success):
+        """Count one finished study."""
+        with self._lock:
+            if success:
+                self.succeeded += 1
+            else:
+                self.failed.append(nct_number)
+
+    def record_restart(self):
+        """Count one driver restart."""
+        with self._lock:
+            self.restarts += 1
+
+    def done(self):
+        """Number of studies finished, successfully or not."""
+        return self.succeeded + len(self.failed)
+
+    def pages_per_minute(self):
+        """Throughput since the start of the crawl."""
+        elapsed = time.monotonic() - self.start_time
+        return self.done() / elapsed * 60 if elapsed > 0 else 0.0
+
+    def report(self):
+        """Log the progress line."""
+        logger.info("Scraped %s/%s studies (%s failed, %s driver restarts) at %.1f pages/minute",
+                    self.done(), self.total, len(self.failed), self.restarts, self.pages_per_minute())
+
+def _scrape_worker(worker_id, studies, driver_factory, politeness, progress, output_directory, max_attempts,
+                   crawl_state=None):
+    """
+    Scrape studies from the shared queue with a single, reused WebDriver.
+
+    The driver is restarted whenever it raises a WebDriverException (for example when Chrome
+    crashes), or no longer answers after a failed study since scrape_criteria reports the errors
+    of its waits as a failure, and the study is retried up to max_attempts times.
+    """
+    driver = None
+    try:
+        while True:
+            try:
+                study_url, nct_number, nct_name = studies.get_nowait()
+            except queue.Empty:
+                return
+
+            success = False
+            error = None
+            for _ in range(max_attempts):
+                try:
+                    if driver is None:
+                        driver = driver_factory()
+                    politeness.wait(study_url)
+                    success = scrape_criteria(driver, study_url, nct_number, nct_name,
+                                              output_directory=output_directory, maximize=False,
+                                              crawl_state=crawl_state)
+                    if not success and not driver_alive(driver):
+                        raise WebDriverException("The driver stopped responding")
+                    error = None
+                    break
+                except WebDriverException as e:
+                    error = f"{e.__class__.__name__}: {e}"
+                    logger.warning("Worker %s: driver failed on %s (%s), restarting",
+                                   worker_id, nct_number, e.__class__.__name__)
+                    progress.record_restart()
+                    if driver is not None:
+                        try:
+                            driver.quit()
+                        except Exception:
+                            pass
+                    driver = None
+
+            # A study given up after repeated driver crashes is checkpointed as failed too
+            if error is not None and crawl_state is not None:
+                crawl_state.record_failure(nct_number, error)
+            progress.record(nct_number, success)
+    finally:
+        if driver is not None:
+            driver.quit()
+
+def scrape_with_pool(studies, output_directory, workers=4, driver_factory=make_driver, min_interval=1.0,
+                     max_attempts=2, report_interval=30.0, crawl_state=None):
+    """
+    Scrape many studies with a pool of WebDriver workers, each reusing one browser.
+
+    Parameters:
+    studies (list): (study_url, nct_number, nct_name) tuples.
+    output_directory (str): Where the <nct_number>_criteria.txt files are written.
+    workers (int): Number of concurrent drivers.
+    driver_factory (callable): Creates a new driver; defaults to a headless Chrome.
+    min_interval (float): Minimum seconds between two requests to the same host.
+    max_attempts (int): Attempts per study when the driver crashes.
+    report_interval (float): Seconds between two progress lines.
+    crawl_state (CrawlState, optional): Checkpoints the outcome of every study.
+
+    Returns:
+    ScrapeProgress: The final counters, including the NCT numbers that failed.
+    """
+    work = queue.Queue()
+    for study in studies:
+        work.put(study)
+
+    progress = ScrapeProgress(len(studies))
+    politeness = HostPoliteness(min_interval)
+    threads = [
+        threading.Thread(target=_scrape_worker, name=f"scraper-{worker_id}",
+                         args=(worker_id, work, driver_factory, politeness, progress, output_directory, max_attempts,
+                               crawl_state))
+        for worker_id in range(min(workers, len(studies)))
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Report progress until every worker has drained the queue
+    try:
+        while any(thread.is_alive() for thread in threads):
+            deadline = time.monotonic() + report_interval
+            for thread in threads:
+                thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            if any(thread.is_alive() for thread in threads):
+                progress.report()
+    finally:
+        if crawl_state is not None:
+            crawl_state.save()
+    progress.report()
+
+    return progress
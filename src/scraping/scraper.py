@@ -1,19 +1,28 @@
 import os
+import time
+import logging
+import argparse
+from datetime import timedelta
 import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from src.metrics import configure_logging, metrics
+from src.utils import write_text_atomic
+
+logger = logging.getLogger(__name__)
 
 # Get the current directory path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Path to store the scraped data (you can create a scraped folder)
+# Path to store the scraped data, created when the first study is saved
 output_dir = os.path.join(current_dir, '..', '..', 'data', 'raw', 'scraped')
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
 
-def scrape_criteria(driver, study_url, nct_number, nct_name):
+# CSV file listing the studies to scrape
+csv_path = os.path.join(current_dir, '..', '..', 'data', 'raw', 'study-links.csv')
+
+def scrape_criteria(driver, study_url, nct_number, nct_name, output_directory=None, maximize=True, crawl_state=None):
     """
     Scrape the inclusion/exclusion and other criteria from a clinical trial study page.
     
@@ -22,13 +31,27 @@ def scrape_criteria(driver, study_url, nct_number, nct_name):
     study_url (str): The URL of the clinical trial study.
     nct_number (str): The NCT number of the clinical trial.
     nct_name (str): The title of the clinical trial.
+    output_directory (str, optional): Where to save the file. Defaults to data/raw/scraped.
+    maximize (bool): Maximize the browser window before reading the page. Pooled drivers set
+        their window size once when they are created instead.
+    crawl_state (CrawlState, optional): If given, the outcome is checkpointed there, including
+        the error of a failed study so that it can be retried.
     
     Saves the scraped criteria to a text file named <nct_number>_criteria.txt in the specified output directory.
+
+    Returns:
+    bool: True if the criteria were saved, False if they could not be read from the page.
     """
+    if output_directory is None:
+        output_directory = output_dir
+        os.makedirs(output_directory, exist_ok=True)
+
     # Construct the URL for participation criteria
     criteria_url = study_url + "#participation-criteria"
+    start = time.perf_counter()
     driver.get(criteria_url)  # Navigate to the criteria URL
-    driver.maximize_window()   # Maximize the browser window
+    if maximize:
+        driver.maximize_window()   # Maximize the browser window
 
     try:
         # Wait until the inclusion/exclusion criteria element is present and retrieve its text
@@ -42,48 +65,98 @@ def scrape_criteria(driver, study_url, nct_number, nct_name):
             EC.presence_of_element_located((By.XPATH, '//*[@id="participation-criteria"]/ctg-participation-criteria/div[2]/div/div[2]/div[2]'))
         )
         other_criteria_text = other_criteria.text
+        metrics.observe('scrape_fetch_seconds', time.perf_counter() - start, backend='selenium')
 
         # Formatting text for output
         formatted_text = f"Study Title: {nct_name}\nInclusion/Exclusion Criteria:\n{inclusion_exclusion_text}\n\nOther Criteria:\n{other_criteria_text}"
         
         # Create the output file path
         file_name = f"{nct_number}_criteria.txt"
-        output_path = os.path.join(output_dir, file_name)
+        output_path = os.path.join(output_directory, file_name)
         
-        # Save the formatted text to a text file
-        with open(output_path, 'w') as file:
-            file.write(formatted_text)
+        # Save the formatted text to a text file, atomically so no half-written file is left behind
+        if crawl_state is not None:
+            crawl_state.save_criteria(nct_number, output_path, formatted_text, write_text_atomic)
+        else:
+            write_text_atomic(output_path, formatted_text)
 
-        print(f"Data for {nct_number} successfully written to {file_name}")
+        logger.debug("Data for %s successfully written to %s", nct_number, file_name)
+        metrics.inc('scrape_studies_total', backend='selenium', status='saved')
+        return True
     
     except Exception as e:
         # Handle any errors that occur during scraping
-        print(f"An error occurred for {nct_number}: {str(e)}")
+        logger.warning("An error occurred for %s: %s", nct_number, e)
+        metrics.inc('scrape_studies_total', backend='selenium', status='failed')
+        if crawl_state is not None:
+            crawl_state.record_failure(nct_number, f"{e.__class__.__name__}: {e}")
+        return False
 
-def main():
+def main(workers=4, headless=True, backend='selenium', refresh_ttl=None, state_path=None, output_directory=None,
+         study_links_path=None):
     """
-    Main function to initialize the WebDriver and read study links from a CSV file,
-    then scrape criteria for each study.
+    Main function to read study links from a CSV file and save the criteria of each study.
+
+    The crawl is checkpointed in a state file every few studies, so a rerun skips the studies
+    already fetched and retries only those that failed.
+
+    Parameters:
+    workers (int): Number of concurrent browsers or HTTP requests.
+    headless (bool): Run the browsers without a visible window.
+    backend (str): 'selenium' renders each study page in a pooled browser; 'http' fetches the
+    study records from the ClinicalTrials.gov API without a browser.
+    refresh_ttl (timedelta, optional): Also re-fetch studies fetched longer ago than this.
+    state_path (str, optional): The crawl state file. Defaults to .crawl-state.json in the output directory.
+    output_directory (str, optional): Where the criteria files are saved. Defaults to data/raw/scraped.
+    study_links_path (str, optional): The CSV file listing the studies. Defaults to data/raw/study-links.csv.
+
+    Returns:
+    list: The NCT numbers whose last fetch failed.
     """
-    # Initialize the WebDriver (Make sure to specify the correct path to your chromedriver)
-    driver = webdriver.Chrome()  # Ensure chromedriver is in PATH or specify path here
-    
-    # Path to the CSV file containing study links
-    csv_path = os.path.join(current_dir, '..', '..', 'data', 'raw', 'study-links.csv')
-    
+    from src.scraping.crawl_state import CrawlState, CRAWL_STATE_FILE
+
+    output_directory = output_directory or output_dir
+    os.makedirs(output_directory, exist_ok=True)
+
     # Read the study-links.csv file into a DataFrame
-    df = pd.read_csv(csv_path)
+    df = pd.read_csv(study_links_path or csv_path)
 
-    # Loop over each study URL in the CSV and scrape the data
-    for index, row in df.iterrows():
-        study_url = row['Study URL']
-        nct_number = row['NCT Number']
-        nct_name = row['Study Title']
-        
-        print(f"Scraping data for NCT Number: {nct_number} from URL: {study_url}")
-        
-        # Call the scrape_criteria function for each study
-        scrape_criteria(driver, study_url, nct_number, nct_name)
+    studies = [
+        (row['Study URL'], row['NCT Number'], row['Study Title'])
+        for _, row in df.iterrows()
+    ]
+
+    crawl_state = CrawlState(state_path or os.path.join(output_directory, CRAWL_STATE_FILE))
+    pending = crawl_state.pending(studies, refresh_ttl)
+    logger.info("Scraping %s of %s studies (%s up to date) with %s worker(s) using the %s backend",
+                len(pending), len(studies), len(studies) - len(pending), workers, backend)
+
+    if pending:
+        if backend == 'http':
+            from src.scraping.http_fetch import fetch_all
+            fetch_all(pending, output_directory, workers=workers, crawl_state=crawl_state)
+        else:
+            # Imported here because the pool module builds on scrape_criteria
+            from src.scraping.pool import make_driver, scrape_with_pool
+
+            # Each worker owns one driver (chromedriver must be in PATH) and reuses it across studies
+            scrape_with_pool(pending, output_directory, workers=workers, driver_factory=lambda: make_driver(headless),
+                             crawl_state=crawl_state)
+
+    failed = crawl_state.failed()
+    if failed:
+        logger.warning("%s studies failed and will be retried on the next run: %s", len(failed), ', '.join(failed))
+    return failed
 
 if __name__ == "__main__":
-    main()  
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Save the eligibility criteria of the studies in study-links.csv.")
+    parser.add_argument('--backend', choices=['selenium', 'http'], default='selenium',
+                        help="Render pages in a browser or fetch the study records over HTTP.")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent workers.")
+    parser.add_argument('--refresh-days', type=float, default=None,
+                        help="Re-fetch studies fetched more than this many days ago.")
+    args = parser.parse_args()
+
+    refresh_ttl = timedelta(days=args.refresh_days) if args.refresh_days is not None else None
+    main(workers=args.workers, backend=args.backend, refresh_ttl=refresh_ttl)
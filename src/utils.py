@@ -0,0 +1,54 @@
+import os
+import json
+import stat
+import tempfile
+
+def _file_mode(path):
+    """Return the permission bits for a file written to path.
+
+    Args:
+        path (str): The destination file path.
+
+    Returns:
+        int: The mode of the existing file, or 0o666 masked by the process umask.
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def write_text_atomic(path, text):
+    """Write a text file atomically.
+
+    Args:
+        path (str): The destination file path.
+        text (str): The content to write.
+
+    The content is written to a temporary file in the same directory and moved into place
+    with os.replace, so readers never see a half-written file. The file keeps the mode of the
+    file it replaces, or gets the mode a plain open() would give it.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            # mkstemp creates the file with mode 0600
+            os.fchmod(f.fileno(), _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json_atomic(path, data, indent=4):
+    """Serialize data to a JSON file atomically.
+
+    Args:
+        path (str): The destination file path.
+        data: The JSON-serializable data.
+        indent (int): Indentation passed to json.dumps.
+    """
+    write_text_atomic(path, json.dumps(data, indent=indent))
@@ -0,0 +1,157 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_openai import ChatOpenAI
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.async_engine import run_async_matching
+
+class FakeChatCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible chat completions endpoint answering from the prompt text.
+
+    The first `failures` requests are rejected with HTTP 429 to exercise the retry path, and
+    evaluation prompts containing `bad_request_marker` with a non-retryable HTTP 400.
+    """
+
+    lock = threading.Lock()
+    requests_seen = 0
+    failures = 0
+    bad_request_marker = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+
+        with self.lock:
+            FakeChatCompletionsHandler.requests_seen += 1
+            rejected = FakeChatCompletionsHandler.requests_seen <= FakeChatCompletionsHandler.failures
+        if rejected:
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+            return
+
+        marker = FakeChatCompletionsHandler.bad_request_marker
+        if marker and marker in prompt and "identify the relevant keyword" not in prompt:
+            self._send(400, {"error": {"message": "Invalid request", "type": "invalid_request_error"}})
+            return
+
+        if "identify the relevant keyword" in prompt:
+            content = "Age"
+        else:
+            # Structured answer requested with the JSON schema response format
+            self.server.response_formats.append(body.get('response_format'))
+            age_verdict = "No" if "'Age': 70" in prompt else "Yes"
+            content = json.dumps({"criteria": [
+                {"section": "Inclusion", "criterion": "Age", "verdict": age_verdict, "reason": ""},
+                {"section": "Exclusion", "criterion": "Smoking", "verdict": "Yes", "reason": ""},
+            ]})
+
+        self._send(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body['model'],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 10, "total_tokens": len(prompt) // 4 + 10},
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestAsyncEngine(unittest.TestCase):
+    """
+    Unit tests for the asyncio matching engine against a local fake chat-model server.
+    """
+
+    def setUp(self):
+        """
+        Start the fake server and create temporary patient, trial and output directories.
+        """
+        FakeChatCompletionsHandler.requests_seen = 0
+        FakeChatCompletionsHandler.failures = 2
+        FakeChatCompletionsHandler.bad_request_marker = None
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeChatCompletionsHandler)
+        self.server.response_formats = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.llm = ChatOpenAI(model='gpt-4o-mini', temperature=0, api_key='test', max_retries=0,
+                              base_url=f"http://127.0.0.1:{self.server.server_port}/v1")
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patient_dir = os.path.join(self.tmp_dir, 'patients')
+        self.trial_dir = os.path.join(self.tmp_dir, 'trials')
+        self.output_dir = os.path.join(self.tmp_dir, 'outputs')
+        for directory in (self.patient_dir, self.trial_dir, self.output_dir):
+            os.makedirs(directory)
+
+        for patient_id, age in (('p1', 30), ('p2', 70)):
+            with open(os.path.join(self.patient_dir, f"{patient_id}_data.json"), 'w') as f:
+                json.dump({"Patient ID": patient_id, "Gender": "F", "Age": age}, f)
+        for trial_id in ('NCT00000001', 'NCT00000002', 'NCT00000003'):
+            with open(os.path.join(self.trial_dir, f"{trial_id}_criteria.txt"), 'w') as f:
+                f.write(f"Study Title: Study {trial_id}\nInclusion/Exclusion Criteria:\nAge 18 to 65")
+
+    def tearDown(self):
+        """
+        Stop the fake server and remove the temporary directories.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_results_written_after_retries(self):
+        """
+        Rate-limited calls are retried and results land in the per-patient eligibility files.
+        """
+        run_async_matching(self.patient_dir, self.trial_dir, self.output_dir, llm=self.llm,
+                           max_concurrency=4, base_delay=0.01)
+
+        # 3 keyword calls + 6 evaluation calls + 2 rejected attempts
+        self.assertEqual(FakeChatCompletionsHandler.requests_seen, 11)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['p1_eligibility.json', 'p2_eligibility.json'])
+        with open(os.path.join(self.output_dir, 'p2_eligibility.json')) as f:
+            self.assertEqual(json.load(f)['eligibleTrials'], [])
+        with open(os.path.join(self.output_dir, 'p1_eligibility.json')) as f:
+            results = json.load(f)
+        self.assertEqual([trial['trialId'] for trial in results['eligibleTrials']],
+                         ['NCT00000001', 'NCT00000002', 'NCT00000003'])
+        self.assertEqual(results['eligibleTrials'][0]['eligibilityCriteriaMet'], ['Age', 'Smoking'])
+        self.assertEqual(len(self.server.response_formats), 6)
+        self.assertTrue(all(response_format["type"] == "json_schema"
+                            for response_format in self.server.response_formats))
+
+    def test_failed_pair_is_skipped(self):
+        """
+        A pair rejected with a non-retryable error is skipped; the other patients are still written.
+        """
+        with open(os.path.join(self.patient_dir, "p3_data.json"), 'w') as f:
+            json.dump({"Patient ID": "p3", "Gender": "F", "Age": 40}, f)
+        FakeChatCompletionsHandler.failures = 0
+        FakeChatCompletionsHandler.bad_request_marker = "'Age': 40"
+
+        run_async_matching(self.patient_dir, self.trial_dir, self.output_dir, llm=self.llm,
+                           max_concurrency=2, base_delay=0.01)
+
+        self.assertIn('p1_eligibility.json', os.listdir(self.output_dir))
+        with open(os.path.join(self.output_dir, 'p1_eligibility.json')) as f:
+            results = json.load(f)
+        self.assertEqual(len(results['eligibleTrials']), 3)
+        with open(os.path.join(self.output_dir, 'p3_eligibility.json')) as f:
+            self.assertEqual(json.load(f)['eligibleTrials'], [])
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import sys
+import os
+import re
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_openai import ChatOpenAI
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.batching import (build_batch_prompt, count_tokens, evaluate_batch, pack_trials, parse_batch_response,
+                             process_patients_and_trials_batched)
+from src.ai.criteria import compile_criteria
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+# Trial the fake model leaves out of multi-trial answers, and trial whose first exclusion criterion it fails
+OMITTED_TRIAL = 'NCT06576180'
+FAILED_TRIAL = 'NCT06576297'
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible chat completions endpoint answering batched prompts in JSON.
+
+    The next `invalid_answers` single-trial prompts are answered with text that is not JSON.
+    """
+
+    lock = threading.Lock()
+    prompts = []
+    invalid_answers = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        with self.lock:
+            FakeBatchHandler.prompts.append(prompt)
+            invalid = prompt.count('Trial NCT') == 1 and FakeBatchHandler.invalid_answers > 0
+            if invalid:
+                FakeBatchHandler.invalid_answers -= 1
+
+        answer = {}
+        blocks = re.split(r'^\s*Trial (NCT\d+):$', prompt, flags=re.MULTILINE)
+        for trial_id, block in zip(blocks[1::2], blocks[2::2]):
+            answer[trial_id] = {criterion_id: "Yes" for criterion_id in re.findall(r'^\s*- ([IE]\d+)', block, re.MULTILINE)}
+            if trial_id == FAILED_TRIAL:
+                answer[trial_id]["E1"] = "No"
+        if len(answer) > 1:
+            answer.pop(OMITTED_TRIAL, None)
+        content = "```json\n" + json.dumps(answer) + "\n```"
+        if invalid:
+            content = "I could not evaluate this trial."
+
+        data = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body['model'],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestBatching(unittest.TestCase):
+    """
+    Unit tests for batched multi-trial evaluation prompts.
+    """
+
+    def setUp(self):
+        """
+        Start the fake chat endpoint and compile the sample trials.
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBatchHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.llm = ChatOpenAI(model=model.MODEL_NAME, temperature=0, api_key="test-key", max_retries=0,
+                              base_url=f"http://127.0.0.1:{self.server.server_port}/v1")
+        FakeBatchHandler.prompts = []
+        FakeBatchHandler.invalid_answers = 0
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.compiled_path = os.path.join(self.temp_dir, 'criteria.bin')
+        compile_criteria(TRIAL_DIR, self.compiled_path)
+        self.output_dir = os.path.join(self.temp_dir, 'outputs')
+        os.makedirs(self.output_dir)
+
+    def tearDown(self):
+        """
+        Stop the fake endpoint, disable the cache and remove the temporary files.
+        """
+        model.llm_cache = None
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_packing_respects_budget(self):
+        """
+        Trials are packed in order into prompts that stay within the token budget.
+        """
+        _, patient_ehr = model.load_patients(PATIENT_DIR)[0]
+        trials = model.load_trials(self.compiled_path)
+
+        base_tokens = count_tokens(build_batch_prompt(patient_ehr, []))
+        budget = base_tokens + 1500
+        batches = pack_trials(patient_ehr, trials, budget)
+
+        self.assertGreater(len(batches), 1)
+        self.assertEqual([trial for batch in batches for trial in batch], trials)
+        for batch in batches:
+            if len(batch) > 1:
+                self.assertLessEqual(count_tokens(build_batch_prompt(patient_ehr, batch)), budget)
+
+    def test_parse_batch_response(self):
+        """
+        The JSON answer is split per trial, unanswered criteria are flagged and bad JSON is tolerated.
+        """
+        trial = model.load_trials(self.compiled_path)[0]
+        results = parse_batch_response(json.dumps({trial["trialId"]: {"I1": "yes"}}), [trial])
+
+        eligibility_dict = results[trial["trialId"]]
+        self.assertEqual(len(eligibility_dict), len(trial["record"]["inclusion"]) + len(trial["record"]["exclusion"]))
+        self.assertEqual(eligibility_dict[f"I1: {trial['record']['inclusion'][0]['text']}"], "Yes")
+        self.assertIn("No answer", eligibility_dict.values())
+        self.assertEqual(parse_batch_response("not json", [trial]), {})
+
+    def test_batched_run_writes_per_patient_output(self):
+        """
+        A batched run sends fewer prompt tokens per pair and splits the answers into the usual output files.
+        """
+        stats = process_patients_and_trials_batched(PATIENT_DIR, self.compiled_path, self.output_dir, llm=self.llm,
+                                                    baseline=True)
+
+        self.assertGreater(stats["pairs"], stats["requests"])
+        self.assertLess(stats["tokensPerPair"], stats["baselineTokensPerPair"])
+
+        # The trial left out of multi-trial answers is evaluated again on its own
+        self.assertTrue(any(prompt.count('Trial NCT') == 1 and OMITTED_TRIAL in prompt
+                            for prompt in FakeBatchHandler.prompts))
+
+        patients = dict(model.load_patients(PATIENT_DIR))
+        output_files = os.listdir(self.output_dir)
+        self.assertTrue(output_files)
+        for file_name in output_files:
+            self.assertIn(file_name.split('_')[0], patients)
+            with open(os.path.join(self.output_dir, file_name)) as f:
+                eligible_trials = json.load(f)["eligibleTrials"]
+            trial_ids = [trial["trialId"] for trial in eligible_trials]
+            self.assertNotIn(FAILED_TRIAL, trial_ids)
+            self.assertTrue(all(criterion[0] in 'IE' for trial in eligible_trials
+                                for criterion in trial["eligibilityCriteriaMet"]))
+
+    def test_single_trial_misses_are_retried(self):
+        """
+        An invalid single-trial answer is not cached and is requested again, up to max_attempts times.
+        """
+        _, patient_ehr = model.load_patients(PATIENT_DIR)[0]
+        first_trial, second_trial = model.load_trials(self.compiled_path)[:2]
+        model.configure_llm_cache(os.path.join(self.temp_dir, 'llm_cache.sqlite'))
+
+        FakeBatchHandler.invalid_answers = 1
+        self.assertIn(first_trial["trialId"], evaluate_batch(patient_ehr, [first_trial], self.llm))
+        self.assertEqual(len(FakeBatchHandler.prompts), 2)
+
+        # Only the valid answer was cached
+        self.assertIn(first_trial["trialId"], evaluate_batch(patient_ehr, [first_trial], self.llm))
+        self.assertEqual(len(FakeBatchHandler.prompts), 2)
+
+        FakeBatchHandler.invalid_answers = 5
+        self.assertEqual(evaluate_batch(patient_ehr, [second_trial], self.llm, max_attempts=2), {})
+        self.assertEqual(len(FakeBatchHandler.prompts), 4)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.scraping.crawl_state import CrawlState, STATUS_FAILED, STATUS_OK
+from src.scraping.http_fetch import fetch_all, make_session
+from src.utils import write_text_atomic
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'api')
+
+class CountingStudiesHandler(BaseHTTPRequestHandler):
+    """
+    Stub of the /studies/{nct_number} endpoint that counts the requests per study.
+    """
+
+    requests = []
+
+    def do_GET(self):
+        nct_number = urlparse(self.path).path.rsplit('/', 1)[-1]
+        CountingStudiesHandler.requests.append(nct_number)
+        fixture_path = os.path.join(FIXTURE_DIR, f"{nct_number}.json")
+        if not os.path.exists(fixture_path):
+            self.send_error(503)
+            return
+        with open(fixture_path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestCrawlState(unittest.TestCase):
+    """
+    Unit tests for the checkpointed crawl state.
+    """
+
+    def setUp(self):
+        """
+        Start the stub server and create a temporary output directory with an empty crawl state.
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CountingStudiesHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/api/v2"
+        self.session = make_session(pool_size=2, retries=0)
+        self.output_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.output_dir, '.crawl-state.json')
+        self.studies = [(None, 'NCT00000004', 'Healthy Volunteer Study'), (None, 'NCT00000099', 'Unavailable Study')]
+        CountingStudiesHandler.requests = []
+
+    def tearDown(self):
+        """
+        Stop the server and remove the output directory.
+        """
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def crawl(self, studies):
+        """
+        Fetch the studies with a freshly loaded crawl state, as a rerun would.
+        """
+        crawl_state = CrawlState(self.state_path)
+        fetch_all(studies, self.output_dir, workers=2, base_url=self.base_url, session=self.session,
+                  crawl_state=crawl_state)
+        return crawl_state
+
+    def test_rerun_retries_only_failures(self):
+        """
+        A rerun skips the studies already fetched and retries the ones that failed.
+        """
+        self.crawl(self.studies)
+
+        with open(self.state_path) as f:
+            entries = json.load(f)['studies']
+        self.assertEqual(entries['NCT00000004']['status'], STATUS_OK)
+        self.assertEqual(len(entries['NCT00000004']['contentHash']), 64)
+        self.assertEqual(entries['NCT00000099']['status'], STATUS_FAILED)
+        self.assertIn('503', entries['NCT00000099']['error'])
+
+        crawl_state = CrawlState(self.state_path)
+        pending = crawl_state.pending(self.studies)
+        self.assertEqual([study[1] for study in pending], ['NCT00000099'])
+
+        CountingStudiesHandler.requests = []
+        crawl_state = self.crawl(pending)
+        self.assertEqual(CountingStudiesHandler.requests, ['NCT00000099'])
+        self.assertEqual(crawl_state.failed(), ['NCT00000099'])
+
+        # Only the criteria file and the state file are in the output directory, no temporary files
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['.crawl-state.json', 'NCT00000004_criteria.txt'])
+
+    def test_refresh_ttl_and_lost_output(self):
+        """
+        Entries older than the TTL, or whose output file is gone, are fetched again.
+        """
+        crawl_state = self.crawl(self.studies[:1])
+        later = datetime.now() + timedelta(days=2)
+
+        self.assertFalse(crawl_state.needs_fetch('NCT00000004'))
+        self.assertFalse(crawl_state.needs_fetch('NCT00000004', refresh_ttl=timedelta(days=7), now=later))
+        self.assertTrue(crawl_state.needs_fetch('NCT00000004', refresh_ttl=timedelta(days=1), now=later))
+
+        os.remove(os.path.join(self.output_dir, 'NCT00000004_criteria.txt'))
+        self.assertTrue(crawl_state.needs_fetch('NCT00000004'))
+
+    def test_unchanged_content_is_not_rewritten(self):
+        """
+        A refreshed study whose content hash did not change keeps its file untouched.
+        """
+        crawl_state = CrawlState(self.state_path)
+        output_path = os.path.join(self.output_dir, 'NCT00000001_criteria.txt')
+
+        self.assertTrue(crawl_state.save_criteria('NCT00000001', output_path, 'criteria', write_text_atomic))
+        os.utime(output_path, (0, 0))
+        self.assertFalse(crawl_state.save_criteria('NCT00000001', output_path, 'criteria', write_text_atomic))
+        self.assertEqual(os.path.getmtime(output_path), 0)
+        self.assertTrue(crawl_state.save_criteria('NCT00000001', output_path, 'new criteria', write_text_atomic))
+
+    def test_saves_are_batched(self):
+        """
+        The state file is written once per batch of studies and on an explicit save.
+        """
+        crawl_state = CrawlState(self.state_path, save_every=2, save_interval=3600)
+        crawl_state.record_failure('NCT00000001', 'HTTPError: 503')
+        self.assertFalse(os.path.exists(self.state_path))
+        crawl_state.record_failure('NCT00000002', 'HTTPError: 503')
+        self.assertEqual(CrawlState(self.state_path).failed(), ['NCT00000001', 'NCT00000002'])
+
+        crawl_state.record_failure('NCT00000003', 'HTTPError: 503')
+        self.assertEqual(len(CrawlState(self.state_path).failed()), 2)
+        crawl_state.save()
+        self.assertEqual(len(CrawlState(self.state_path).failed()), 3)
+
+    def test_atomic_write_keeps_file_mode(self):
+        """
+        Atomically written files get the umask-based mode, and a replaced file keeps its mode.
+        """
+        output_path = os.path.join(self.output_dir, 'NCT00000001_criteria.txt')
+        umask = os.umask(0o022)
+        try:
+            write_text_atomic(output_path, 'criteria')
+            self.assertEqual(os.stat(output_path).st_mode & 0o777, 0o644)
+            os.chmod(output_path, 0o640)
+            write_text_atomic(output_path, 'new criteria')
+            self.assertEqual(os.stat(output_path).st_mode & 0o777, 0o640)
+        finally:
+            os.umask(umask)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.criteria import (CompiledCriteria, compile_criteria, is_compiled_criteria, parse_criteria_text,
+                             render_criteria_text)
+from src.ai import model
+
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+def read_trial(trial_id):
+    with open(os.path.join(TRIAL_DIR, f"{trial_id}_criteria.txt")) as f:
+        return f.read()
+
+class TestCriteriaCompiler(unittest.TestCase):
+    """
+    Unit tests for the structured criteria compiler and the compiled criteria file.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for compiled files.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_numbered_criteria_and_study_population(self):
+        """
+        Numbered criteria are split per section and the study population is kept apart.
+        """
+        record = parse_criteria_text(read_trial('NCT06576180'), 'NCT06576180')
+
+        self.assertTrue(record["studyTitle"].startswith("Effects of Neoadjuvant Therapy"))
+        self.assertEqual([c["id"] for c in record["inclusion"]], ['I1', 'I2', 'I3'])
+        self.assertEqual(len(record["exclusion"]), 7)
+        self.assertEqual(record["exclusion"][0]["text"], "Brain tumor, brain injury, or stroke at baseline or during follow-up")
+        self.assertTrue(record["studyPopulation"].startswith("The patients were diagnosed"))
+        self.assertEqual((record["minAge"], record["maxAge"], record["sexes"]), (18.0, 80.0, 'All'))
+
+    def test_wrapped_lines_groups_and_empty_items(self):
+        """
+        Wrapped lines are joined, grouped headings are recorded, and 'None' items are dropped.
+        """
+        record = parse_criteria_text(read_trial('NCT06576297'), 'NCT06576297')
+        self.assertTrue(record["inclusion"][0]["text"].endswith("despite a minimum of 6 weeks of treatment"))
+        self.assertEqual(record["inclusion"][1]["text"], "Age >70 years")
+
+        record = parse_criteria_text(read_trial('NCT06576323'), 'NCT06576323')
+        self.assertEqual(record["inclusion"][4]["group"], 'for Mothers in Aim 1')
+        self.assertEqual(len(record["exclusion"]), 1)
+        self.assertEqual(record["exclusion"][0]["group"], 'for Mothers in Aim 3')
+
+    def test_text_without_headings(self):
+        """
+        Criteria without any heading are read as inclusion criteria, and inline headings are split.
+        """
+        record = parse_criteria_text("Study Title: T\nInclusion/Exclusion Criteria:\nAdults\n\nOther Criteria:\n", 'NCT1')
+        self.assertEqual(record["inclusion"], [{"id": "I1", "text": "Adults", "group": None}])
+        self.assertEqual(record["exclusion"], [])
+
+        record = parse_criteria_text("Inclusion Criteria: Adults\nExclusion criteria:\n* Pregnancy: any trimester", 'NCT2')
+        self.assertIsNone(record["studyTitle"])
+        self.assertEqual(record["inclusion"][0]["text"], "Adults")
+        self.assertEqual(record["exclusion"][0]["text"], "Pregnancy: any trimester")
+
+    def test_compiled_file_round_trip(self):
+        """
+        Every record is read back from the memory-mapped file by trial ID.
+        """
+        compiled_path = os.path.join(self.temp_dir, 'criteria.bin')
+        summary = compile_criteria(TRIAL_DIR, compiled_path)
+
+        self.assertTrue(is_compiled_criteria(compiled_path))
+        self.assertFalse(is_compiled_criteria(os.path.join(TRIAL_DIR, 'NCT06576180_criteria.txt')))
+        with CompiledCriteria(compiled_path) as compiled:
+            self.assertEqual(len(compiled), summary["trials"])
+            self.assertIn('NCT06576297', compiled)
+            self.assertIsNone(compiled.get('NCT00000000'))
+            self.assertEqual(compiled.get('NCT06576297'), parse_criteria_text(read_trial('NCT06576297'), 'NCT06576297'))
+            self.assertEqual(compiled.trial_ids(), sorted(compiled.trial_ids()))
+
+    def test_model_loads_compiled_trials(self):
+        """
+        The matcher reads compiled criteria and prompts with criteria addressed by ID.
+        """
+        compiled_path = os.path.join(self.temp_dir, 'criteria.bin')
+        compile_criteria(TRIAL_DIR, compiled_path)
+
+        trials = model.load_trials(compiled_path)
+        from_text = model.load_trials(TRIAL_DIR)
+        self.assertEqual([t["trialId"] for t in trials], [t["trialId"] for t in from_text])
+        self.assertEqual([t["otherCriteria"] for t in trials], [t["otherCriteria"] for t in from_text])
+        self.assertIn("- E2: A history of stroke", trials[0]["criteria"])
+
+        subset = render_criteria_text(trials[0]["record"], criterion_ids=['I1'])
+        self.assertIn("- I1:", subset)
+        self.assertNotIn("- E1:", subset)
+
+    def test_parse_results_tolerates_colons_and_missing_sections(self):
+        """
+        Answers whose criteria contain colons, or that lack a section, are still parsed.
+        """
+        results = model.parse_eligibility_results(
+            "Inclusion Criteria:\n- Age: 18 to 80: Yes\n- Gender: Yes\n- no answer here\n"
+        )
+        self.assertEqual(results, {"Age: 18 to 80": "Yes", "Gender": "Yes"})
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import sys
+import os
+import shutil
+import zlib
+import tempfile
+import unittest
+import importlib.util
+import numpy as np
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.embeddings import (EmbeddingIndex, SentenceEncoder, normalize_rows, patient_text, shortlist_candidates,
+                                update_embedding_index)
+from src.ai.retrieval import read_trial_directory, tokenize
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+class TermEncoder:
+    """
+    Deterministic bag-of-terms encoder with the SentenceEncoder interface, counting the texts it encodes.
+    """
+
+    model_name = 'term-hashing'
+
+    def __init__(self, dimension=64):
+        self.dimension = dimension
+        self.encoded = 0
+
+    def encode(self, texts):
+        self.encoded += len(texts)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in tokenize(text):
+                vectors[row, zlib.crc32(term.encode('utf-8')) % self.dimension] += 1
+        return normalize_rows(vectors)
+
+class TestEmbeddings(unittest.TestCase):
+    """
+    Unit tests for the trial embedding index.
+    """
+
+    def setUp(self):
+        """
+        Copy the sample trials to a temporary directory that the tests can modify.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.trial_dir = os.path.join(self.temp_dir, 'trials')
+        shutil.copytree(TRIAL_DIR, self.trial_dir)
+        self.index_dir = os.path.join(self.temp_dir, 'embeddings')
+
+    def tearDown(self):
+        """
+        Remove the temporary files.
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_patient_text(self):
+        """
+        The problem list is deduplicated and the SNOMED tags are dropped.
+        """
+        patient_ehr = {"Problems": [{"Description": "Hypertension (disorder)"}, {"Description": "Hypertension (disorder)"},
+                                    {"Description": "Asthma (disorder)"}]}
+        self.assertEqual(patient_text(patient_ehr), "Asthma; Hypertension")
+        self.assertEqual(patient_text({}), "")
+
+    def test_cache_by_content_hash(self):
+        """
+        Only new and changed trials are re-encoded, and the matrix is memory-mapped from disk.
+        """
+        encoder = TermEncoder()
+        trials = read_trial_directory(self.trial_dir)
+        self.assertEqual(EmbeddingIndex(self.index_dir).update(trials, encoder)["encoded"], len(trials))
+
+        index = EmbeddingIndex(self.index_dir)
+        self.assertIsInstance(index.vectors, np.memmap)
+        self.assertEqual(index.vectors.shape, (len(trials), encoder.dimension))
+        self.assertEqual(index.update(trials, encoder)["cached"], len(trials))
+        self.assertEqual(encoder.encoded, len(trials))
+
+        modified, removed = sorted(os.listdir(self.trial_dir))[:2]
+        modified_path = os.path.join(self.trial_dir, modified)
+        with open(modified_path) as f:
+            text = f.read()
+        with open(modified_path, 'w') as f:
+            f.write(text.replace("Inclusion Criteria:\n", "Inclusion Criteria:\n- Multiple myeloma\n", 1))
+        os.remove(os.path.join(self.trial_dir, removed))
+
+        changed = read_trial_directory(self.trial_dir)
+        summary = index.update(changed, encoder)
+        self.assertEqual((summary["encoded"], summary["cached"], summary["removed"]), (1, len(trials) - 2, 1))
+        self.assertEqual(EmbeddingIndex(self.index_dir).trial_ids, [trial["trialId"] for trial in changed])
+
+    def test_index_includes_brief_summaries(self):
+        """
+        The index built from the study links CSV is reused, not re-encoded, by a run with the same CSV.
+        """
+        encoder = TermEncoder()
+        trials = read_trial_directory(self.trial_dir)
+        csv_path = os.path.join(self.temp_dir, 'study-links.csv')
+        with open(csv_path, 'w') as f:
+            f.write("NCT Number,Brief Summary\n")
+            f.writelines(f"{trial['trialId']},A study of multiple myeloma\n" for trial in trials)
+
+        with_summaries = update_embedding_index(self.index_dir, trials, encoder, csv_path)
+        self.assertEqual(encoder.encoded, len(trials))
+        self.assertEqual(update_embedding_index(self.index_dir, trials, encoder, csv_path).hashes,
+                         with_summaries.hashes)
+        self.assertEqual(encoder.encoded, len(trials))
+
+        # Without the summaries the documents differ, so every trial is encoded again
+        update_embedding_index(self.index_dir, trials, encoder)
+        self.assertEqual(encoder.encoded, 2 * len(trials))
+
+    def test_search(self):
+        """
+        Brute-force and approximate search rank the closest trial first and honour the trial filter.
+        """
+        encoder = TermEncoder()
+        trials = [{"trialId": f"NCT{i}", "criteria": f"Study Title: {title}\nInclusion Criteria:\n- {title}\n"}
+                  for i, title in enumerate(["Multiple myeloma", "Breast cancer", "Asthma in adults"])]
+        index = EmbeddingIndex(self.index_dir)
+        index.update(trials, encoder)
+
+        query = encoder.encode(["breast cancer"])[0]
+        for approximate in (False, True):
+            results = index.search(query, 2, approximate=approximate)
+            self.assertEqual(results[0][0], "NCT1")
+            self.assertEqual(len(results), 2)
+            self.assertEqual([trial_id for trial_id, _ in index.search(query, 2, trial_ids=["NCT0"],
+                                                                       approximate=approximate)], ["NCT0"])
+
+    def test_shortlist_candidates(self):
+        """
+        Each patient gets exactly top-K candidate trials.
+        """
+        encoder = TermEncoder()
+        patients = model.load_patients(PATIENT_DIR)
+        trials = model.load_trials(self.trial_dir)
+        index = EmbeddingIndex(self.index_dir)
+        index.update(trials, encoder)
+
+        candidates = shortlist_candidates(index, patients, trials, 5, encoder)
+        self.assertEqual(candidates.shape, (len(patients), len(trials)))
+        self.assertTrue(np.all(candidates.sum(axis=1) == 5))
+
+    @unittest.skipUnless(importlib.util.find_spec('torch') and importlib.util.find_spec('transformers'),
+                         "torch and transformers are not installed")
+    def test_sentence_encoder(self):
+        """
+        The sentence encoder returns unit-length vectors, one per text.
+        """
+        vectors = SentenceEncoder(batch_size=2).encode(["multiple myeloma", "plasma cell neoplasm", "asthma"])
+        self.assertEqual(vectors.shape[0], 3)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-5)
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
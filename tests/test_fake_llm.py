@@ -0,0 +1,80 @@
+import sys
+import os
+import asyncio
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.batching import build_batch_prompt, parse_batch_response
+from src.ai.fake_llm import FakeChatModel
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+class TestFakeLLM(unittest.TestCase):
+    """
+    Unit tests for the deterministic offline chat model.
+    """
+
+    def setUp(self):
+        """
+        Load a sample patient and the sample trials.
+        """
+        _, self.patient_ehr = model.load_patients(PATIENT_DIR)[0]
+        self.trials = model.load_trials(TRIAL_DIR)
+
+    def tearDown(self):
+        """
+        Restore the default chat model.
+        """
+        model.configure_llm(None)
+
+    def test_batched_answers_parse(self):
+        """
+        Every criterion of a batched prompt is answered, identically on every call.
+        """
+        llm = FakeChatModel(no_rate=0.2)
+        trials = self.trials[:3]
+        prompt = build_batch_prompt(self.patient_ehr, trials, record_stats=False)
+
+        response = llm.invoke(prompt)
+        results = parse_batch_response(response.content, trials)
+        self.assertEqual(set(results), {trial["trialId"] for trial in trials})
+        verdicts = [status for eligibility_dict in results.values() for status in eligibility_dict.values()]
+        self.assertNotIn("No answer", verdicts)
+        self.assertIn("No", verdicts)
+        self.assertEqual(llm.invoke(prompt).content, response.content)
+        self.assertGreater(response.usage_metadata["input_tokens"], 0)
+
+    def test_per_pair_evaluation_offline(self):
+        """
+        The keyword and evaluation prompts of the per-pair path run offline through configure_llm.
+        """
+        llm = FakeChatModel(no_rate=0.0)
+        model.configure_llm(llm)
+
+        results = model.process_patient_eligibility(self.trials[0]["criteria"], self.patient_ehr)
+        eligibility_dict = model.parse_eligibility_results(results)
+        self.assertTrue(eligibility_dict)
+        self.assertEqual(model.determine_overall_eligibility(eligibility_dict), "Yes")
+        self.assertEqual(len(llm.call_seconds), 2)
+
+    def test_latency_and_async(self):
+        """
+        Async calls sleep for the configured latency and are recorded with their token usage.
+        """
+        llm = FakeChatModel(latency=0.05)
+
+        async def call_concurrently():
+            return await asyncio.gather(*[llm.ainvoke("Hello") for _ in range(4)])
+
+        responses = asyncio.run(call_concurrently())
+        self.assertEqual([response.content for response in responses], ["Yes"] * 4)
+        self.assertEqual(len(llm.call_seconds), 4)
+        self.assertTrue(all(seconds >= 0.05 for seconds in llm.call_seconds))
+        self.assertEqual(llm.prompt_tokens, 4)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.feature_store import (build_feature_store_from_json, is_feature_store, list_sections,
+                                  load_demographics, load_section, load_patient_records)
+from src.ai.model import load_patients
+from src.ai.preprocess import refresh_relative_values
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+
+class TestFeatureStore(unittest.TestCase):
+    """
+    Unit tests for the columnar patient feature store.
+    """
+
+    def setUp(self):
+        """
+        Build a feature store from the sample processed patients before each test.
+        """
+        self.store_dir = tempfile.mkdtemp()
+        build_feature_store_from_json(SAMPLE_DIR, self.store_dir)
+
+        self.expected = {}
+        for file_name in sorted(os.listdir(SAMPLE_DIR)):
+            with open(os.path.join(SAMPLE_DIR, file_name)) as f:
+                patient_data = json.load(f)
+            self.expected[patient_data['Patient ID']] = patient_data
+
+    def tearDown(self):
+        """
+        Remove the temporary store.
+        """
+        shutil.rmtree(self.store_dir)
+
+    def test_round_trip(self):
+        """
+        Every patient and section row is rebuilt from the store as it was in the JSON files.
+        """
+        self.assertTrue(is_feature_store(self.store_dir))
+        self.assertIn('Vital Signs', list_sections(self.store_dir))
+
+        records = dict(load_patient_records(self.store_dir))
+        self.assertEqual(set(records), set(self.expected))
+        for patient_id, patient_data in self.expected.items():
+            for key, value in patient_data.items():
+                self.assertEqual(records[patient_id][key], value)
+
+    def test_column_and_patient_projection(self):
+        """
+        Only the requested columns and patients are loaded.
+        """
+        patient_ids = sorted(self.expected)[:2]
+        demographics = load_demographics(self.store_dir, columns=['Age'], patient_ids=patient_ids)
+        self.assertEqual(demographics.column_names, ['Patient ID', 'Age'])
+        self.assertEqual(sorted(demographics['Patient ID'].to_pylist()), patient_ids)
+
+        vitals = load_section(self.store_dir, 'Vital Signs', columns=['Description', 'Value'], patient_ids=patient_ids[:1])
+        self.assertEqual(vitals.column_names, ['Patient ID', 'Description', 'Value'])
+        self.assertEqual(vitals.num_rows, len(self.expected[patient_ids[0]]['Vital Signs']))
+
+    def test_model_loads_patients_from_store(self):
+        """
+        The model stage reads only the prompt fields when pointed at a store, with the ages and
+        last-usage values recomputed as for the JSON files.
+        """
+        patients = dict(load_patients(self.store_dir))
+        patient_id = sorted(self.expected)[0]
+        self.assertNotIn('Given Name', patients[patient_id])
+        self.assertNotIn('Diagnostic Results', patients[patient_id])
+        expected = refresh_relative_values(self.expected[patient_id])
+        self.assertEqual(patients[patient_id]['Medications'], expected['Medications'])
+        self.assertEqual(patients[patient_id]['Age'], expected['Age'])
+        self.assertEqual(dict(load_patients(SAMPLE_DIR))[patient_id]['Medications'], expected['Medications'])
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
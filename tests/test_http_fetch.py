@@ -0,0 +1,99 @@
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.scraping.http_fetch import fetch_all, make_session
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'api')
+SCRAPED_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+class StubStudiesHandler(BaseHTTPRequestHandler):
+    """
+    Stub of the /studies/{nct_number} endpoint serving recorded study records.
+    """
+
+    def do_GET(self):
+        nct_number = urlparse(self.path).path.rsplit('/', 1)[-1]
+        fixture_path = os.path.join(FIXTURE_DIR, f"{nct_number}.json")
+        if not os.path.exists(fixture_path):
+            self.send_error(404)
+            return
+        with open(fixture_path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestHttpFetch(unittest.TestCase):
+    """
+    Unit tests for the browserless fetch backend against a local stub of the study records API.
+    """
+
+    def setUp(self):
+        """
+        Start the stub server and create a temporary output directory.
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubStudiesHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/api/v2"
+        self.session = make_session(pool_size=2, retries=0)
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Stop the server and remove the output directory.
+        """
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def test_fetch_writes_scraper_format(self):
+        """
+        A fetched record is written exactly as the browser scraper wrote the same study.
+        """
+        with open(os.path.join(SCRAPED_DIR, 'NCT06576180_criteria.txt')) as f:
+            expected = f.read()
+        title = expected.split('\n', 1)[0][len('Study Title: '):]
+
+        progress = fetch_all([(None, 'NCT06576180', title)], self.output_dir, workers=1,
+                             base_url=self.base_url, session=self.session)
+
+        self.assertEqual(progress.succeeded, 1)
+        with open(os.path.join(self.output_dir, 'NCT06576180_criteria.txt')) as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_age_sex_block_and_missing_study(self):
+        """
+        Open-ended ages, sex and healthy volunteers are rendered, and unknown studies are reported as failed.
+        """
+        studies = [(None, 'NCT00000004', 'Healthy Volunteer Study'), (None, 'NCT00000099', 'Missing Study')]
+        progress = fetch_all(studies, self.output_dir, workers=2, base_url=self.base_url, session=self.session)
+
+        self.assertEqual(progress.succeeded, 1)
+        self.assertEqual(progress.failed, ['NCT00000099'])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'NCT00000099_criteria.txt')))
+
+        with open(os.path.join(self.output_dir, 'NCT00000004_criteria.txt')) as f:
+            text = f.read()
+        self.assertTrue(text.startswith("Study Title: Healthy Volunteer Study\nInclusion/Exclusion Criteria:\n"))
+        self.assertTrue(text.endswith(
+            "\n\nOther Criteria:\nAges Eligible for Study\n18 Years and older (Adult,  Older Adult )\n"
+            "Sexes Eligible for Study\nFemale\nAccepts Healthy Volunteers\nYes"
+        ))
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.llm_cache import LLMCache
+from src.ai.fake_llm import FakeChatModel
+
+class TestLLMCache(unittest.TestCase):
+    """
+    Unit tests for the persistent LLM response cache.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the cache database before each test.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'llm_cache.sqlite')
+
+    def tearDown(self):
+        """
+        Reset the module-level cache and remove the temporary directory after each test.
+        """
+        if model.llm_cache is not None:
+            model.llm_cache.close()
+        model.llm_cache = None
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_miss_and_key_components(self):
+        """
+        Responses are keyed by model, temperature and prompt, and counted as hits or misses.
+        """
+        cache = LLMCache(self.cache_path)
+        self.assertIsNone(cache.get('gpt-4o-mini', 0, 'prompt'))
+        cache.set('gpt-4o-mini', 0, 'prompt', 'answer')
+
+        self.assertEqual(cache.get('gpt-4o-mini', 0, 'prompt'), 'answer')
+        self.assertIsNone(cache.get('gpt-4o-mini', 0.5, 'prompt'))
+        self.assertIsNone(cache.get('gpt-4o', 0, 'prompt'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+        cache.close()
+
+        # Entries survive reopening the database
+        reopened = LLMCache(self.cache_path)
+        self.assertEqual(reopened.get('gpt-4o-mini', 0, 'prompt'), 'answer')
+        reopened.close()
+
+    def test_lru_eviction_by_size(self):
+        """
+        The least recently used entry is evicted once the size limit is exceeded.
+        """
+        cache = LLMCache(self.cache_path, max_bytes=20)
+        cache.set('m', 0, 'a', 'x' * 8)
+        cache.set('m', 0, 'b', 'y' * 8)
+        cache.get('m', 0, 'a')  # 'a' becomes most recently used
+        cache.set('m', 0, 'c', 'z' * 8)
+
+        self.assertIsNone(cache.get('m', 0, 'b'))
+        self.assertEqual(cache.get('m', 0, 'a'), 'x' * 8)
+        self.assertEqual(cache.get('m', 0, 'c'), 'z' * 8)
+        self.assertLessEqual(cache.stats()['sizeBytes'], 20)
+        cache.close()
+
+    @patch("src.ai.model.get_llm")
+    def test_call_llm_reuses_cached_response(self, mock_get_llm):
+        """
+        A repeated prompt is answered from the cache without calling the model, unless bypassed.
+        """
+        mock_get_llm.return_value.invoke.return_value = MagicMock(content="Age")
+        model.configure_llm_cache(self.cache_path)
+
+        self.assertEqual(model.call_llm("prompt").content, "Age")
+        self.assertEqual(model.call_llm("prompt").content, "Age")
+        self.assertEqual(mock_get_llm.return_value.invoke.call_count, 1)
+
+        model.llm_cache.close()
+        model.configure_llm_cache(self.cache_path, bypass=True)
+        model.call_llm("prompt")
+        self.assertEqual(mock_get_llm.return_value.invoke.call_count, 2)
+
+    def test_cache_identity_of_effective_model(self):
+        """
+        Cache entries are keyed by the model actually called, its bound options and the response format.
+        """
+        default_identity = model.cache_identity()
+        self.assertEqual(default_identity, (model.MODEL_NAME, model.TEMPERATURE))
+
+        fake = FakeChatModel(no_rate=0.1)
+        self.assertNotEqual(model.cache_identity(fake), default_identity)
+        self.assertNotEqual(model.cache_identity(fake), model.cache_identity(FakeChatModel(no_rate=0.2)))
+        self.assertNotEqual(model.cache_identity(fake, {"type": "json_object"}), model.cache_identity(fake))
+        self.assertEqual(model.cache_identity(fake.bind(response_format={"type": "json_object"})),
+                         model.cache_identity(fake, {"type": "json_object"}))
+
+        # A model set with configure_llm does not answer from the default model's entries
+        model.configure_llm_cache(self.cache_path)
+        model.llm_cache.set(model.MODEL_NAME, model.TEMPERATURE, "Is the patient eligible?", "cached")
+        model.configure_llm(fake)
+        try:
+            self.assertEqual(model.call_llm("Is the patient eligible?").content, "Yes")
+        finally:
+            model.configure_llm(None)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
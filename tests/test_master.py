@@ -0,0 +1,135 @@
+import sys
+import os
+import re
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src import master
+from src.ai import model
+
+SAMPLE_XML_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'patients_ehr')
+SAMPLE_TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+class EligibleHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible chat completions endpoint answering "Yes" to every criterion of a batched prompt.
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        blocks = re.split(r'^\s*Trial (NCT\d+):$', prompt, flags=re.MULTILINE)
+        answer = {trial_id: {criterion_id: "Yes" for criterion_id in re.findall(r'^\s*- ([IE]\d+)', block, re.MULTILINE)}
+                  for trial_id, block in zip(blocks[1::2], blocks[2::2])}
+
+        data = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body['model'],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(answer)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestMaster(unittest.TestCase):
+    """
+    Unit tests for the in-process pipeline runner.
+    """
+
+    def setUp(self):
+        """
+        Start the fake chat endpoint and lay out a data directory with two patients and three trials.
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), EligibleHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.data_dir = tempfile.mkdtemp()
+        paths = master.default_paths(self.data_dir)
+        os.makedirs(paths["patients_xml"])
+        os.makedirs(paths["trials"])
+        for file_name in sorted(f for f in os.listdir(SAMPLE_XML_DIR) if f.endswith('.xml'))[:2]:
+            shutil.copy(os.path.join(SAMPLE_XML_DIR, file_name), paths["patients_xml"])
+        for file_name in sorted(os.listdir(SAMPLE_TRIAL_DIR))[:3]:
+            shutil.copy(os.path.join(SAMPLE_TRIAL_DIR, file_name), paths["trials"])
+
+    def tearDown(self):
+        """
+        Stop the fake endpoint, reset the model configuration and remove the data directory.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if model.llm_cache is not None:
+            model.llm_cache.close()
+        model.llm_cache = None
+        model.configure_patient_summary(None)
+        shutil.rmtree(self.data_dir)
+
+    def test_pipeline_runs_stages_in_process(self):
+        """
+        Preprocessing and batched matching run in one process on the configured directories, with timed stages.
+        """
+        environment = {"OPENAI_API_KEY": "test-key", "OPENAI_BASE_URL": f"http://127.0.0.1:{self.server.server_port}/v1"}
+        with patch.dict(os.environ, environment):
+            timings = master.main(False, True, True, False, data_dir=self.data_dir, mode='batched')
+
+        self.assertEqual(list(timings), ['preprocessor', 'model'])
+        self.assertTrue(all(seconds > 0 for seconds in timings.values()))
+
+        paths = master.default_paths(self.data_dir)
+        self.assertEqual(len(os.listdir(paths["patients"])), 3)  # two patients and the manifest
+        self.assertTrue(os.path.isdir(paths["patient_store"]))
+        self.assertTrue(os.path.exists(paths["llm_cache"]))
+        output_files = os.listdir(paths["outputs"])
+        self.assertTrue(output_files)
+        for file_name in output_files:
+            with open(os.path.join(paths["outputs"], file_name)) as f:
+                self.assertTrue(json.load(f)["eligibleTrials"])
+
+    def test_explicit_patients_dir_is_preferred_to_the_store(self):
+        """
+        A patients directory passed on the command line is read even if a newer store holds other patients.
+        """
+        paths = master.default_paths(self.data_dir)
+        master.run_preprocess(paths, workers=1)
+        self.assertEqual(master.select_patient_dir(paths), paths["patient_store"])
+
+        # A smaller cohort in another directory, older than the store built from the full one
+        cohort_dir = os.path.join(self.data_dir, 'cohort')
+        os.makedirs(cohort_dir)
+        patient_file = sorted(f for f in os.listdir(paths["patients"]) if f.endswith('_data.json'))[0]
+        shutil.copy(os.path.join(paths["patients"], patient_file), cohort_dir)
+        store_time = os.path.getmtime(os.path.join(paths["patient_store"], 'demographics.arrow'))
+        os.utime(os.path.join(cohort_dir, patient_file), (store_time - 60, store_time - 60))
+        os.utime(cohort_dir, (store_time - 60, store_time - 60))
+
+        cohort_paths = dict(paths, patients=cohort_dir)
+        self.assertEqual(master.select_patient_dir(cohort_paths, patients_given=True), cohort_dir)
+
+    def test_failed_unit_tests_exit_non_zero(self):
+        """
+        The run exits with status 1 when the unit tests fail.
+        """
+        with patch.object(master, 'run_tests', return_value=False):
+            with self.assertRaises(SystemExit) as context:
+                master.main(False, False, False, True, data_dir=self.data_dir)
+        self.assertEqual(context.exception.code, 1)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
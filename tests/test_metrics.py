@@ -0,0 +1,137 @@
+import sys
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.metrics import MetricsRegistry, JsonFormatter, metrics
+from src.ai import model
+from src.ai.fake_llm import FakeChatModel
+from src.ai.preprocess import process_xml_files
+
+SAMPLE_XML_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'patients_ehr')
+
+class TestMetrics(unittest.TestCase):
+    """
+    Unit tests for the metrics registry and its instrumentation of the pipeline.
+    """
+
+    def setUp(self):
+        """
+        Start every test from an empty shared registry.
+        """
+        metrics.reset()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Restore the default chat model and remove the temporary directory.
+        """
+        model.configure_llm(None)
+        metrics.reset()
+        shutil.rmtree(self.temp_dir)
+
+    def test_counters_and_timers(self):
+        """
+        Counters add up per label set and timers fill their cumulative buckets.
+        """
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        registry.inc('rows_total', 3, section='Problems')
+        registry.inc('rows_total', 2, section='Problems')
+        registry.inc('rows_total', section='Vital Signs')
+        registry.observe('parse_seconds', 0.05)
+        registry.observe('parse_seconds', 0.5)
+        with registry.timer('parse_seconds'):
+            pass
+
+        self.assertEqual(registry.counter_value('rows_total', section='Problems'), 5)
+        self.assertEqual(registry.counter_value('rows_total', section='Vital Signs'), 1)
+        self.assertEqual(registry.counter_value('rows_total', section='Allergies'), 0)
+        timer = registry.snapshot()["timers"][0]
+        self.assertEqual(timer["count"], 3)
+        self.assertEqual(timer["buckets"], [2, 3])
+        self.assertAlmostEqual(timer["max"], 0.5)
+
+    def test_prometheus_format(self):
+        """
+        Counters and histograms are rendered in the Prometheus text format and written to a file.
+        """
+        registry = MetricsRegistry(buckets=(1.0,))
+        registry.inc('llm_cache_lookups_total', 4, result='hit')
+        registry.observe('llm_call_seconds', 0.25)
+        text = registry.to_prometheus()
+
+        self.assertIn('# TYPE llm_cache_lookups_total counter', text)
+        self.assertIn('llm_cache_lookups_total{result="hit"} 4', text)
+        self.assertIn('# TYPE llm_call_seconds histogram', text)
+        self.assertIn('llm_call_seconds_bucket{le="1.0"} 1', text)
+        self.assertIn('llm_call_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('llm_call_seconds_count 1', text)
+
+        path = os.path.join(self.temp_dir, 'run.prom')
+        registry.write_prometheus(path)
+        with open(path, 'r') as f:
+            self.assertEqual(f.read(), text)
+
+    def test_merge_snapshot(self):
+        """
+        A snapshot merged into another registry adds its counts, sums and buckets.
+        """
+        worker = MetricsRegistry()
+        worker.inc('files_total', 2, status='processed')
+        worker.observe('parse_seconds', 0.2)
+        parent = MetricsRegistry()
+        parent.inc('files_total', 1, status='processed')
+        parent.observe('parse_seconds', 0.4)
+        parent.merge(worker.snapshot())
+
+        self.assertEqual(parent.counter_value('files_total', status='processed'), 3)
+        timer = parent.snapshot()["timers"][0]
+        self.assertEqual(timer["count"], 2)
+        self.assertAlmostEqual(timer["sum"], 0.6)
+
+    def test_llm_calls_and_tokens(self):
+        """
+        Chat model calls record their count, latency and reported token usage.
+        """
+        llm = FakeChatModel(completion_tokens=7)
+        model.configure_llm(llm)
+        model.call_llm("Is the patient eligible?")
+        model.call_llm("Is the patient still eligible?")
+
+        self.assertEqual(metrics.counter_value('llm_calls_total'), 2)
+        self.assertEqual(metrics.counter_value('llm_prompt_tokens_total'), llm.prompt_tokens)
+        self.assertEqual(metrics.counter_value('llm_completion_tokens_total'), 14)
+        self.assertEqual(metrics.snapshot()["timers"][0]["count"], 2)
+
+    def test_preprocess_workers_merge_metrics(self):
+        """
+        Parse timings and section rows recorded in worker processes reach the parent registry.
+        """
+        summary = process_xml_files(SAMPLE_XML_DIR, self.temp_dir, workers=2)
+        files = summary["processed"] + len(summary["failed"])
+
+        parse_timer = [timer for timer in metrics.snapshot()["timers"]
+                       if timer["name"] == 'preprocess_xml_parse_seconds']
+        self.assertEqual(parse_timer[0]["count"], files)
+        self.assertEqual(metrics.counter_value('preprocess_files_total', status='processed'), summary["processed"])
+        self.assertGreater(metrics.counter_value('preprocess_section_rows_total', section='Problems'), 0)
+
+    def test_json_log_records(self):
+        """
+        The JSON formatter writes the message, the level and the extra fields of a record.
+        """
+        record = logging.makeLogRecord({"name": "src.ai.model", "levelname": "INFO", "msg": "Processed %s",
+                                        "args": ("patient-1",), "patientId": "patient-1"})
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Processed patient-1")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["patientId"], "patient-1")
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+
+class TestTrialKeywordPrecompute(unittest.TestCase):
+    """
+    Unit tests for the per-trial keyword precompute stage in the model module.
+    """
+
+    def setUp(self):
+        """
+        Create temporary patient, trial and output directories before each test.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patient_dir = os.path.join(self.tmp_dir, 'patients')
+        self.trial_dir = os.path.join(self.tmp_dir, 'trials')
+        self.output_dir = os.path.join(self.tmp_dir, 'outputs')
+        for directory in (self.patient_dir, self.trial_dir, self.output_dir):
+            os.makedirs(directory)
+
+        for patient_id in ('p1', 'p2', 'p3'):
+            with open(os.path.join(self.patient_dir, f"{patient_id}_data.json"), 'w') as f:
+                json.dump({"Patient ID": patient_id, "Gender": "F", "Age": 40}, f)
+
+        for trial_id in ('NCT00000001', 'NCT00000002'):
+            with open(os.path.join(self.trial_dir, f"{trial_id}_criteria.txt"), 'w') as f:
+                f.write(f"Study Title: Study {trial_id}\nInclusion/Exclusion Criteria:\nAge > 18")
+
+    def tearDown(self):
+        """
+        Remove the temporary directories after each test.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    @patch("src.ai.model.evaluate_criteria_by_keywords")
+    @patch("src.ai.model.identify_criteria_keywords")
+    def test_keywords_identified_once_per_trial(self, mock_identify, mock_evaluate):
+        """
+        Keyword extraction should run once per trial, not once per patient-trial pair.
+        """
+        mock_identify.return_value = MagicMock(content="Age")
+        mock_evaluate.return_value = MagicMock(content="Inclusion Criteria:\n- Age: Yes\nExclusion Criteria:\n")
+
+        model.process_patients_and_trials(self.patient_dir, self.trial_dir, self.output_dir)
+
+        self.assertEqual(mock_identify.call_count, 2)
+        self.assertEqual(mock_evaluate.call_count, 6)
+        mock_evaluate.assert_any_call("Age", unittest.mock.ANY)
+
+    @patch("src.ai.model.identify_criteria_keywords")
+    def test_persisted_keywords_reused_until_criteria_change(self, mock_identify):
+        """
+        Persisted keywords are reused while the criteria hash matches and refreshed when it changes.
+        """
+        mock_identify.return_value = MagicMock(content="Age")
+        keywords_path = os.path.join(self.tmp_dir, 'trial_keywords.json')
+
+        trials = model.load_trials(self.trial_dir)
+        model.precompute_trial_keywords(trials, keywords_path)
+        self.assertEqual(mock_identify.call_count, 2)
+
+        # A second run over unchanged trials makes no extraction calls
+        model.precompute_trial_keywords(model.load_trials(self.trial_dir), keywords_path)
+        self.assertEqual(mock_identify.call_count, 2)
+
+        # Changing one trial's text only recomputes that trial
+        with open(os.path.join(self.trial_dir, 'NCT00000002_criteria.txt'), 'a') as f:
+            f.write("\nBMI < 30")
+        trial_keywords = model.precompute_trial_keywords(model.load_trials(self.trial_dir), keywords_path)
+        self.assertEqual(mock_identify.call_count, 3)
+        self.assertEqual(set(trial_keywords), {'NCT00000001', 'NCT00000002'})
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
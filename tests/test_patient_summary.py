@@ -0,0 +1,112 @@
+import sys
+import os
+import json
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.patient_summary import summarize_courses, summarize_events, summarize_patient, summarize_vital_signs
+from src.ai.tokens import count_tokens
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+
+class TestPatientSummary(unittest.TestCase):
+    """
+    Unit tests for the token-budgeted patient summary.
+    """
+
+    def setUp(self):
+        """
+        Load the sample patient with the most Surgeries entries.
+        """
+        patients = []
+        for file_name in sorted(os.listdir(PATIENT_DIR)):
+            with open(os.path.join(PATIENT_DIR, file_name)) as f:
+                patients.append(json.load(f))
+        self.patient_ehr = max(patients, key=lambda patient: len(patient.get("Surgeries", [])))
+
+    def tearDown(self):
+        """
+        Send the raw patient data in prompts again.
+        """
+        model.configure_patient_summary(None)
+
+    def test_latest_vital_sign_per_type(self):
+        """
+        Only the latest reading of each vital sign is kept.
+        """
+        rows = [
+            {"Start": "2020-01-01T00:00:00Z", "Stop": None, "Description": "Body Weight", "Value": "60 kg"},
+            {"Start": "2023-01-01T00:00:00Z", "Stop": None, "Description": "Body Weight", "Value": "58 kg"},
+            {"Start": "2021-01-01T00:00:00Z", "Stop": None, "Description": "Heart rate", "Value": "70 /min"},
+        ]
+        lines = [line for _, line in summarize_vital_signs(rows)]
+        self.assertEqual(lines, ["Body Weight: 58 kg (2023-01-01)", "Heart rate: 70 /min (2021-01-01)"])
+
+    def test_medication_courses_and_events(self):
+        """
+        Repeated medication courses collapse into one line with duration and recency; events are counted.
+        """
+        rows = [
+            {"Start": "2015-01-01T00:00:00Z", "Stop": "2015-01-10T00:00:00Z", "Description": "Drug A",
+             "Duration of Usage": "10 days", "Last Usage": "3000 days ago"},
+            {"Start": "2016-01-01T00:00:00Z", "Stop": "2016-01-05T00:00:00Z", "Description": "Drug A",
+             "Duration of Usage": "5 days", "Last Usage": "2900 days ago"},
+            {"Start": "2022-01-01T00:00:00Z", "Stop": None, "Description": "Drug B",
+             "Duration of Usage": None, "Last Usage": "Currently used"},
+        ]
+        lines = [line for _, line in summarize_courses(rows, 'Duration of Usage', 'Last Usage')]
+        self.assertEqual(lines, [
+            "Drug B: since 2022-01-01",
+            "Drug A: 2 courses 2015-01-01 to 2016-01-05 (15 days total, ended 2900 days ago)",
+        ])
+
+        events = [{"Start": f"20{year}-01-01T00:00:00Z", "Description": "Screening"} for year in (18, 20, 19)]
+        self.assertEqual([line for _, line in summarize_events(events)], ["Screening: x3, last 2020-01-01"])
+
+    def test_summary_fits_budget(self):
+        """
+        The summary stays within its token budget by dropping the oldest low-priority entries first.
+        """
+        full_summary = summarize_patient(self.patient_ehr, max_tokens=None)
+        summary = summarize_patient(self.patient_ehr, max_tokens=300)
+
+        self.assertGreater(count_tokens(full_summary), 300)
+        self.assertLessEqual(count_tokens(summary), 300)
+        self.assertIn("older entries omitted", summary)
+        self.assertTrue(summary.startswith(f"Gender: {self.patient_ehr['Gender']}, Age: {self.patient_ehr['Age']}"))
+        self.assertIn("Body Weight:", summary)
+
+    def test_prompts_use_summary_and_record_sizes(self):
+        """
+        With the summary enabled, prompts carry the compact text and the size saving is recorded.
+        """
+        stats = model.configure_patient_summary(500)
+        prompt = model.build_evaluation_prompt("Age", self.patient_ehr)
+
+        self.assertNotIn("'Start':", prompt)
+        self.assertIn("Vital Signs:", prompt)
+        summary = stats.summary()
+        self.assertEqual(summary["prompts"], 1)
+        self.assertLessEqual(summary["summaryTokensPerPrompt"], 500)
+        self.assertGreater(summary["reduction"], 0.5)
+
+        model.configure_patient_summary(None)
+        self.assertIn("'Start':", model.build_evaluation_prompt("Age", self.patient_ehr))
+
+    def test_context_is_computed_once_per_patient(self):
+        """
+        The summary is reused for every trial of a patient, and rebuilt for a new budget.
+        """
+        stats = model.configure_patient_summary(500)
+        first = model.format_patient_context(self.patient_ehr)
+        self.assertIs(model.format_patient_context(self.patient_ehr), first)
+        self.assertEqual(stats.summary()["prompts"], 2)
+
+        model.configure_patient_summary(300)
+        self.assertLessEqual(count_tokens(model.format_patient_context(self.patient_ehr)), 300)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
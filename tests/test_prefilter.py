@@ -0,0 +1,92 @@
+import sys
+import os
+import unittest
+from datetime import datetime
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.prefilter import parse_other_criteria, prefilter_pairs
+from src.ai.dates import set_reference_time, reset_reference_time
+
+class TestPrefilter(unittest.TestCase):
+    """
+    Unit tests for the age and sex prefilter built from the "Other Criteria" block.
+    """
+
+    def test_parse_other_criteria(self):
+        """
+        Age ranges, sexes and healthy volunteer flags are parsed from the scraped block.
+        """
+        text = ("Study Title: Test\nInclusion/Exclusion Criteria:\nAge above 18\n\n"
+                "Other Criteria:\nAges Eligible for Study\n18 Years to 70 Years (Adult,  Older Adult )\n"
+                "Sexes Eligible for Study\nMale\nAccepts Healthy Volunteers\nYes")
+        self.assertEqual(parse_other_criteria(text),
+                         {"minAge": 18.0, "maxAge": 70.0, "sexes": "Male", "healthyVolunteers": True})
+
+        open_ended = "Other Criteria:\nAges Eligible for Study\n60 Years and older (Adult,  Older Adult )\nSexes Eligible for Study\nAll"
+        self.assertEqual(parse_other_criteria(open_ended),
+                         {"minAge": 60.0, "maxAge": None, "sexes": "All", "healthyVolunteers": None})
+
+        months = parse_other_criteria("Other Criteria:\nAges Eligible for Study\n6 Months to 12 Years (Child )")
+        self.assertEqual((months["minAge"], months["maxAge"]), (0.5, 12.0))
+
+        labels_only = parse_other_criteria("Other Criteria:\nAges Eligible for Study\n(Child,  Adult,  Older Adult )")
+        self.assertEqual((labels_only["minAge"], labels_only["maxAge"]), (None, None))
+
+    def test_parse_sample_trials(self):
+        """
+        Every sample trial file yields a parsed block.
+        """
+        trial_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+        with open(os.path.join(trial_dir, 'NCT06577051_criteria.txt')) as f:
+            other_criteria = parse_other_criteria(f.read())
+        self.assertEqual(other_criteria,
+                         {"minAge": 4.0, "maxAge": 15.0, "sexes": "All", "healthyVolunteers": False})
+
+    def test_prefilter_pairs(self):
+        """
+        Pairs outside the trial's age range or sex are eliminated; missing data never eliminates.
+        """
+        patients = [
+            {"Age": 12, "Gender": "F"},
+            {"Age": 70, "Gender": "M"},
+            {"Age": None, "Gender": None},
+        ]
+        trials = [
+            {"otherCriteria": {"minAge": 18.0, "maxAge": 70.0, "sexes": "All"}},
+            {"otherCriteria": {"minAge": None, "maxAge": None, "sexes": "Female"}},
+            {"otherCriteria": {"minAge": 4.0, "maxAge": 15.0, "sexes": "All"}},
+        ]
+        mask = prefilter_pairs(patients, trials)
+        self.assertEqual(mask.tolist(), [
+            [False, True, True],
+            [True, False, False],
+            [True, True, True],
+        ])
+
+    def test_infant_ages_in_months(self):
+        """
+        Infants are compared with minimums in months or weeks in fractional years, from their birth time.
+        """
+        set_reference_time(datetime(2024, 6, 1))
+        self.addCleanup(reset_reference_time)
+        patients = [
+            {"Birth Time": "20231101000000", "Age": 0, "Gender": "F"},
+            {"Birth Time": "20240401000000", "Age": 0, "Gender": "M"},
+            {"Age": 0, "Gender": "M"},
+        ]
+        trials = [
+            {"otherCriteria": {"minAge": 0.5, "maxAge": 2.0, "sexes": "All"}},
+            {"otherCriteria": parse_other_criteria(
+                "Other Criteria:\nAges Eligible for Study\n6 Weeks to 12 Months (Child )")},
+        ]
+        mask = prefilter_pairs(patients, trials)
+        self.assertEqual(mask.tolist(), [
+            [True, True],
+            [False, True],
+            [True, True],
+        ])
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
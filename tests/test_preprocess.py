@@ -1,8 +1,14 @@
 import sys
 import os
+import json
+import shutil
+import tempfile
 import unittest
 import xml.etree.ElementTree as ET
-from src.ai.preprocess import extract_section_data
+from datetime import datetime
+from src.ai.preprocess import (extract_section_data, parse_xml_file, parse_xml_streaming, process_xml_files,
+                               refresh_relative_values)
+from src.ai.dates import set_reference_time, reset_reference_time, parse_iso_timestamp
 
 # Add the parent directory to the system path for module imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -44,6 +50,14 @@ class TestExtractSectionData(unittest.TestCase):
         self.root = ET.fromstring(self.xml_data)
         # Initialize a dictionary to hold patient data
         self.patient_data = {}
+        # Fix "today" so the "days ago" values are deterministic
+        set_reference_time(datetime(2024, 10, 7, 12, 0, 0))
+
+    def tearDown(self):
+        """
+        Reset the reference time after each test.
+        """
+        reset_reference_time()
 
     def test_extract_medications(self):
         """
@@ -78,6 +92,195 @@ class TestExtractSectionData(unittest.TestCase):
         self.assertEqual(len(self.patient_data['Medications']), 2)  # Validate number of entries
         self.assertEqual(self.patient_data['Medications'], expected_data)  # Check if extracted data matches expected
 
+    def test_extract_vital_signs_with_missing_cells(self):
+        """
+        Vital sign rows read the value from the fifth cell and missing cells come back as None.
+        """
+        section = ET.fromstring('''<hl7:section xmlns:hl7="urn:hl7-org:v3">
+            <hl7:title>Vital Signs</hl7:title>
+            <hl7:tbody>
+                <hl7:tr>
+                    <hl7:td>2023-01-01T00:00:00Z</hl7:td>
+                    <hl7:td/>
+                    <hl7:td>Body Weight</hl7:td>
+                    <hl7:td>29463-7</hl7:td>
+                    <hl7:td>48.2 kg</hl7:td>
+                </hl7:tr>
+                <hl7:tr>
+                    <hl7:td>2023-02-01T00:00:00Z</hl7:td>
+                    <hl7:td/>
+                    <hl7:td>Body Height</hl7:td>
+                </hl7:tr>
+            </hl7:tbody>
+        </hl7:section>''')
+
+        extract_section_data("Vital Signs", section, self.patient_data)
+
+        self.assertEqual(self.patient_data['Vital Signs'], [
+            {'Start': '2023-01-01T00:00:00Z', 'Stop': None, 'Description': 'Body Weight', 'Value': '48.2 kg'},
+            {'Start': '2023-02-01T00:00:00Z', 'Stop': None, 'Description': 'Body Height', 'Value': None},
+        ])
+
+    def test_extract_medications_with_day_counts(self):
+        """
+        Numeric day counts are emitted alongside the string values when requested.
+        """
+        extract_section_data("Medications", self.root.find('.//hl7:section', {'hl7': 'urn:hl7-org:v3'}),
+                             self.patient_data, day_counts=True)
+
+        first = self.patient_data['Medications'][0]
+        self.assertEqual(first['Duration of Usage'], '10 days')
+        self.assertEqual(first['Duration of Usage Days'], 10)
+        self.assertEqual(first['Last Usage'], '636 days ago')
+        self.assertEqual(first['Last Usage Days'], 636)
+
+class TestDates(unittest.TestCase):
+    """
+    Unit tests for the timestamp parsing helpers.
+    """
+
+    def test_fast_path_matches_strptime(self):
+        """
+        The sliced fast path agrees with strptime and malformed values still raise ValueError.
+        """
+        for value in ('2023-01-01T00:00:00Z', '1999-12-31T23:59:59Z', '2024-02-29T12:30:45Z'):
+            self.assertEqual(parse_iso_timestamp(value), datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+        for value in ('2023-02-30T00:00:00Z', '2023-01-01', 'not a date'):
+            with self.assertRaises(ValueError):
+                parse_iso_timestamp(value)
+
+class TestStreamingParser(unittest.TestCase):
+    """
+    Unit tests comparing the iterparse-based parser with the full-tree parser.
+    """
+
+    def test_streaming_matches_dom_parser(self):
+        """
+        The streaming parser produces the same patient data as the full-tree parser.
+        """
+        xml_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'patients_ehr')
+        xml_file = os.path.join(xml_dir, sorted(f for f in os.listdir(xml_dir) if f.endswith('.xml'))[0])
+
+        expected = parse_xml_file(xml_file)
+        streamed = parse_xml_streaming(xml_file)
+
+        self.assertEqual(streamed, expected)
+        self.assertEqual(list(streamed), list(expected))  # Same key order in the JSON output
+        self.assertIn('Patient ID', streamed)
+
+class TestProcessXmlFiles(unittest.TestCase):
+    """
+    Unit tests for batch preprocessing of an EHR directory.
+    """
+
+    def setUp(self):
+        """
+        Copy two sample CCDA files and one malformed file into a temporary input directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xml_dir = os.path.join(self.tmp_dir, 'xml')
+        self.output_dir = os.path.join(self.tmp_dir, 'json')
+        os.makedirs(self.xml_dir)
+        os.makedirs(self.output_dir)
+
+        sample_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'patients_ehr')
+        self.sample_files = sorted(f for f in os.listdir(sample_dir) if f.endswith('.xml'))[:2]
+        for file_name in self.sample_files:
+            shutil.copy(os.path.join(sample_dir, file_name), self.xml_dir)
+        with open(os.path.join(self.xml_dir, 'broken.xml'), 'w') as f:
+            f.write('<ClinicalDocument><recordTarget>')
+
+    def tearDown(self):
+        """
+        Remove the temporary directories and reset the reference time.
+        """
+        shutil.rmtree(self.tmp_dir)
+        reset_reference_time()
+
+    def test_parallel_run_collects_failures(self):
+        """
+        A malformed file is reported as a failure while the other files are still written.
+        """
+        summary = process_xml_files(self.xml_dir, self.output_dir, workers=2, chunksize=1)
+
+        self.assertEqual(summary['processed'], 2)
+        self.assertEqual(len(summary['failed']), 1)
+        self.assertTrue(summary['failed'][0]['file'].endswith('broken.xml'))
+        self.assertIn('ParseError', summary['failed'][0]['error'])
+
+        output_files = sorted(os.listdir(self.output_dir))
+        self.assertEqual(len(output_files), 2)
+        for file_name in self.sample_files:
+            patient_id = file_name[:-len('.xml')].split('_')[-1]
+            with open(os.path.join(self.output_dir, f"{patient_id}_data.json")) as f:
+                self.assertEqual(json.load(f)['Patient ID'], patient_id)
+
+    def test_incremental_run_only_touches_changes(self):
+        """
+        A rerun skips unchanged files, reprocesses changed ones and removes outputs of deleted sources.
+        """
+        os.remove(os.path.join(self.xml_dir, 'broken.xml'))
+        first = process_xml_files(self.xml_dir, self.output_dir, incremental=True)
+        self.assertEqual(first['processed'], 2)
+
+        second = process_xml_files(self.xml_dir, self.output_dir, incremental=True)
+        self.assertEqual(second['processed'], 0)
+        self.assertEqual(len(second['skipped']), 2)
+
+        # Touching a file without changing it is still a skip
+        kept_file, removed_file = (os.path.join(self.xml_dir, f) for f in self.sample_files)
+        os.utime(kept_file, (0, 0))
+        os.remove(removed_file)
+        third = process_xml_files(self.xml_dir, self.output_dir, incremental=True)
+        self.assertEqual(third['processed'], 0)
+        self.assertEqual(third['skipped'], [os.path.abspath(kept_file)])
+        self.assertEqual(third['removed'], [os.path.abspath(removed_file)])
+        self.assertEqual(len([f for f in os.listdir(self.output_dir) if f.endswith('_data.json')]), 1)
+
+        with open(kept_file, 'a') as f:
+            f.write('\n')
+        fourth = process_xml_files(self.xml_dir, self.output_dir, incremental=True)
+        self.assertEqual(fourth['processed'], 1)
+
+    def test_incremental_run_reprocesses_on_new_options(self):
+        """
+        Files processed with other day_counts are processed again.
+        """
+        os.remove(os.path.join(self.xml_dir, 'broken.xml'))
+        reference_time = datetime(2024, 6, 1, 9, 0)
+        first = process_xml_files(self.xml_dir, self.output_dir, incremental=True, reference_time=reference_time)
+        self.assertEqual(first['processed'], 2)
+
+        same_day = process_xml_files(self.xml_dir, self.output_dir, incremental=True,
+                                     reference_time=datetime(2024, 6, 1, 17, 0))
+        self.assertEqual(same_day['processed'], 0)
+
+        with_day_counts = process_xml_files(self.xml_dir, self.output_dir, incremental=True, day_counts=True,
+                                            reference_time=reference_time)
+        self.assertEqual(with_day_counts['processed'], 2)
+
+    def test_incremental_run_on_another_day_skips_and_refreshes(self):
+        """
+        A rerun on a later day skips every file; the ages and last-usage values are
+        recomputed when the outputs are read.
+        """
+        os.remove(os.path.join(self.xml_dir, 'broken.xml'))
+        first = process_xml_files(self.xml_dir, self.output_dir, incremental=True, day_counts=True,
+                                  reference_time=datetime(2024, 6, 1))
+        self.assertEqual(first['processed'], 2)
+
+        later = process_xml_files(self.xml_dir, self.output_dir, incremental=True, day_counts=True,
+                                  reference_time=datetime(2031, 3, 15))
+        self.assertEqual(later['processed'], 0)
+        self.assertEqual(len(later['skipped']), 2)
+
+        for file_name in self.sample_files:
+            expected = parse_xml_file(os.path.join(self.xml_dir, file_name), day_counts=True)
+            with open(os.path.join(self.output_dir, f"{expected['Patient ID']}_data.json")) as f:
+                cached = json.load(f)
+            self.assertNotEqual(cached['Age'], expected['Age'])
+            self.assertEqual(refresh_relative_values(cached), expected)
+
 # Entry point for running the unit tests
 if __name__ == '__main__':
     unittest.main()
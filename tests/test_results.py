@@ -0,0 +1,123 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai.model import save_eligibility_json
+from src.ai.results import (RESULTS_JSONL, ResultSink, consolidate_jsonl, dedupe_output_dir, eligibility_path,
+                            read_eligibility_file)
+
+def trial_info(trial_id, criteria=("Age",)):
+    """An eligible trial entry as built by model.create_eligibility_json."""
+    return {"trialId": trial_id, "trialName": f"Study {trial_id}", "eligibilityCriteriaMet": list(criteria)}
+
+class TestResults(unittest.TestCase):
+    """
+    Unit tests for the buffered and streaming eligibility result writers.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary output directory.
+        """
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Remove the temporary output directory.
+        """
+        shutil.rmtree(self.output_dir)
+
+    def test_sink_writes_each_patient_once(self):
+        """
+        Results are buffered until the patient is flushed, which replaces the file with them without duplicates.
+        """
+        path = eligibility_path(self.output_dir, 'p1')
+        with open(path, 'w') as f:
+            json.dump({"eligibleTrials": [trial_info('NCT1'), trial_info('NCT1'), trial_info('NCT2')]}, f)
+
+        with ResultSink(self.output_dir) as sink:
+            sink.add('p1', trial_info('NCT1', ["Age", "Sex"]))
+            sink.add('p1', trial_info('NCT3'))
+            sink.add('p2', trial_info('NCT3'))
+            self.assertEqual(len(read_eligibility_file(path)), 3)
+
+            sink.flush('p1')
+            trials = read_eligibility_file(path)
+            self.assertEqual([trial["trialId"] for trial in trials], ['NCT1', 'NCT3'])
+            self.assertEqual(trials[0]["eligibilityCriteriaMet"], ["Age", "Sex"])
+            self.assertFalse(os.path.exists(eligibility_path(self.output_dir, 'p2')))
+
+            # A patient without eligible trials left in this run gets an empty list
+            sink.flush('p1')
+            self.assertEqual(read_eligibility_file(path), [])
+
+        # Closing the sink flushes the remaining patients
+        self.assertEqual(len(read_eligibility_file(eligibility_path(self.output_dir, 'p2'))), 1)
+        self.assertEqual(sink.written, 3)
+
+    def test_jsonl_consolidation(self):
+        """
+        JSON Lines results are consolidated into deduplicated per-patient files, skipping a truncated last line.
+        """
+        with ResultSink(self.output_dir, jsonl=True) as sink:
+            sink.add('p1', trial_info('NCT1'))
+            sink.add('p2', trial_info('NCT2'))
+            sink.add('p1', trial_info('NCT1'))
+        self.assertEqual(os.listdir(self.output_dir), [RESULTS_JSONL])
+
+        # A new run starts a new file
+        with ResultSink(self.output_dir, jsonl=True) as sink:
+            sink.add('p1', trial_info('NCT1'))
+            sink.add('p2', trial_info('NCT2'))
+
+        jsonl_path = os.path.join(self.output_dir, RESULTS_JSONL)
+        with open(jsonl_path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        with open(jsonl_path, 'a') as f:
+            f.write('{"patientId": "p3", "trialId"')
+
+        summary = consolidate_jsonl(jsonl_path, self.output_dir)
+        self.assertEqual(summary, {"patients": 2, "trials": 2})
+        self.assertEqual(read_eligibility_file(eligibility_path(self.output_dir, 'p1')), [trial_info('NCT1')])
+
+    def test_jsonl_consolidation_replaces_unless_merging(self):
+        """
+        Consolidation replaces existing files and writes empty ones for listed patients; merging keeps old entries.
+        """
+        save_eligibility_json(eligibility_path(self.output_dir, 'p1'), trial_info('NCT-OLD'))
+        with ResultSink(self.output_dir, jsonl=True) as sink:
+            sink.add('p1', trial_info('NCT1'))
+        jsonl_path = os.path.join(self.output_dir, RESULTS_JSONL)
+
+        summary = consolidate_jsonl(jsonl_path, self.output_dir, patient_ids=['p1', 'p2'])
+        self.assertEqual(summary, {"patients": 2, "trials": 1})
+        self.assertEqual(read_eligibility_file(eligibility_path(self.output_dir, 'p1')), [trial_info('NCT1')])
+        self.assertEqual(read_eligibility_file(eligibility_path(self.output_dir, 'p2')), [])
+
+        save_eligibility_json(eligibility_path(self.output_dir, 'p1'), trial_info('NCT-OLD'))
+        consolidate_jsonl(jsonl_path, self.output_dir, merge=True)
+        trial_ids = [trial["trialId"] for trial in read_eligibility_file(eligibility_path(self.output_dir, 'p1'))]
+        self.assertEqual(sorted(trial_ids), ['NCT-OLD', 'NCT1'])
+
+    def test_dedupe_existing_files(self):
+        """
+        Duplicates left by appending reruns are removed, and single saves no longer add them.
+        """
+        path = eligibility_path(self.output_dir, 'p1')
+        save_eligibility_json(path, trial_info('NCT1'))
+        save_eligibility_json(path, trial_info('NCT1'))
+        self.assertEqual(len(read_eligibility_file(path)), 1)
+
+        with open(path, 'w') as f:
+            json.dump({"eligibleTrials": [trial_info('NCT1'), trial_info('NCT2'), trial_info('NCT1')]}, f)
+        self.assertEqual(dedupe_output_dir(self.output_dir), 1)
+        self.assertEqual([trial["trialId"] for trial in read_eligibility_file(path)], ['NCT1', 'NCT2'])
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
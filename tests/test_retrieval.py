@@ -0,0 +1,108 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.prefilter import prefilter_pairs
+from src.ai.retrieval import (TrialIndex, patient_terms, read_trial_directory, restrict_to_candidates,
+                              retrieve_candidates, tokenize)
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+class TestRetrieval(unittest.TestCase):
+    """
+    Unit tests for the candidate-trial retrieval index.
+    """
+
+    def setUp(self):
+        """
+        Copy the sample trials to a temporary directory that the tests can modify.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.trial_dir = os.path.join(self.temp_dir, 'trials')
+        shutil.copytree(TRIAL_DIR, self.trial_dir)
+        self.index_path = os.path.join(self.temp_dir, 'index.json')
+
+    def tearDown(self):
+        """
+        Remove the temporary files.
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_tokenize(self):
+        """
+        Stop words, short words and numbers are dropped and plurals are folded.
+        """
+        self.assertEqual(tokenize("Patients with 2 or more Tumors of the Kidneys, aged 18 years"),
+                         ['tumor', 'kidney'])
+        self.assertEqual(tokenize("Hypertension (disorder)"), ['hypertension'])
+
+    def test_incremental_update(self):
+        """
+        Only new, modified and deleted trials change the index, and the index survives a reload.
+        """
+        index = TrialIndex(self.index_path)
+        trials = read_trial_directory(self.trial_dir)
+        self.assertEqual(index.update(trials)["added"], len(trials))
+        index.save()
+
+        reloaded = TrialIndex(self.index_path)
+        self.assertEqual(reloaded.trials, index.trials)
+        self.assertEqual(reloaded.update(trials)["unchanged"], len(trials))
+
+        modified, removed = sorted(os.listdir(self.trial_dir))[:2]
+        modified_path = os.path.join(self.trial_dir, modified)
+        with open(modified_path) as f:
+            text = f.read()
+        with open(modified_path, 'w') as f:
+            f.write(text.replace("Inclusion Criteria:\n", "Inclusion Criteria:\n- Xenotransplantitis\n", 1))
+        os.remove(os.path.join(self.trial_dir, removed))
+
+        changes = reloaded.update(read_trial_directory(self.trial_dir))
+        self.assertEqual((changes["updated"], changes["removed"], changes["added"]), (1, 1, 0))
+        self.assertNotIn(removed.split('_')[0], reloaded.trials)
+        self.assertEqual(list(reloaded.postings["xenotransplantitis"]), [modified.split('_')[0]])
+        self.assertFalse(any(removed.split('_')[0] in trials for trials in reloaded.postings.values()))
+
+    def test_search_ranking(self):
+        """
+        Trials mentioning the query terms rank first, best score first.
+        """
+        index = TrialIndex()
+        index.add('NCT1', "Adults with type 2 diabetes on metformin", 'a')
+        index.add('NCT2', "Diabetes prevention in adults", 'b')
+        index.add('NCT3', "Asthma in children", 'c')
+
+        results = index.search(tokenize("diabetes metformin"))
+        self.assertEqual([trial_id for trial_id, _ in results], ['NCT1', 'NCT2'])
+        self.assertGreater(results[0][1], results[1][1])
+        self.assertEqual(index.search(tokenize("diabetes"), trial_ids=['NCT2'])[0][0], 'NCT2')
+
+    def test_restrict_to_candidates(self):
+        """
+        Each patient keeps at most top-K prefiltered trials, and the index is persisted.
+        """
+        patients = model.load_patients(PATIENT_DIR)
+        trials = model.load_trials(self.trial_dir)
+        self.assertTrue(all(patient_terms(patient_ehr) for _, patient_ehr in patients))
+
+        eligible_pairs = prefilter_pairs([patient_ehr for _, patient_ehr in patients], trials)
+        restricted = restrict_to_candidates(eligible_pairs, patients, trials, 5, self.index_path)
+
+        self.assertEqual(restricted.shape, eligible_pairs.shape)
+        self.assertFalse(np.any(restricted & ~eligible_pairs))
+        self.assertTrue(np.all(restricted.sum(axis=1) <= 5))
+        self.assertTrue(os.path.exists(self.index_path))
+
+        candidates = retrieve_candidates(TrialIndex(self.index_path), patients, trials, 5)
+        np.testing.assert_array_equal(restricted, eligible_pairs & candidates)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
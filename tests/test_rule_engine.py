@@ -0,0 +1,155 @@
+import sys
+import os
+import json
+import unittest
+from datetime import datetime
+from langchain_core.messages import AIMessage
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.dates import set_reference_time, reset_reference_time
+from src.ai.rule_engine import compile_rule, resolve_criteria
+
+TRIAL_TEXT = """Study Title: Sample weight loss trial
+Inclusion/Exclusion Criteria:
+Inclusion Criteria:
+- BMI >= 30 kg/m2
+- HbA1c between 7 and 10
+- Able to attend all study visits
+Exclusion Criteria:
+- Stroke or seizure within 6 months
+"""
+
+def make_patient(bmi, problems=()):
+    """Build a patient EHR with one BMI reading and the given (description, start, stop) problems."""
+    return {
+        "Vital Signs": [
+            {"Start": "2023-01-01T00:00:00Z", "Stop": None, "Description": "Body mass index (BMI) [Ratio]",
+             "Value": "24.0 kg/m2"},
+            {"Start": "2024-01-01T00:00:00Z", "Stop": None, "Description": "Body mass index (BMI) [Ratio]",
+             "Value": f"{bmi} kg/m2"},
+        ],
+        "Problems": [{"Start": start, "Stop": stop, "Description": description}
+                     for description, start, stop in problems],
+        "Medications": [],
+    }
+
+class RecordingChatModel:
+    """
+    Chat model stand-in that records the evaluation prompts and accepts every criterion sent.
+    """
+
+    def __init__(self):
+        self.prompts = []
+
+    def bind(self, response_format=None):
+        return self
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return AIMessage(content=json.dumps({"criteria": [
+            {"section": "Inclusion", "criterion": "Able to attend all study visits", "verdict": "Yes", "reason": ""},
+        ]}))
+
+class TestRuleEngine(unittest.TestCase):
+    """
+    Unit tests for the local rule engine of numeric and temporal criteria.
+    """
+
+    def setUp(self):
+        """
+        Fix the reference time and enable the rule engine.
+        """
+        set_reference_time(datetime(2024, 6, 1))
+        self.trial = {"trialId": "NCT00000001", "studyTitle": "Sample weight loss trial", "criteria": TRIAL_TEXT}
+        self.stats = model.configure_rule_engine()
+
+    def tearDown(self):
+        """
+        Restore the default chat model, the rule engine and the reference time.
+        """
+        model.configure_llm(None)
+        model.configure_rule_engine(False)
+        reset_reference_time()
+
+    def test_recognized_criteria(self):
+        """
+        Comparisons and events within a period are recognized; anything more is left to the model.
+        """
+        rule = compile_rule('I1', 'inclusion',
+                            "Body mass index (BMI) of 21 - 30 kg/m^2 and body weight no less than 50 kg.")
+        self.assertEqual([(check.low, check.high) for check in rule.checks], [(21.0, 30.0), (50.0, float('inf'))])
+        rule = compile_rule('E1', 'exclusion', "History of malignancy within 5 years prior to screening.")
+        self.assertAlmostEqual(rule.window_days, 5 * 365.25)
+        for text in ["BMI not greater than 30", "HbA1c < 48 mmol/mol", "BMI > 40 or BMI > 35 with comorbidities",
+                     "Surgery within 3 months", "Able to attend all study visits"]:
+            self.assertIsNone(compile_rule('I1', 'inclusion', text), text)
+
+    def test_latest_measurement_decides(self):
+        """
+        The latest reading is compared, and a missing measurement leaves the criterion undecided.
+        """
+        resolution = resolve_criteria(self.trial, make_patient(32.5))
+        self.assertEqual(resolution.verdicts, {"I1: BMI >= 30 kg/m2": "Yes"})
+        self.assertEqual([criterion["id"] for _, criterion in resolution.undecided], ["I2", "I3", "E1"])
+
+        resolution = resolve_criteria(self.trial, make_patient(27.0))
+        self.assertTrue(resolution.ineligible)
+
+    def test_recent_events_exclude(self):
+        """
+        A matching problem that started within the period decides an exclusion; older or unmatched ones do not.
+        """
+        recent = make_patient(32.5, [("Cerebrovascular accident (disorder)", "2024-03-01T00:00:00Z", None)])
+        self.assertEqual(resolve_criteria(self.trial, recent).verdicts["E1: Stroke or seizure within 6 months"], "No")
+
+        old = make_patient(32.5, [("Seizure disorder", "2019-01-01T00:00:00Z", "2020-01-01T00:00:00Z")])
+        self.assertNotIn("E1: Stroke or seizure within 6 months", resolve_criteria(self.trial, old).verdicts)
+
+        # An ongoing condition diagnosed long ago is left to the model
+        chronic = make_patient(32.5, [("Epilepsy (disorder)", "2010-01-01T00:00:00Z", None)])
+        self.assertNotIn("E1: Stroke or seizure within 6 months", resolve_criteria(self.trial, chronic).verdicts)
+
+    def test_events_match_whole_words(self):
+        """
+        Events are matched on whole words: hyperthyroidism is not hypertension.
+        """
+        trial = {"trialId": "NCT00000002", "studyTitle": "Sample trial",
+                 "criteria": TRIAL_TEXT.replace("Stroke or seizure within 6 months", "Hypertension within 6 months")}
+        label = "E1: Hypertension within 6 months"
+
+        other = make_patient(32.5, [("Hyperthyroidism (disorder)", "2024-03-01T00:00:00Z", None)])
+        self.assertNotIn(label, resolve_criteria(trial, other).verdicts)
+
+        matching = make_patient(32.5, [("Essential hypertension (disorder)", "2024-03-01T00:00:00Z", None)])
+        self.assertEqual(resolve_criteria(trial, matching).verdicts[label], "No")
+
+        rule = compile_rule('E1', 'exclusion', "Seizures within 6 months")
+        self.assertIn(frozenset({'seizure'}), rule.events)
+        self.assertIn(frozenset({'epilepsy'}), rule.events)
+
+    def test_only_undecided_criteria_reach_the_model(self):
+        """
+        The model is asked about the undecided criteria only, and not at all once a rule rules the patient out.
+        """
+        llm = RecordingChatModel()
+        model.configure_llm(llm)
+
+        trial_info = model.evaluate_pair("p1", make_patient(32.5), self.trial, "Inclusion Criteria:\n- BMI")
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertIn("Able to attend all study visits", llm.prompts[0])
+        self.assertNotIn("BMI >= 30", llm.prompts[0])
+        self.assertIn("I1: BMI >= 30 kg/m2", trial_info["eligibilityCriteriaMet"])
+
+        self.assertIsNone(model.evaluate_pair("p2", make_patient(27.0), self.trial, "Inclusion Criteria:\n- BMI"))
+        self.assertEqual(len(llm.prompts), 1)
+
+        summary = self.stats.summary()
+        self.assertEqual((summary["criteria"], summary["resolved"]), (8, 2))
+        self.assertEqual((summary["pairs"], summary["pairsWithoutLLM"]), (2, 1))
+        self.assertAlmostEqual(summary["resolvedFraction"], 0.25)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
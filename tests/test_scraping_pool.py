@@ -0,0 +1,174 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import functools
+import urllib.request
+import xml.etree.ElementTree as ET
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.scraping.pool import make_driver, scrape_with_pool
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'trial_pages')
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler that does not log every request.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+class StaticPageElement:
+    """
+    Stand-in for a WebElement backed by an ElementTree element.
+    """
+
+    def __init__(self, element):
+        self.text = ''.join(element.itertext()).strip()
+
+class StaticPageDriver:
+    """
+    Minimal WebDriver stand-in that fetches pages over HTTP and resolves XPaths with ElementTree.
+
+    When crash_on_first_get is set, the first navigation raises WebDriverException like a dead browser.
+    With die_after_gets, the browser dies once that many pages were loaded, while the next page is read.
+    """
+
+    instances = 0
+
+    def __init__(self, crash_on_first_get=False, die_after_gets=None):
+        StaticPageDriver.instances += 1
+        self.crash_on_first_get = crash_on_first_get
+        self.gets_left = die_after_gets
+        self.dead = False
+        self.page = None
+
+    @property
+    def current_url(self):
+        if self.dead:
+            raise WebDriverException("invalid session id")
+        return 'about:blank'
+
+    def get(self, url):
+        if self.crash_on_first_get:
+            self.crash_on_first_get = False
+            raise WebDriverException("chrome not reachable")
+        if self.gets_left is not None:
+            self.dead = self.gets_left == 0
+            self.gets_left -= 1
+        with urllib.request.urlopen(url.split('#')[0]) as response:
+            self.page = ET.fromstring(response.read())
+
+    def find_element(self, by, value):
+        if self.dead:
+            raise WebDriverException("invalid session id")
+        element = self.page.find('.' + value)
+        if element is None:
+            raise NoSuchElementException(value)
+        return StaticPageElement(element)
+
+    def quit(self):
+        pass
+
+class TestScrapingPool(unittest.TestCase):
+    """
+    Unit tests for the pooled scraper against a local static HTTP server serving saved trial pages.
+    """
+
+    def setUp(self):
+        """
+        Serve the saved trial pages and create a temporary output directory.
+        """
+        handler = functools.partial(QuietHandler, directory=FIXTURE_DIR)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.studies = [
+            (f"{base_url}/NCT0000000{n}.html", f"NCT0000000{n}", f"Study {n}") for n in (1, 2, 3)
+        ]
+        self.output_dir = tempfile.mkdtemp()
+        StaticPageDriver.instances = 0
+
+    def tearDown(self):
+        """
+        Stop the server and remove the output directory.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def test_pool_scrapes_all_pages_with_politeness(self):
+        """
+        Every study is written by a pool of reused drivers while requests to the host stay spaced out.
+        """
+        start = time.monotonic()
+        progress = scrape_with_pool(self.studies, self.output_dir, workers=2, driver_factory=StaticPageDriver,
+                                    min_interval=0.1, report_interval=1.0)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(progress.succeeded, 3)
+        self.assertEqual(progress.failed, [])
+        self.assertEqual(StaticPageDriver.instances, 2)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+        with open(os.path.join(self.output_dir, 'NCT00000002_criteria.txt')) as f:
+            text = f.read()
+        self.assertTrue(text.startswith("Study Title: Study 2\nInclusion/Exclusion Criteria:\nInclusion Criteria:"))
+        self.assertIn("Adults with condition 2", text)
+        self.assertIn("\n\nOther Criteria:\nAges Eligible for Study\n18 Years and older", text)
+
+    def test_worker_restarts_crashed_driver(self):
+        """
+        A driver that crashes is replaced and the study is retried.
+        """
+        factory_calls = []
+
+        def factory():
+            factory_calls.append(1)
+            return StaticPageDriver(crash_on_first_get=len(factory_calls) == 1)
+
+        progress = scrape_with_pool(self.studies[:1], self.output_dir, workers=1, driver_factory=factory,
+                                    min_interval=0)
+
+        self.assertEqual(progress.restarts, 1)
+        self.assertEqual(progress.succeeded, 1)
+        self.assertEqual(len(factory_calls), 2)
+
+    def test_worker_restarts_driver_that_dies_during_a_page(self):
+        """
+        A driver that dies while a page is read, which scrape_criteria reports as a failed study,
+        is replaced and the study is retried.
+        """
+        factory_calls = []
+
+        def factory():
+            factory_calls.append(1)
+            return StaticPageDriver(die_after_gets=1 if len(factory_calls) == 1 else None)
+
+        progress = scrape_with_pool(self.studies, self.output_dir, workers=1, driver_factory=factory,
+                                    min_interval=0)
+
+        self.assertEqual(progress.restarts, 1)
+        self.assertEqual(progress.succeeded, 3)
+        self.assertEqual(progress.failed, [])
+        self.assertEqual(len(factory_calls), 2)
+
+    @unittest.skipUnless(shutil.which('chromedriver'), "chromedriver is not installed")
+    def test_headless_chrome_pool(self):
+        """
+        The same crawl works with real headless Chrome drivers.
+        """
+        progress = scrape_with_pool(self.studies, self.output_dir, workers=2, driver_factory=make_driver,
+                                    min_interval=0)
+        self.assertEqual(progress.succeeded, 3)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from langchain_core.messages import AIMessage
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.metrics import metrics
+from src.ai import model
+from src.ai.verdicts import ResponseFormatError, parse_verdicts, verdicts_to_eligibility_dict
+
+VALID_RESPONSE = json.dumps({"criteria": [
+    {"section": "Inclusion", "criterion": "Age", "verdict": "Yes", "reason": ""},
+    {"section": "Exclusion", "criterion": "Smoking", "verdict": "No", "reason": "Current smoker"},
+]})
+
+class ScriptedChatModel:
+    """
+    Chat model stand-in that answers with a fixed sequence of responses and records the bound formats.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.response_formats = []
+        self.calls = 0
+
+    def bind(self, response_format=None):
+        self.response_formats.append(response_format)
+        return self
+
+    def invoke(self, prompt):
+        self.calls += 1
+        return AIMessage(content=self.responses.pop(0))
+
+class TestVerdicts(unittest.TestCase):
+    """
+    Unit tests for the structured eligibility verdicts and the retry of invalid answers.
+    """
+
+    def setUp(self):
+        """
+        Define a trial with precomputed keywords and start from an empty registry.
+        """
+        metrics.reset()
+        self.temp_dir = tempfile.mkdtemp()
+        self.trial = {"trialId": "NCT00000001", "studyTitle": "Sample trial", "criteria": "Age 18 or older"}
+        self.criteria_keywords = "Inclusion Criteria:\n- Age\nExclusion Criteria:\n- Smoking"
+        self.patient_ehr = {"patient_id": "p1", "Vital Signs": []}
+
+    def tearDown(self):
+        """
+        Restore the default chat model, the cache and the shared registry.
+        """
+        model.configure_llm(None)
+        model.llm_cache = None
+        metrics.reset()
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_valid_response(self):
+        """
+        A schema-conforming answer is validated into typed verdicts with their reasons.
+        """
+        verdicts = parse_verdicts(VALID_RESPONSE)
+        self.assertEqual([verdict.section for verdict in verdicts.criteria], ["Inclusion", "Exclusion"])
+        self.assertEqual(verdicts.criteria[1].reason, "Current smoker")
+        self.assertEqual(verdicts_to_eligibility_dict(verdicts), {"Age": "Yes", "Smoking": "No"})
+
+    def test_code_fence_is_stripped(self):
+        """
+        A JSON answer wrapped in a Markdown code fence is accepted.
+        """
+        verdicts = parse_verdicts(f"```json\n{VALID_RESPONSE}\n```")
+        self.assertEqual(len(verdicts.criteria), 2)
+
+    def test_invalid_responses_raise(self):
+        """
+        Free text, unknown verdicts and empty criteria lists are rejected.
+        """
+        bad_verdict = VALID_RESPONSE.replace('"No"', '"Maybe"')
+        for content in ["Inclusion Criteria:\n- Age: Yes", bad_verdict, '{"criteria": []}']:
+            with self.assertRaises(ResponseFormatError):
+                parse_verdicts(content)
+
+    def test_legacy_text_answers_still_parse(self):
+        """
+        Answers in the earlier line format are still read by parse_eligibility_results.
+        """
+        eligibility_dict = model.parse_eligibility_results("Inclusion Criteria:\n- Age: Yes\nExclusion Criteria:\n")
+        self.assertEqual(eligibility_dict, {"Age": "Yes"})
+
+    def test_invalid_answer_is_retried_for_the_pair(self):
+        """
+        An invalid answer is requested again with the JSON schema format and is never cached.
+        """
+        llm = ScriptedChatModel(["not json", VALID_RESPONSE.replace('"No"', '"Yes"')])
+        model.configure_llm(llm)
+        model.configure_llm_cache(os.path.join(self.temp_dir, 'llm_cache.sqlite'))
+
+        trial_info = model.evaluate_pair("p1", self.patient_ehr, self.trial, self.criteria_keywords)
+        self.assertEqual(trial_info["trialId"], "NCT00000001")
+        self.assertEqual(llm.calls, 2)
+        self.assertTrue(all(fmt["type"] == "json_schema" for fmt in llm.response_formats))
+        self.assertEqual(metrics.counter_value('llm_invalid_responses_total'), 1)
+
+        # Only the valid answer was cached: the pair is now answered without calling the model
+        model.evaluate_pair("p1", self.patient_ehr, self.trial, self.criteria_keywords)
+        self.assertEqual(llm.calls, 2)
+
+    def test_pair_is_given_up_without_raising(self):
+        """
+        A pair without a valid answer after max_attempts is skipped and counted as failed.
+        """
+        llm = ScriptedChatModel(["no", "still no"])
+        model.configure_llm(llm)
+
+        trial_info = model.evaluate_pair("p1", self.patient_ehr, self.trial, self.criteria_keywords, max_attempts=2)
+        self.assertIsNone(trial_info)
+        self.assertEqual(metrics.counter_value('pairs_failed_total'), 1)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest.mock import patch
+
+# Add the project root directory to PYTHONPATH for module imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.ai import model
+from src.ai.fake_llm import FakeChatModel
+from src.ai.work_queue import LeaseLost, WorkQueue, evaluate_unit, plan_work, run_worker, merge_results
+
+PATIENT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'patients_small')
+TRIAL_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'scraped_small')
+
+def run_fake_worker(queue_path, shard_dir, keywords_path, owner):
+    """Worker process entry point answering with the offline chat model."""
+    model.configure_llm(FakeChatModel(no_rate=0.1))
+    run_worker(queue_path, PATIENT_DIR, TRIAL_DIR, shard_dir, keywords_path=keywords_path, owner=owner, wait=False)
+
+def read_outputs(output_dir):
+    """Map every eligibility file of a directory to its sorted trial IDs."""
+    outputs = {}
+    for file_name in os.listdir(output_dir):
+        with open(os.path.join(output_dir, file_name), 'r') as f:
+            outputs[file_name] = sorted(trial["trialId"] for trial in json.load(f)["eligibleTrials"])
+    return outputs
+
+class TestWorkQueue(unittest.TestCase):
+    """
+    Unit tests for the work queue and its distributed workers.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the queue and the results.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.queue_path = os.path.join(self.temp_dir, 'queue.sqlite')
+
+    def tearDown(self):
+        """
+        Restore the default chat model and remove the temporary directory.
+        """
+        model.configure_llm(None)
+        shutil.rmtree(self.temp_dir)
+
+    def test_lease_heartbeat_and_expiry(self):
+        """
+        A leased unit is hidden from other workers until its lease expires without a heartbeat.
+        """
+        queue = WorkQueue(self.queue_path)
+        queue.enqueue([[["p1", "NCT1"]], [["p2", "NCT1"]]])
+
+        first = queue.lease('worker-a', lease_seconds=10, now=100)
+        second = queue.lease('worker-b', lease_seconds=10, now=100)
+        self.assertEqual((first["id"], second["id"]), (1, 2))
+        self.assertIsNone(queue.lease('worker-c', lease_seconds=10, now=105))
+
+        # worker-a keeps its unit alive, worker-b goes silent
+        self.assertTrue(queue.heartbeat(first["id"], 'worker-a', lease_seconds=10, now=108))
+        taken_over = queue.lease('worker-c', lease_seconds=10, now=115)
+        self.assertEqual(taken_over["id"], second["id"])
+        self.assertEqual(taken_over["attempts"], 2)
+
+        # The stale owner can no longer complete the unit
+        self.assertFalse(queue.complete(second["id"], 'worker-b', 'late.jsonl'))
+        self.assertTrue(queue.complete(second["id"], 'worker-c', 'unit-2.jsonl'))
+        self.assertTrue(queue.complete(first["id"], 'worker-a', 'unit-1.jsonl'))
+        progress = queue.progress()
+        self.assertEqual((progress["done"], progress["total"], progress["pairsDone"]), (2, 2, 2))
+        self.assertEqual(queue.result_paths(), ['unit-1.jsonl', 'unit-2.jsonl'])
+
+    def test_failed_units_are_retried(self):
+        """
+        A failing unit goes back to the queue until it used up its attempts, then waits for retry_failed.
+        """
+        queue = WorkQueue(self.queue_path, max_attempts=2)
+        queue.enqueue([[["p1", "NCT1"]]])
+
+        unit = queue.lease('worker-a')
+        queue.fail(unit["id"], 'worker-a', 'ValueError: bad answer')
+        self.assertEqual(queue.progress()["pending"], 1)
+        unit = queue.lease('worker-a')
+        queue.fail(unit["id"], 'worker-a', 'ValueError: bad answer')
+        self.assertEqual(queue.progress()["failed"], 1)
+        self.assertIsNone(queue.lease('worker-a'))
+        self.assertEqual(queue.failures(), [(1, 2, 'ValueError: bad answer')])
+
+        self.assertEqual(queue.retry_failed(), 1)
+        self.assertEqual(queue.lease('worker-a')["attempts"], 1)
+
+    def test_plan_covers_every_prefiltered_pair(self):
+        """
+        The units split the pairs left by the prefilter, and a planned queue cannot be planned twice.
+        """
+        queue = WorkQueue(self.queue_path)
+        summary = plan_work(queue, PATIENT_DIR, TRIAL_DIR, patient_batch=3, trial_batch=8)
+
+        units = []
+        while True:
+            unit = queue.lease('planner-check')
+            if unit is None:
+                break
+            units.append(unit)
+        pairs = [tuple(pair) for unit in units for pair in unit["pairs"]]
+        self.assertEqual(len(units), summary["units"])
+        self.assertEqual(len(pairs), summary["pairs"])
+        self.assertEqual(len(set(pairs)), len(pairs))
+        self.assertTrue(all(len({patient_id for patient_id, _ in unit["pairs"]}) <= 3 for unit in units))
+        with self.assertRaises(ValueError):
+            plan_work(queue, PATIENT_DIR, TRIAL_DIR)
+
+    def test_workers_match_single_process_run(self):
+        """
+        Two worker processes sharing the queue produce the same results as one in-process run.
+        """
+        model.configure_llm(FakeChatModel(no_rate=0.1))
+        queue = WorkQueue(self.queue_path)
+        keywords_path = os.path.join(self.temp_dir, 'keywords.json')
+        plan_work(queue, PATIENT_DIR, TRIAL_DIR, patient_batch=3, trial_batch=8, keywords_path=keywords_path)
+        shard_dir = os.path.join(self.temp_dir, 'shards')
+
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=run_fake_worker,
+                                   args=(self.queue_path, shard_dir, keywords_path, f"worker-{index}"))
+                   for index in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=120)
+            self.assertEqual(worker.exitcode, 0)
+
+        self.assertEqual(queue.progress()["done"], queue.progress()["total"])
+        merged_dir = os.path.join(self.temp_dir, 'merged')
+        merge_results(queue, merged_dir)
+
+        expected_dir = os.path.join(self.temp_dir, 'expected')
+        model.process_patients_and_trials(PATIENT_DIR, TRIAL_DIR, expected_dir, keywords_path)
+        self.assertEqual(read_outputs(merged_dir), read_outputs(expected_dir))
+
+    def test_batched_worker(self):
+        """
+        A worker in the batched mode evaluates every unit and writes one shard file per unit.
+        """
+        queue = WorkQueue(self.queue_path)
+        plan = plan_work(queue, PATIENT_DIR, TRIAL_DIR, patient_batch=4, trial_batch=10)
+
+        shard_dir = os.path.join(self.temp_dir, 'shards')
+        summary = run_worker(self.queue_path, PATIENT_DIR, TRIAL_DIR, shard_dir, mode='batched', wait=False,
+                             llm=FakeChatModel(no_rate=0.0))
+        self.assertEqual(summary, {"completed": plan["units"], "failed": 0, "lost": 0})
+        self.assertEqual(len(os.listdir(shard_dir)), plan["units"])
+
+        merged = merge_results(queue, os.path.join(self.temp_dir, 'merged'))
+        self.assertEqual(merged["trials"], plan["pairs"])
+
+    def test_merge_replaces_planned_patient_files(self):
+        """
+        Merging replaces the files of the planned patients, with an empty list for those without results.
+        """
+        queue = WorkQueue(self.queue_path)
+        plan_work(queue, PATIENT_DIR, TRIAL_DIR, patient_batch=4, trial_batch=10)
+        patient_ids = [patient_id for patient_id, _ in model.load_patients(PATIENT_DIR)]
+        self.assertEqual(queue.planned_patients(), [])
+
+        merged_dir = os.path.join(self.temp_dir, 'merged')
+        os.makedirs(merged_dir)
+        stale_path = os.path.join(merged_dir, f"{patient_ids[0]}_eligibility.json")
+        with open(stale_path, 'w') as f:
+            json.dump({"eligibleTrials": [{"trialId": "NCT-STALE"}]}, f)
+
+        run_worker(self.queue_path, PATIENT_DIR, TRIAL_DIR, os.path.join(self.temp_dir, 'shards'), mode='batched',
+                   wait=False, llm=FakeChatModel(no_rate=1.0))
+        self.assertEqual(queue.planned_patients(), patient_ids)
+
+        merged = merge_results(queue, merged_dir)
+        self.assertEqual(merged, {"patients": len(patient_ids), "trials": 0})
+        self.assertEqual(read_outputs(merged_dir),
+                         {f"{patient_id}_eligibility.json": [] for patient_id in patient_ids})
+
+    def test_lost_lease_is_not_counted(self):
+        """
+        A unit whose lease was lost is neither completed nor failed by the worker, and its evaluation stops.
+        """
+        queue = WorkQueue(self.queue_path)
+        plan = plan_work(queue, PATIENT_DIR, TRIAL_DIR, patient_batch=4, trial_batch=10)
+
+        shard_dir = os.path.join(self.temp_dir, 'shards')
+        with patch.object(WorkQueue, 'complete', return_value=False):
+            summary = run_worker(self.queue_path, PATIENT_DIR, TRIAL_DIR, shard_dir, mode='batched', wait=False,
+                                 llm=FakeChatModel(no_rate=0.0), max_units=1)
+        self.assertEqual(summary, {"completed": 0, "failed": 0, "lost": 1})
+
+        unit = queue.lease('worker-b')
+        lease = type('LostLease', (), {'lost': True})()
+        trials_by_id = {trial["trialId"]: trial for trial in model.load_trials(TRIAL_DIR)}
+        with self.assertRaises(LeaseLost):
+            evaluate_unit(unit, PATIENT_DIR, trials_by_id, mode='batched', llm=FakeChatModel(), lease=lease)
+        self.assertEqual(queue.progress()["done"], 0)
+        self.assertGreater(plan["units"], 1)
+
+# Entry point for running the unit tests
+if __name__ == "__main__":
+    unittest.main()